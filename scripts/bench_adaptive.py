@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+"""
+Compares lookups using the default concurrency and shortlist size with
+lookups using the parameters StatsTracker.get_lookup_params suggests, over
+simulated networks of different sizes and loss rates (see
+bench_multilookup.py for the network model).
+
+StatsTracker is given the true network size and loss rate, so this measures
+the parameter choices, not the estimates. Reports, per lookup, the mean time
+taken, the number of 'find' queries sent, and the fraction of the true k
+closest peers found.
+
+Usage: python3 bench_adaptive.py [lookups_per_network]
+"""
+
+from bench_multilookup import SimNetwork
+
+from theseus.constants import k
+from theseus.lookup import AddrLookup
+from theseus.statstracker import StatsTracker
+
+from random import Random
+
+import sys
+
+
+def suggested_params(size, dead_fraction):
+    stats = StatsTracker(None)
+    stats.get_size = lambda: size
+    stats.record_queries(1000, int(1000 * dead_fraction))
+    return stats.get_lookup_params()
+
+
+def run(network, params):
+    elapsed = queries = found = 0
+    live = [peer.entry for peer in network.peers.values() if not peer.dead]
+    AddrLookup._clock = network.clock
+    for target in network.targets:
+        target_int = int.from_bytes(target, "big")
+        best = sorted(live, key=lambda entry: entry.node_addr.addr_int ^ target_int)[:k]
+
+        network.queries = 0
+        started = network.clock.seconds()
+        lookup = AddrLookup(network)
+        lookup.configure(target=target, hedge=False, **params)
+        d, = network.run([lookup.start()])
+        elapsed += network.clock.seconds() - started
+        queries += network.queries
+        found += len(set(best) & set(d.result)) / len(best)
+
+    n = len(network.targets)
+    return elapsed / n, queries / n, found / n
+
+
+def main(lookups=20):
+    for size in (40, 1000, 20000):
+        for dead_percent in (0, 25):
+            params = suggested_params(size, dead_percent / 100)
+            print("{} peers, {}% dead: {}".format(size, dead_percent, params))
+            network = SimNetwork(Random(size), size, lookups, dead_percent / 100, min(size, 20*k))
+            for name, p in (("default", {}), ("adaptive", params)):
+                elapsed, queries, found = run(network, p)
+                print("  {:>9}: {:5.2f} s, {:5.1f} queries, {:4.0%} of closest found".format(name, elapsed, queries, found))
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
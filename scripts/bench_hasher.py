@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+"""
+Measures node addr verification throughput (Argon2id hashes per second) for
+each hasher executor and worker count, plus the old setup: three jobs at a
+time on the reactor's shared threadpool.
+
+While the jobs run, a 10ms LoopingCall checks how late the reactor gets to
+it, which shows how much hashing gets in the way of everything else.
+
+Usage: python3 bench_hasher.py [jobs] [max_workers]
+"""
+
+from twisted.internet.task import react, LoopingCall
+from twisted.internet.defer import gatherResults, inlineCallbacks
+from twisted.internet.threads import deferToThread
+
+from theseus.hasher import Hasher, default_workers
+from theseus.enums import LOW
+
+import os
+import sys
+import time
+
+
+class SharedPoolExecutor:
+    # how hash jobs were run before executors were pluggable
+    workers = 3
+
+    def submit(self, f, *args):
+        return deferToThread(f, *args)
+
+    def stop(self):
+        pass
+
+
+@inlineCallbacks
+def run(reactor, hasher, jobs, salt):
+    lags = []
+    last = [time.perf_counter()]
+
+    def tick():
+        now = time.perf_counter()
+        lags.append(now - last[0] - 0.01)
+        last[0] = now
+
+    ticker = LoopingCall(tick)
+    ticker.start(0.01)
+    started = time.perf_counter()
+    _ = yield gatherResults([hasher.do_hash(i.to_bytes(8, "big"), salt, LOW) for i in range(jobs)])
+    elapsed = time.perf_counter() - started
+    ticker.stop()
+    hasher.executor.stop()
+    return jobs / elapsed, max(lags, default=0)
+
+
+@inlineCallbacks
+def main(reactor, jobs=64, max_workers=8):
+    print("{} jobs, {} cores, default workers: {}".format(jobs, os.cpu_count(), default_workers(Hasher.MEMLIMIT)))
+    configs = [("shared", None)]
+    workers = 1
+    while workers <= max_workers:
+        configs += [("thread", workers), ("process", workers)]
+        workers *= 2
+
+    for n, (name, workers) in enumerate(configs):
+        if name == "shared":
+            hasher = Hasher("thread", 1)
+            hasher.executor = SharedPoolExecutor()
+        else:
+            hasher = Hasher(name, workers)
+        salt = n.to_bytes(16, "big")  # fresh inputs for each run, so nothing's cached
+        rate, lag = yield run(reactor, hasher, jobs, salt)
+        print("{:>8} x{}: {:6.1f} hashes/s, worst reactor lag {:5.1f}ms".format(
+            name, hasher.executor.workers, rate, lag * 1000))
+
+
+if __name__ == "__main__":
+    react(main, [int(arg) for arg in sys.argv[1:]])
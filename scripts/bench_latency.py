@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+"""
+Measures how much preferring low-latency candidates within a distance tier
+speeds up lookups when peers' RTTs vary widely, as in geographically spread
+deployments.
+
+Uses bench_multilookup.py's network model, except that each peer has a fixed
+RTT: a third are nearby (20-50ms), half are further off (100-300ms) and the
+rest are on slow links (1-2s). The local peer learns RTTs from the queries it
+sends, as PeerTracker does, during a warm-up pass over the targets. The
+targets are then looked up again with those RTTs, and once more with them
+hidden from the lookup, which gives the plain distance-ordered behavior. Reports the mean time per lookup, the
+number of 'find' queries sent and the fraction of the true k closest peers
+found.
+
+Usage: python3 bench_latency.py [lookups] [network_size] [dead_percent]
+"""
+
+from bench_multilookup import SimNetwork, SimPeer
+
+from twisted.internet.task import deferLater
+
+from theseus.constants import k
+from theseus.lookup import AddrLookup
+
+from random import Random
+
+import sys
+
+
+class SpreadPeer(SimPeer):
+    def __init__(self, network, entry):
+        super().__init__(network, entry)
+        rng = network.rng
+        tier = rng.random()
+        if tier < 0.3:
+            self.rtt = rng.uniform(0.02, 0.05)
+        elif tier < 0.8:
+            self.rtt = rng.uniform(0.1, 0.3)
+        else:
+            self.rtt = rng.uniform(1, 2)
+
+    def query(self, query_name, args, timeout=None, priority=None):
+        if self.dead:
+            return super().query(query_name, args, timeout, priority)
+        self.network.queries += 1
+        target = int.from_bytes(args['addr'], "big")
+        closest = sorted(self.known, key=lambda entry: entry.node_addr.addr_int ^ target)[:k]
+        response = {b'nodes': [entry.as_bytes() for entry in closest]}
+        return deferLater(self.network.clock, self.rtt * self.network.rng.uniform(0.9, 1.1), self._answer, response)
+
+    def _answer(self, response):
+        self.network.measured[self.entry.contact_info] = self.rtt
+        return response
+
+
+class LearningTracker:
+    def __init__(self, network):
+        self.network = network
+        self.enabled = True
+
+    def is_reachable(self, contact):
+        return True
+
+    def is_dead(self, contact):
+        return False
+
+    def get_rtt(self, contact):
+        return self.network.measured.get(contact) if self.enabled else None
+
+
+class SpreadNetwork(SimNetwork):
+    peer_class = SpreadPeer
+
+    def __init__(self, *args):
+        self.measured = {}
+        super().__init__(*args)
+        self.peer_tracker = LearningTracker(self)
+
+
+def run(network, use_rtts):
+    network.peer_tracker.enabled = use_rtts
+    AddrLookup._clock = network.clock
+    live = [peer.entry for peer in network.peers.values() if not peer.dead]
+    elapsed = queries = found = 0
+    for target in network.targets:
+        target_int = int.from_bytes(target, "big")
+        best = sorted(live, key=lambda entry: entry.node_addr.addr_int ^ target_int)[:k]
+
+        network.queries = 0
+        started = network.clock.seconds()
+        lookup = AddrLookup(network)
+        lookup.configure(target=target, hedge=False)
+        d, = network.run([lookup.start()])
+        elapsed += network.clock.seconds() - started
+        queries += network.queries
+        found += len(set(best) & set(d.result)) / len(best)
+
+    n = len(network.targets)
+    return elapsed / n, queries / n, found / n
+
+
+def main(lookups=100, size=5000, dead_percent=10):
+    network = SpreadNetwork(Random(size), size, lookups, dead_percent / 100, min(size, 20*k))
+    run(network, True)  # warm-up
+    print("{} lookups, {} peers ({}% dead)".format(lookups, size, dead_percent))
+    for name, use_rtts in (("latency", True), ("distance", False)):
+        elapsed, queries, found = run(network, use_rtts)
+        print("  {:>9}: {:5.2f} s, {:5.1f} queries, {:4.0%} of closest found".format(name, elapsed, queries, found))
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+"""
+Measures peak memory use for a large routing table plus the kind of working
+sets a lookup builds (sets of routing entries, dicts keyed by contact info).
+
+Entries are parsed from their wire form, the same way lookups parse 'find'
+responses, so that every entry gets its own ContactInfo and NodeAddress.
+
+Usage: python3 bench_memory.py [num_entries]
+"""
+
+from theseus.nodeaddr import NodeAddress
+from theseus.routing import RoutingEntry, FlatRoutingTable
+
+from random import Random
+
+import sys
+import time
+import tracemalloc
+
+
+NUM_LOCAL_ADDRS = 5
+
+
+def make_wire_entries(rng, n):
+    ts = int(time.time()).to_bytes(4, "big")
+    return [ts + rng.getrandbits(32).to_bytes(4, "big") + rng.getrandbits(48).to_bytes(6, "big")
+            + rng.getrandbits(160).to_bytes(20, "big")
+            + (1024 + i % 60000).to_bytes(2, "big")
+            + rng.getrandbits(256).to_bytes(32, "big")
+            for i in range(n)]
+
+
+def main(n=10**5):
+    rng = Random(1)
+    local_addrs = [NodeAddress(rng.getrandbits(160).to_bytes(20, 'big'), None) for _ in range(NUM_LOCAL_ADDRS)]
+    wire_entries = make_wire_entries(rng, n)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    entries = [RoutingEntry.from_bytes(b, trusted=True).result for b in wire_entries]
+
+    table = FlatRoutingTable(local_addrs)
+    table.k = max(8, n // 256)
+    table._reset()  # so the root bucket picks up the new k
+    for entry in entries:
+        table.insert(entry.contact_info, entry.node_addr)
+    table_size, _ = tracemalloc.get_traced_memory()
+
+    # lookup-style working sets
+    entry_set = set(entries)
+    candidates = {entry.contact_info: entry.node_addr for entry in entries}
+    seen_set = set(candidates)
+
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print("entries:          {}".format(n))
+    print("stored in table:  {}".format(len(table.get_contents())))
+    print("table + entries:  {:.1f} MB".format(table_size / 2**20))
+    print("peak:             {:.1f} MB".format(peak / 2**20))
+    print("time:             {:.2f} s".format(elapsed))
+    assert len(entry_set) == len(seen_set) == n
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
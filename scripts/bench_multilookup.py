@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+"""
+Compares the traffic of looking up several targets at once, as PeerService
+does when its local addrs are regenerated, with separate AddrLookups versus a
+single MultiAddrLookup.
+
+The network is simulated: each remote peer knows its own closest neighbors
+plus a random sample of the rest, and answers 'find' queries after a random
+delay. A fraction of peers are dead, and their queries time out. Reports the
+total number of 'find' queries sent, the number of distinct peers contacted
+(i.e. cnxns needed) and the time until every lookup is done.
+
+Usage: python3 bench_multilookup.py [num_targets] [network_size] [trials] [dead_percent]
+"""
+
+from twisted.internet.task import Clock, deferLater
+
+from theseus.constants import k
+from theseus.errors import QueryRetriesExceededError
+from theseus.lookup import AddrLookup, MultiAddrLookup
+from theseus.routing import RoutingEntry, FlatRoutingTable
+from theseus.nodeaddr import NodeAddress
+
+from random import Random
+
+import sys
+import time
+
+
+class SimPeer:
+    def __init__(self, network, entry):
+        self.network = network
+        self.entry = entry
+        self.known = []
+        self.dead = False
+
+    def query(self, query_name, args, timeout=None, priority=None):
+        self.network.queries += 1
+        self.network.contacted.add(self.entry.contact_info)
+        if self.dead:
+            return deferLater(self.network.clock, 2, self._time_out)
+        target = int.from_bytes(args['addr'], "big")
+        closest = sorted(self.known, key=lambda entry: entry.node_addr.addr_int ^ target)[:k]
+        response = {b'nodes': [entry.as_bytes() for entry in closest]}
+        return deferLater(self.network.clock, self.network.rng.uniform(0.05, 0.5), lambda: response)
+
+    @staticmethod
+    def _time_out():
+        raise QueryRetriesExceededError()
+
+    def get_hedge_delay(self):
+        return 1
+
+
+class SimPeerTracker:
+    def is_reachable(self, contact):
+        return True
+
+    def is_dead(self, contact):
+        return False
+
+
+class SimNetwork:
+    blacklist = ()
+    peer_class = SimPeer
+    peer_tracker = SimPeerTracker()
+
+    def __init__(self, rng, size, num_targets, dead_fraction, table_size):
+        self.rng = rng
+        self.clock = Clock()
+        self.queries = 0
+        self.contacted = set()
+
+        ts = int(time.time()).to_bytes(4, "big")
+        entries = RoutingEntry.parse_nodes([
+            ts + bytes([127, 0, 0, 1]) + rng.getrandbits(48).to_bytes(6, "big")
+            + rng.getrandbits(160).to_bytes(20, "big")
+            + (1024 + i).to_bytes(2, "big")
+            + rng.getrandbits(256).to_bytes(32, "big")
+            for i in range(size)])
+        self.peers = {entry.contact_info: self.peer_class(self, entry) for entry in entries}
+
+        by_addr = sorted(entries, key=lambda entry: entry.node_addr.addr_int)
+        for i, entry in enumerate(by_addr):
+            neighbors = by_addr[max(0, i - k):i] + by_addr[i + 1:i + 1 + k]
+            self.peers[entry.contact_info].known = neighbors + rng.sample(entries, 4*k)
+            self.peers[entry.contact_info].dead = rng.random() < dead_fraction
+
+        self.peer_key = type("Key", (), {"public_bytes": bytes(32)})()
+        self.targets = [rng.getrandbits(160).to_bytes(20, "big") for _ in range(num_targets)]
+        self.routing_table = FlatRoutingTable([NodeAddress(target, None) for target in self.targets])
+        for entry in rng.sample(entries, table_size):
+            self.routing_table.insert(entry.contact_info, entry.node_addr)
+
+    def get_peer(self, contact):
+        return self.peers[contact]
+
+    def run(self, deferreds):
+        while not all(d.called for d in deferreds):
+            self.clock.advance(0.05)
+        return deferreds
+
+
+def separate(network):
+    lookups = []
+    for target in network.targets:
+        lookup = AddrLookup(network)
+        lookup.configure(target=target, hedge=False)
+        lookups.append(lookup)
+    network.run([lookup.start() for lookup in lookups])
+
+
+def batched(network):
+    multi = MultiAddrLookup(network)
+    multi.configure(targets=network.targets, hedge=False)
+    network.run(multi.start())
+
+
+def main(num_targets=5, size=5000, trials=5, dead_percent=10, table_size=160):
+    totals = {}
+    for trial in range(trials):
+        for name, run in (("separate", separate), ("batched", batched)):
+            network = SimNetwork(Random(trial), size, num_targets, dead_percent / 100, table_size)
+            AddrLookup._clock = network.clock
+            run(network)
+            queries, contacted, elapsed = totals.get(name, (0, 0, 0))
+            totals[name] = (queries + network.queries, contacted + len(network.contacted), elapsed + network.clock.seconds())
+
+    print("{} targets, {} peers ({}% dead), {} trials".format(num_targets, size, dead_percent, trials))
+    for name, (queries, contacted, elapsed) in totals.items():
+        print("{:>9}: {:6.1f} queries, {:6.1f} peers contacted, {:5.2f} s".format(
+            name, queries / trials, contacted / trials, elapsed / trials))
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
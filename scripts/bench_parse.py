@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+"""
+Compares the cost of turning a k=8 'find' response's node list into routing
+entries via per-entry Deferreds (RoutingEntry.from_bytes, gathered with a
+DeferredList) and via the synchronous batch parser (RoutingEntry.parse_nodes).
+
+Usage: python3 bench_parse.py [num_responses]
+"""
+
+from twisted.internet.defer import DeferredList
+
+from theseus.constants import k
+from theseus.routing import RoutingEntry
+
+from os import urandom
+
+import sys
+import time
+import timeit
+
+
+def make_nodes(n):
+    ts = int(time.time()).to_bytes(4, "big")
+    return [ts + urandom(30) + (1024 + i).to_bytes(2, "big") + urandom(32) for i in range(n)]
+
+
+def main(n=20000):
+    nodes = make_nodes(k)
+
+    def deferreds():
+        DeferredList([RoutingEntry.from_bytes(b, trusted=True) for b in nodes])
+
+    def batch():
+        RoutingEntry.parse_nodes(nodes)
+
+    for name, fn in (("deferreds", deferreds), ("parse_nodes", batch)):
+        elapsed = timeit.timeit(fn, number=n)
+        print("{:>12}: {:8.2f} us/response".format(name, elapsed / n * 1e6))
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
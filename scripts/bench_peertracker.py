@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+"""
+Measures PeerTracker memory usage for a large number of seen peers, before and
+after idle PeerStates are demoted to PeerRecords.
+
+Usage: python3 bench_peertracker.py [num_peers]
+"""
+
+from twisted.internet.task import Clock
+
+from theseus.contactinfo import ContactInfo
+from theseus.peertracker import PeerState, PeerTracker
+from theseus.routing import RoutingTable
+
+from os import urandom
+from unittest.mock import Mock
+
+import gc
+import sys
+import tracemalloc
+
+
+def mib(n):
+    return "{:.1f} MiB".format(n / 2**20)
+
+
+def main(num_peers=100000):
+    clock = Clock()
+    PeerState._clock = clock
+    PeerTracker._clock = clock
+
+    local_peer = Mock()
+    local_peer.routing_table = RoutingTable()
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+
+    tracker = PeerTracker(local_peer)
+    for i in range(num_peers):
+        host = "10.{}.{}.{}".format((i >> 16) & 0xFF, (i >> 8) & 0xFF, i & 0xFF)
+        tracker.register_contact(ContactInfo(host, 1024 + i % 60000, urandom(32)))
+
+    gc.collect()
+    full = tracemalloc.get_traced_memory()[0] - baseline
+    print("{n} peers as PeerStates:  {m} ({b:.0f} bytes/peer)".format(n=num_peers, m=mib(full), b=full/num_peers))
+
+    clock.advance(PeerTracker.demote_after)
+    tracker.sweep()
+    gc.collect()
+    compact = tracemalloc.get_traced_memory()[0] - baseline
+    print("{n} peers as PeerRecords: {m} ({b:.0f} bytes/peer)".format(n=num_peers, m=mib(compact), b=compact/num_peers))
+
+    clock.advance(PeerTracker.expire_after)
+    tracker.sweep()
+    gc.collect()
+    expired = tracemalloc.get_traced_memory()[0] - baseline
+    print("After idle expiry:          {m}".format(m=mib(expired)))
+
+    tracker.stop()
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+"""
+Compares insert and k-closest query throughput for the tree-based RoutingTable
+and the FlatRoutingTable at several table sizes.
+
+Bucket size is scaled with the table size so that most inserted entries are
+actually stored; with the default k=8 and a handful of local addrs, a table
+only ever holds a few hundred entries however many inserts are attempted.
+
+Usage: python3 bench_routing.py [sizes...]
+"""
+
+from theseus.contactinfo import ContactInfo
+from theseus.nodeaddr import NodeAddress
+from theseus.routing import RoutingTable, FlatRoutingTable
+
+from random import Random
+
+import sys
+import time
+
+
+NUM_LOCAL_ADDRS = 5
+NUM_QUERIES = 2000
+
+
+def make_entries(rng, n):
+    key = bytes(32)
+    return [(ContactInfo('127.0.0.1', 1024 + i % 60000, key), NodeAddress(rng.getrandbits(160).to_bytes(20, 'big'), None))
+            for i in range(n)]
+
+
+def bench(table_class, k, local_addrs, entries, targets):
+    table = table_class(local_addrs)
+    table.k = k
+    table._reset()  # so the root bucket picks up the new k
+
+    start = time.perf_counter()
+    for contact, addr in entries:
+        table.insert(contact, addr)
+    insert_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for target in targets:
+        table.query(target, 8)
+    query_time = time.perf_counter() - start
+
+    return len(table.get_contents()), insert_time, query_time
+
+
+def main(*sizes):
+    rng = Random(1)
+    local_addrs = [NodeAddress(rng.getrandbits(160).to_bytes(20, 'big'), None) for _ in range(NUM_LOCAL_ADDRS)]
+    targets = [rng.getrandbits(160).to_bytes(20, 'big') for _ in range(NUM_QUERIES)]
+
+    print("{:>8} {:>6} {:>6} {:>8} {:>14} {:>14}".format("entries", "k", "engine", "stored", "insert (us/op)", "query (us/op)"))
+    for n in sizes or (10**3, 10**4, 10**5):
+        k = max(8, n // 256)
+        entries = make_entries(rng, n)
+        for name, table_class in (("tree", RoutingTable), ("flat", FlatRoutingTable)):
+            stored, insert_time, query_time = bench(table_class, k, local_addrs, entries, targets)
+            print("{:>8} {:>6} {:>6} {:>8} {:>14.2f} {:>14.2f}".format(
+                n, k, name, stored, insert_time / n * 1e6, query_time / NUM_QUERIES * 1e6))
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -1,10 +1,13 @@
 from twisted.application.service import Application
 
+from theseus.config import config
 from theseus.peer import PeerService
 
 
 application = Application("theseus_dht")
 
-peer = PeerService()
+# the snapshot is opt-in, since it's one file per config dir: peers sharing a
+# config dir would otherwise all come back with the same key
+peer = PeerService(snapshot_file=config.snapshot_file if config["use_snapshot"] else None)
 peer.setName("peer")
 peer.setServiceParent(application)
@@ -0,0 +1,109 @@
+from twisted.internet import reactor
+from twisted.logger import Logger
+
+from heapq import heappush, heappop
+from socket import inet_aton
+
+import ipaddress
+
+
+class Blacklist:
+    """
+    Set of blacklisted IPv4 hosts and networks. Entries may be given as host
+    strings, CIDR strings, ipaddress objects, or anything with a `host`
+    attribute (e.g. ContactInfo or Twisted's IPv4Address).
+
+    Entries are bucketed by prefix length, so a membership check costs one
+    dict lookup per distinct prefix length in use. Every entry expires after
+    its duration has passed; the oldest-expiring entries are evicted first if
+    the blacklist grows past max_size.
+    """
+
+    log = Logger()
+
+    max_size = 500
+    default_duration = 24*60*60  # seconds
+
+    _clock = reactor
+
+    def __init__(self, max_size=None, default_duration=None):
+        self.max_size = max_size or self.max_size
+        self.default_duration = default_duration or self.default_duration
+
+        self.networks = {}  # prefixlen -> {network int: expiry time}
+        self.expiries = []  # heap of (expiry time, prefixlen, network int)
+
+    def __len__(self):
+        return sum(len(nets) for nets in self.networks.values())
+
+    def __contains__(self, host):
+        if not self.networks:
+            return False
+
+        addr = self._host_to_int(host)
+        now = self._clock.seconds()
+        for prefixlen, nets in self.networks.items():
+            expires_at = nets.get(addr >> (32 - prefixlen))
+            if expires_at is not None and expires_at > now:
+                return True
+        return False
+
+    def add(self, host, duration=None):
+        """
+        Blacklists the given host or network for `duration` seconds (pass
+        float('inf') to blacklist it permanently). Re-adding an entry extends
+        its expiry time, but never shortens it.
+        """
+        network = self._to_network(host)
+        key = int(network.network_address) >> (32 - network.prefixlen)
+        expires_at = self._clock.seconds() + (self.default_duration if duration is None else duration)
+
+        nets = self.networks.setdefault(network.prefixlen, {})
+        if nets.get(key, 0) >= expires_at:
+            return
+        nets[key] = expires_at
+        heappush(self.expiries, (expires_at, network.prefixlen, key))
+
+        self.prune()
+        while len(self) > self.max_size:
+            self._pop()
+
+    def remove(self, host):
+        network = self._to_network(host)
+        key = int(network.network_address) >> (32 - network.prefixlen)
+        nets = self.networks.get(network.prefixlen, {})
+        nets.pop(key, None)
+        if not nets:
+            self.networks.pop(network.prefixlen, None)
+        # the stale heap entry is skipped when it comes up
+
+    def prune(self):
+        """
+        Drops expired entries.
+        """
+        now = self._clock.seconds()
+        while self.expiries and self.expiries[0][0] <= now:
+            self._pop()
+
+    def _pop(self):
+        expires_at, prefixlen, key = heappop(self.expiries)
+        nets = self.networks.get(prefixlen)
+        if nets is None or nets.get(key) != expires_at:
+            return  # stale entry
+        del nets[key]
+        if not nets:
+            del self.networks[prefixlen]
+
+    @staticmethod
+    def _host_to_int(host):
+        host = getattr(host, "host", host)
+        if type(host) is str:
+            return int.from_bytes(inet_aton(host), "big")
+        return int(host)
+
+    @staticmethod
+    def _to_network(host):
+        network = ipaddress.ip_network(getattr(host, "host", host), strict=False)
+        if network.version != 4:
+            raise ValueError("Only IPv4 blacklisting is supported")
+        return network
@@ -27,10 +27,14 @@ class Config:
     theseus_dir = os.path.expanduser(os.getenv("THESEUSHOME", "~/.theseus/"))
     config_file = os.path.join(theseus_dir, "theseus_config")
     data_file = os.path.join(theseus_dir, "data_store")
+    snapshot_file = os.path.join(theseus_dir, "routing_snapshot")
 
     config_defaults = {
         "config_version": "1",
         "protocol_version": "0",
+        "use_snapshot": False,  # keep the peer key and routing table in snapshot_file across restarts
+        "hasher_executor": "thread",  # or "process"
+        "hasher_workers": None,  # None: one per core, memory permitting
         "listen_port_range": [1025, 65535],
         "ports_to_avoid": [
             1027, 1080, 1093, 1094, 1099, 1109, 1127, 1178, 1194, 1210, 1214,
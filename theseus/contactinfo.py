@@ -4,38 +4,49 @@ from noise.functions import KeyPair25519
 
 
 class ContactInfo:
+    # lookups and routing tables create these by the thousand, so they're
+    # slotted, hash their fields once, and hold on to raw public key bytes
+    # until something (e.g. a Noise handshake) actually needs a key object
+    __slots__ = ("host", "port", "key_bytes", "_key", "_hash")
+
     def __init__(self, host, port, key):
         # host: str, currently expected to be IPv4 in dotted form
 
-        # currently, key: KeyPair25519.from_public_bytes
+        # key: either raw public key bytes or a KeyPair25519. either way, the
+        # `key` property gives a key object and `key_bytes` gives raw bytes.
         # in future, key: noise.functions._KeyPair subclass  (hopefully)
 
-        # (key is not bytes because we don't want higher levels of abstraction
-        # absorbing the complexity of having to know what public key algorithm
-        # is in use -- _KeyPair can abstract this information away & provide a
-        # consistent interface)
-
-        if type(key) is bytes:
-            key = KeyPair25519.from_public_bytes(key)
+        # (the `key` property exposes a _KeyPair rather than bytes because we
+        # don't want higher levels of abstraction absorbing the complexity of
+        # having to know what public key algorithm is in use -- _KeyPair can
+        # abstract this information away & provide a consistent interface)
 
         if not 1024 <= port <= 65535:
-            raise Exception("Bad port")
+            raise ValueError("Bad port")
 
         self.host = host
         self.port = port
-        self.key = key
+        if type(key) is bytes:
+            self.key_bytes, self._key = key, None
+        else:
+            self.key_bytes, self._key = key.public_bytes, key
+        self._hash = hash((host, port, self.key_bytes))
 
-    def __key(self):
-        return (self.host, self.port, self.key.public_bytes)
+    @property
+    def key(self):
+        if self._key is None:
+            self._key = KeyPair25519.from_public_bytes(self.key_bytes)
+        return self._key
 
     def __hash__(self):
-        return hash(self.__key())
+        return self._hash
 
     def __eq__(self, other):
-        return isinstance(other, self.__class__) and self.__key() == other.__key()
+        return isinstance(other, self.__class__) and self._hash == other._hash \
+                and self.key_bytes == other.key_bytes and self.port == other.port and self.host == other.host
 
     def __repr__(self):
-        return "ContactInfo({}, {}, {})".format(*self.__key())
+        return "ContactInfo({}, {}, {})".format(self.host, self.port, self.key_bytes)
 
     def get_addr(self):
         return IPv4Address("TCP", self.host, self.port)
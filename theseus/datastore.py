@@ -7,6 +7,7 @@ from heapq import heappush, heappop
 from time import time
 
 from .constants import L
+from .distance import to_int
 
 
 class DataStore:
@@ -23,6 +24,7 @@ class DataStore:
         self.log.info("Initializing data store for {a}", a=None if local_addr is None else local_addr.hex())
 
         self.local_addr = local_addr
+        self.local_addr_int = None if local_addr is None else to_int(local_addr)
         self.memlimit = memlimit or self.memlimit
         self.default_duration = default_duration or self.default_duration
 
@@ -33,12 +35,7 @@ class DataStore:
     def _get_distance(self, addr):
         if self.local_addr is None:
             return 0
-
-        n = 0
-        for i, byte in enumerate(self.local_addr):
-            n <<= 8
-            n += byte ^ self.local_addr[i]
-        return n
+        return to_int(addr) ^ self.local_addr_int
 
     def _choose_duration(self, addr, sizeof):
         if self.running_total + sizeof >= self.memlimit:
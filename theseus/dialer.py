@@ -0,0 +1,65 @@
+from twisted.internet.defer import Deferred, succeed
+from twisted.logger import Logger
+
+from heapq import heappush, heappop
+import itertools
+
+from .enums import INTERACTIVE
+
+
+class DialScheduler:
+    """
+    Caps the number of outbound connection attempts in progress at any one
+    time. Attempts beyond the cap wait in a priority queue, so interactive
+    lookups get to dial before maintenance and speculative traffic.
+    """
+
+    log = Logger()
+
+    max_dials = 8
+
+    def __init__(self, max_dials=None):
+        self.max_dials = max_dials or self.max_dials
+        self.active = 0
+        self.queue = []
+        self._counter = itertools.count()
+
+    def acquire(self, priority=INTERACTIVE):
+        """
+        Returns a Deferred which fires once a dial slot is free. Whoever holds
+        the slot must call `release` when their cnxn attempt concludes.
+        Cancelling the Deferred before it fires gives up its place in line.
+        """
+        self._trim()
+        if self.active < self.max_dials and not self.queue:
+            self.active += 1
+            return succeed(None)
+
+        self.log.debug("Dial slots exhausted ({n} active); queueing priority {p} dial", n=self.active, p=priority.name)
+        d = Deferred()
+        heappush(self.queue, (priority, next(self._counter), d))
+        return d
+
+    def reprioritize(self, d, priority):
+        """
+        Moves a queued dial to a new (presumably higher) priority. The stale
+        queue entry is skipped when it comes up.
+        """
+        if not d.called:
+            heappush(self.queue, (priority, next(self._counter), d))
+
+    def release(self):
+        self.active -= 1
+        self._trim()
+        while self.queue and self.active < self.max_dials:
+            d = heappop(self.queue)[2]
+            if d.called:
+                continue
+            self.active += 1
+            d.callback(None)
+            self._trim()
+
+    def _trim(self):
+        # drop cancelled or already-dispatched entries from the front of the queue
+        while self.queue and self.queue[0][2].called:
+            heappop(self.queue)
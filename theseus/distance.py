@@ -0,0 +1,36 @@
+"""
+Helpers for the XOR distance metric on node addresses.
+
+Addresses are compared as plain ints. NodeAddress caches its address's int
+form at construction (as `addr_int`), so hot paths like routing table queries
+and lookup candidate ranking never need to re-parse address bytes.
+"""
+
+from .constants import L
+
+
+def to_int(addr):
+    """
+    Converts a big-endian address bytestring to an int.
+    """
+    return int.from_bytes(addr, "big")
+
+
+def distance(addr1, addr2):
+    """
+    Returns the XOR distance between two addresses, each given as either an
+    int or a NodeAddress.
+    """
+    return _as_int(addr1) ^ _as_int(addr2)
+
+
+def shared_prefix_len(addr1, addr2, bits=L):
+    """
+    Returns the number of leading bits two `bits`-bit addresses (given as
+    ints or NodeAddresses) have in common.
+    """
+    return bits - distance(addr1, addr2).bit_length()
+
+
+def _as_int(addr):
+    return addr if type(addr) is int else addr.addr_int
@@ -22,6 +22,14 @@ DISCONNECTED, CONNECTING, CONNECTED = (PeerCnxnStates.DISCONNECTED,
         PeerCnxnStates.CONNECTING, PeerCnxnStates.CONNECTED)
 
 
+# CircuitStates track whether a remote peer is believed to be reachable. A
+# peer's circuit opens after repeated connection failures, and half-opens once
+# its backoff period has elapsed so that a single trial connection can be made.
+CircuitStates = Enum("CircuitStates", "CLOSED OPEN HALF_OPEN")
+CLOSED, OPEN, HALF_OPEN = (CircuitStates.CLOSED, CircuitStates.OPEN,
+        CircuitStates.HALF_OPEN)
+
+
 # DHTInfoKeys enum members have their associated ASCII key bytes as values
 class DHTInfoKeys(Enum):
     MAX_VERSION = b'max_version'
@@ -41,3 +49,10 @@ IDCheckPriorities = IntEnum("IDCheckPriorities", "CRITICAL HIGH MEDIUM LOW UNSET
 CRITICAL, HIGH, MEDIUM, LOW, UNSET = (IDCheckPriorities.CRITICAL,
         IDCheckPriorities.HIGH, IDCheckPriorities.MEDIUM,
         IDCheckPriorities.LOW, IDCheckPriorities.UNSET)
+
+
+# DialPriorities order outbound cnxn attempts waiting on the DialScheduler.
+# Like IDCheckPriorities, lower values are higher priority.
+DialPriorities = IntEnum("DialPriorities", "INTERACTIVE MAINTENANCE SPECULATIVE")
+INTERACTIVE, MAINTENANCE, SPECULATIVE = (DialPriorities.INTERACTIVE,
+        DialPriorities.MAINTENANCE, DialPriorities.SPECULATIVE)
@@ -96,6 +96,10 @@ class TheseusConnectionError(TheseusInternalError):
     pass
 
 
+class PeerUnreachableError(TheseusConnectionError):
+    pass
+
+
 class QueryRetriesExceededError(TheseusInternalError):
     pass
 
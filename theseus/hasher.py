@@ -1,16 +1,130 @@
+from twisted.internet import reactor
 from twisted.internet.defer import Deferred, inlineCallbacks, succeed, DeferredList
-from twisted.internet.threads import deferToThread
+from twisted.internet.threads import deferToThreadPool
 from twisted.logger import Logger
+from twisted.python.failure import Failure
+from twisted.python.threadpool import ThreadPool
 
 from nacl.pwhash import argon2id
 
-from functools import lru_cache
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from queue import PriorityQueue
+from threading import Thread
 import itertools
+import os
 
+from .config import config
 from .enums import UNSET
 
 
+def _kdf(message, salt, opslimit, memlimit):
+    # module-level so that it can be pickled for worker processes
+    return argon2id.kdf(20, message, salt, opslimit, memlimit)
+
+
+def _available_memory():
+    # in bytes, or None if we can't tell
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def default_workers(memlimit):
+    """
+    One worker per core, or fewer if there isn't enough free memory for each
+    of them to be running a job needing memlimit bytes.
+    """
+    workers = os.cpu_count() or 1
+    memory = _available_memory()
+    if memory is not None:
+        workers = min(workers, memory // memlimit)
+    return max(1, workers)
+
+
+class ThreadExecutor:
+    """
+    Runs hash jobs on a thread pool of their own, so that they neither hold
+    up nor get held up by anything else using the reactor's shared pool (e.g.
+    name resolution). Argon2 releases the GIL while it works, so the threads
+    do hash in parallel.
+    """
+
+    _reactor = reactor
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.pool = None
+
+    def submit(self, f, *args):
+        if self.pool is None:
+            self.pool = ThreadPool(0, self.workers, "hasher")
+            self.pool.start()
+            self._reactor.addSystemEventTrigger("during", "shutdown", self.stop)
+        return deferToThreadPool(self._reactor, self.pool, f, *args)
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.stop()
+            self.pool = None
+
+
+class ProcessExecutor:
+    """
+    Runs hash jobs in worker processes, which isolates their memory use (and
+    any crashes) from the reactor's process at the cost of pickling each
+    job's inputs and outputs.
+    """
+
+    _reactor = reactor
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.pool = None
+        self.futures = set()  # jobs submitted and not yet reported back
+
+    def submit(self, f, *args):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.workers)
+            self._reactor.addSystemEventTrigger("during", "shutdown", self.stop)
+        d = Deferred()
+        future = self.pool.submit(f, *args)
+        self.futures.add(future)
+        future.add_done_callback(lambda future: self._reactor.callFromThread(self._fire, d, future))
+        return d
+
+    def _fire(self, d, future):
+        self.futures.discard(future)
+        try:
+            result = future.result()
+        except Exception:
+            d.errback(Failure())
+        else:
+            d.callback(result)
+
+    def stop(self):
+        # queued jobs are cancelled, which fails their Deferreds. running jobs
+        # are waited on in a thread of its own, so as not to block the
+        # reactor. (not shutdown(wait=False): before 3.8 that can leave the
+        # workers running, which hangs the interpreter on exit)
+        if self.pool is not None:
+            for future in list(self.futures):
+                future.cancel()
+            Thread(target=self.pool.shutdown, name="hasher shutdown").start()
+            self.pool = None
+
+
+executors = {"thread": ThreadExecutor, "process": ProcessExecutor}
+
+
 class Hasher:
     log = Logger()
 
@@ -20,16 +134,23 @@ class Hasher:
     OPSLIMIT = argon2id.OPSLIMIT_INTERACTIVE
     MEMLIMIT = argon2id.MEMLIMIT_INTERACTIVE
 
-    MAX_THREADS = 3  # TODO should these be worker processes instead? does the GIL keep these threads from actually being useful?
     LRU_CACHE_SIZE = 500
 
-    def __init__(self):
+    def __init__(self, executor="thread", workers=None):
+        # executor: a key of executors. workers: max concurrent hash jobs
+        # (None to pick a number suited to this machine)
+        self.executor = executors[executor](workers or default_workers(self.MEMLIMIT))
         self.queue = PriorityQueue()
         self.callbacks = {}
+        self.cache = OrderedDict()  # (message, salt) -> image, least recently used first
         self.active_jobs = 0
 
     def do_hash(self, message, salt, priority=UNSET):
         inputs = (message, salt)
+        if inputs in self.cache:
+            self.cache.move_to_end(inputs)
+            return succeed(self.cache[inputs])
+
         self.log.debug("Adding priority {priority} hash job for {m},{s}", priority=priority.name, m=message.hex(), s=salt.hex())
         self.queue.put((priority, inputs))
         d = Deferred()
@@ -39,24 +160,35 @@ class Hasher:
 
     @inlineCallbacks
     def _update_jobs(self):
+        # jobs are handed to the executor no faster than it has workers free
+        # to run them, so they always start in order of priority
         try:
-            if self.queue.empty() or self.active_jobs == self.MAX_THREADS:
+            if self.queue.empty() or self.active_jobs >= self.executor.workers:
                 return
 
             job = self.queue.get()
             while job[1] not in self.callbacks:
+                if self.queue.empty():
+                    return
                 job = self.queue.get()
             self.active_jobs += 1
 
             inputs = job[1]
-            image = yield deferToThread(self._kdf, *inputs)
-
-            self.log.debug("Priority {priority} hash job complete. {m},{s} -> {i}", priority=job[0].name, m=inputs[0].hex(), s=inputs[1].hex(), i=image.hex())
-            for d in self.callbacks.pop(job[1], []):
-                try:
-                    d.callback(image)
-                except Exception:
-                    self.log.failure("Error in hash job callback")
+            try:
+                image = yield self.executor.submit(_kdf, *inputs, self.OPSLIMIT, self.MEMLIMIT)
+            except Exception:
+                failure = Failure()
+                self.log.failure("Priority {priority} hash job failed", failure, priority=job[0].name)
+                for d in self.callbacks.pop(inputs, []):
+                    d.errback(failure)
+            else:
+                self.log.debug("Priority {priority} hash job complete. {m},{s} -> {i}", priority=job[0].name, m=inputs[0].hex(), s=inputs[1].hex(), i=image.hex())
+                self._remember(inputs, image)
+                for d in self.callbacks.pop(inputs, []):
+                    try:
+                        d.callback(image)
+                    except Exception:
+                        self.log.failure("Error in hash job callback")
             self.active_jobs -= 1
             self._update_jobs()
 
@@ -64,10 +196,17 @@ class Hasher:
             self.log.failure("Unexpected error in hasher")
             raise e
 
-    @staticmethod
-    @lru_cache(maxsize=LRU_CACHE_SIZE)
-    def _kdf(message, salt):
-        return argon2id.kdf(20, message, salt, Hasher.OPSLIMIT, Hasher.MEMLIMIT)
+    def _remember(self, inputs, image):
+        self.cache[inputs] = image
+        if len(self.cache) > self.LRU_CACHE_SIZE:
+            self.cache.popitem(last=False)
+
+    def is_busy(self, priority):
+        """
+        Returns True if any hash job more urgent than the given priority is
+        waiting to run.
+        """
+        return any(queued < priority and inputs in self.callbacks for queued, inputs in self.queue.queue)
 
     def exhaust(self):
         if len(self.callbacks) == 0:
@@ -79,4 +218,4 @@ class Hasher:
         return d
 
 
-hasher = Hasher()
+hasher = Hasher(config["hasher_executor"], config["hasher_workers"])
@@ -9,6 +9,7 @@ from .bencode import bencode, bdecode
 from .errors import PluginError, BencodeError, TheseusProtocolError, errcodes
 from .errors import KRPCError, Error100, Error101, Error102, Error103, Error300
 
+from collections import OrderedDict
 from os import urandom
 
 
@@ -18,6 +19,7 @@ from os import urandom
 class KRPCProtocol(NetstringReceiver):
     log = Logger()
     max_name_size = 32
+    max_abandoned_queries = 64
     _peer = None
 
     def __init__(self, *args, **kwargs):
@@ -27,6 +29,7 @@ class KRPCProtocol(NetstringReceiver):
         self.response_handlers = {}
 
         self.open_queries = {}
+        self.abandoned_queries = OrderedDict()  # txn ids of cancelled queries -> None, oldest first
         #self.deferred_responses = {}
 
         for provider in getPlugins(IKRPC):
@@ -54,6 +57,7 @@ class KRPCProtocol(NetstringReceiver):
 
         while self.open_queries:
             self.open_queries.popitem()[1].errback(reason)
+        self.abandoned_queries.clear()
 
     def stringReceived(self, string):
         try:
@@ -88,7 +92,11 @@ class KRPCProtocol(NetstringReceiver):
             args = krpc.get(b'r')
             deferred = self.open_queries.pop(txn_id, None)
 
-            if deferred is None or args is None:
+            if deferred is None and txn_id in self.abandoned_queries:
+                # a late response to a query we've given up on
+                del self.abandoned_queries[txn_id]
+                KRPCProtocol.log.debug("{peer} - Ignoring response to cancelled query (txn {txn})", peer=self._peer, txn=txn_id.hex())
+            elif deferred is None or args is None:
                 # probably best to give this node a healthy bit of distance
                 self.transport.loseConnection()
                 if deferred:
@@ -115,6 +123,8 @@ class KRPCProtocol(NetstringReceiver):
                 self.open_queries.pop(txn_id).errback(
                         errcodes.get(errcode, TheseusProtocolError)(errinfo)
                         )
+            elif txn_id in self.abandoned_queries:
+                del self.abandoned_queries[txn_id]
             else:
                 KRPCProtocol.log.info("{peer} - Error received for unrecognized txn {txn}", peer=self._peer, txn=txn_id.hex())
 
@@ -198,7 +208,8 @@ class KRPCProtocol(NetstringReceiver):
         KRPCProtocol.log.info("{peer} - Sending query (txn {txn}): {query} {args}", peer=self._peer, txn=txn_id.hex(), query=query_name, args=args)
         self.sendString(bencode({b't': txn_id, b'y': b'q', b'q': query_name, b'a': args}))
 
-        deferred = Deferred()
+        self.abandoned_queries.pop(txn_id, None)
+        deferred = Deferred(lambda d: self._abandon_query(txn_id))
         if query_name in self.response_handlers:
             deferred.addCallback(self.response_handlers.get(query_name))
         deferred.addErrback(self._on_error)
@@ -206,6 +217,15 @@ class KRPCProtocol(NetstringReceiver):
         self.open_queries[txn_id] = deferred
         return deferred
 
+    def _abandon_query(self, txn_id):
+        # cancelling a query (e.g. when it times out) stops us waiting on it,
+        # and means any response it does get is quietly dropped. only the most
+        # recent few are remembered, since most never get a response at all
+        if self.open_queries.pop(txn_id, None) is not None:
+            self.abandoned_queries[txn_id] = None
+            if len(self.abandoned_queries) > self.max_abandoned_queries:
+                self.abandoned_queries.popitem(last=False)
+
     def _send_response(self, txn_id, retval):
         response = {b't': txn_id, b'y': b'r', b'r': retval}
         bencoded = bencode(response)
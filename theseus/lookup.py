@@ -1,24 +1,69 @@
-from twisted.internet.defer import Deferred, DeferredList, inlineCallbacks, fail, CancelledError
+from twisted.internet.defer import Deferred, succeed, fail, CancelledError
 from twisted.internet.task import deferLater
 from twisted.internet import reactor
 from twisted.logger import Logger
 
+from .enums import INTERACTIVE
 from .errors import LookupConfigError, TheseusConnectionError, LookupRetriesExceededError
 from .routing import RoutingEntry
 from .constants import k, L
+from .distance import to_int, distance
+
+from bisect import insort
+from itertools import count
+from typing import List
 
 
 class AddrLookup:
+    """
+    Iterative Kademlia lookup for the peers closest to a target addr.
+
+    The lookup keeps a single shortlist of candidate routing entries, ordered
+    by distance from the target and bounded in size, and keeps up to `alpha`
+    'find' queries in flight at once. As soon as any query returns, its
+    results are merged into the shortlist and the next closest unqueried
+    candidate is queried, so one slow peer never holds up the others.
+
+    The lookup finishes once the `num_peers` closest candidates that haven't
+    failed have all answered. Any queries still in flight at that point are
+    further away than every result, so they're cancelled.
+
+    If `share_with` is set, it's called with the lookup whenever a 'find'
+    response comes in, and should return other lookups (e.g. for nearby
+    targets) which the response's entries will also be offered to. If
+    `discovered` is set, it's called with each response's entries too, e.g.
+    so they can be verified and added to the routing table.
+
+    If `trace` is set to a LookupTrace, the lookup records each query it
+    sends and how each one turns out.
+
+    If `deadline` is set, the lookup gives up waiting after that many seconds
+    and finishes with the closest peers it has found so far (which need not
+    have answered yet). `timed_out` is set when this happens. If `progress`
+    is set, it's called with the lookup's best results so far whenever they
+    change.
+    """
+
     log = Logger()
     _clock = reactor
 
     cancelled = False
     target = None
     prefix = ""
-    num_paths = k // 2
-    path_width = 2
-    query_timeout = 5
+    alpha = 3  # max concurrent 'find' queries
+    query_timeout = None  # None means use each peer's RTT-derived timeout
     num_peers = k
+    shortlist_size = 4*k
+    unknown_rtt = 1  # seconds; assumed for candidates we've never measured
+    hedge = True
+    priority = INTERACTIVE
+    share_with = None
+    discovered = None
+    trace = None
+    deadline = None  # seconds
+    progress = None
+    timed_out = False
+    query_counts = (0, 0)  # (queries sent, queries failed) in the last run
 
     _start_retry_min = 0
     _start_retry_max = 30
@@ -30,164 +75,485 @@ class AddrLookup:
     def __init__(self, local_peer=None):
         self.local_peer = local_peer
         self.callbacks = []
-        self.seen_set = set()
+        self._reset()
+
+    def _reset(self):
+        self.shortlist = []  # sorted list of (distance, seq, entry)
+        self.candidates = {}  # contact -> its shortlist item
+        self.seen_set = set()  # contacts we've queried
+        self.responded = set()  # contacts which answered their queries
+        self.failed = set()  # contacts whose queries failed, or which can't be queried
+        self.pending = []  # in-flight _query_find Deferreds
+        self.queries_sent = 0  # (not counting contacts skipped by _claim)
+        self.queries_failed = 0
+        self._seq = count()
+        self._advancing = False
+        self._readvance = False
+        self._retry = None  # pending retry of start, if there weren't enough peers
+        self._deadline_at = None
+        self._deadline_call = None
+        self._reported = []  # contacts in the results last passed to progress
 
     def configure(self, **kwargs):
-        # self, target=None, num_paths=None, path_width=None, query_timeout=None, num_peers=None
+        # self, target=None, alpha=None, query_timeout=None, num_peers=None, shortlist_size=None, hedge=None, priority=None, share_with=None, discovered=None, trace=None, failed=None, deadline=None, progress=None
         # target: bytes
         # TODO: add paranoia
         self.target = kwargs.get('target', self.target)
-        self.num_paths = kwargs.get('num_paths', self.num_paths)
-        self.path_width = kwargs.get('path_width', self.path_width)
+        self.alpha = kwargs.get('alpha', self.alpha)
         self.query_timeout = kwargs.get('query_timeout', self.query_timeout)
         self.num_peers = kwargs.get('num_peers', self.num_peers)
+        self.shortlist_size = kwargs.get('shortlist_size', self.shortlist_size)
+        self.hedge = kwargs.get('hedge', self.hedge)
+        self.priority = kwargs.get('priority', self.priority)
+        self.share_with = kwargs.get('share_with', self.share_with)
+        self.discovered = kwargs.get('discovered', self.discovered)
+        self.trace = kwargs.get('trace', self.trace)
+        self.deadline = kwargs.get('deadline', self.deadline)
+        self.progress = kwargs.get('progress', self.progress)
+        if kwargs.get('failed') is not None:
+            self.failed = kwargs['failed']  # shared with other lookups
         self.prefix = "Lookup " + self.target.hex() + ': '
+        self.target_int = to_int(self.target)
 
     def start(self):
         if self.cancelled:
             return fail(Exception("lookup cancelled"))
 
         # returns a Deferred that will fire on completion
-        if None in (self.target, self.num_paths, self.path_width):
-            raise AddrLookupConfigError("missing required parameter")
+        if None in (self.target, self.alpha):
+            raise LookupConfigError("missing required parameter")
 
         if self.running:
             self.callbacks.append(Deferred())
             return self.callbacks[-1]
 
-        starting_set = set(self.local_peer.routing_table.query(self.target))
+        # the deadline counts from the first attempt to start
+        now = self._clock.seconds()
+        if self.deadline is not None and self._deadline_at is None:
+            self._deadline_at = now + self.deadline
 
-        if len(starting_set) < self.num_paths * self.path_width:
+        starting_set = self.local_peer.routing_table.query(self.target)
+
+        if len(starting_set) < self.alpha:
             # might happen at startup after local ID generation
+            if self._deadline_at is not None and now >= self._deadline_at:
+                self.log.debug(self.prefix + "Not enough peers, and the deadline has passed")
+                self.timed_out = True
+                self._reset()
+                self._start_retry = AddrLookup._start_retry
+                return succeed([])
             if self._start_retry < self._start_retry_max:
                 self._start_retry += self._start_retry_delta
-                self.log.debug(self.prefix + "Not enough peers. Retrying in {t} seconds.", target=self.target, t=self._start_retry)
-                return deferLater(self._clock, self._start_retry, self.start)
+                delay = self._start_retry if self._deadline_at is None else min(self._start_retry, self._deadline_at - now)
+                self.log.debug(self.prefix + "Not enough peers. Retrying in {t} seconds.", target=self.target, t=delay)
+                self._retry = deferLater(self._clock, delay, self.start)
+                return self._retry
             else:
                 self.log.debug(self.prefix + "Giving up after hitting max retries")
                 return fail(LookupRetriesExceededError())
 
         self.running = True
+        self.timed_out = False
+        if self._deadline_at is not None:
+            self._deadline_call = self._clock.callLater(max(0, self._deadline_at - now), self._on_deadline)
         d = Deferred(canceller=self.cancel)
         self.callbacks.append(d)
         self.log.info(self.prefix + "Starting lookup for {target}", target=self.target)
         self.log.debug(self.prefix + "Starting peers: {starting_set}", target=self.target, starting_set=starting_set)
-        num_paths = min(self.num_paths, (len(starting_set) + (self.path_width - 1)) // self.path_width)
-        paths = [self.lookup_path(starting_set, i) for i in range(num_paths)]
-        DeferredList(paths).addCallback(self.on_completion)
+        if self.trace is not None:
+            self.trace.begin(self._clock.seconds())
+        for entry in starting_set:
+            self._add_candidate(entry)
+            if self.trace is not None:
+                self.trace.learned(entry.contact_info, 1)
+        self._advance()
 
         return d
 
     def cancel(self, *args, **kwargs):
+        """
+        Stops the lookup, cancelling its outstanding queries (and with them
+        any cnxn attempts they're waiting on) and errbacking every caller
+        with CancelledError.
+        """
         self.log.debug(self.prefix + "Cancelling.")
-        cancelled = True
-        for d in self.callbacks:
-            d.errback(CancelledError())
-
-    def on_completion(self, dl_result):
-        self.log.info(self.prefix + "Routing queries complete. {n} routing entries found before trimming.", n=len(dl_result))
+        self.cancelled = True
+        if self._retry is not None and not self._retry.called:
+            self._retry.cancel()
+        if self._deadline_call is not None and self._deadline_call.active():
+            self._deadline_call.cancel()
 
-        trimmed_results = {}
-
-        for success, result in dl_result:
-            if not success: continue
-            for routing_entry in result:
-                contact = routing_entry.contact_info
-                contact_pubkey = contact.key.public_bytes
-                local_pubkey = self.local_peer.peer_key.public_bytes
+        if self.running:
+            self.running = False
+            if self.trace is not None:
+                self.trace.finish(self._clock.seconds())
+            for d in list(self.pending):
+                d.cancel()
+
+        callbacks, self.callbacks = self.callbacks, []
+        for d in callbacks:
+            if not d.called:
+                d.errback(CancelledError())
+        self._reset()
+
+    def offer(self, entries):
+        """
+        Adds routing entries learned elsewhere (e.g. from another lookup's
+        'find' responses) to the shortlist of a running lookup.
+        """
+        if not self.running:
+            return
+        for entry in entries:
+            self._add_candidate(entry)
+        self._advance()
 
-                if contact in self.local_peer.blacklist or contact_pubkey == local_pubkey:
+    def get_distance(self, node_addr):
+        return distance(node_addr, self.target_int)
+
+    def _add_candidate(self, entry):
+        # returns the entry's distance from the target if it was added
+        contact = entry.contact_info
+        if contact.host in self.local_peer.blacklist \
+                or contact.key_bytes == self.local_peer.peer_key.public_bytes \
+                or self.local_peer.peer_tracker.is_dead(contact):
+            return None
+
+        # keep only the closest entry we've seen for each contact
+        dist = self.get_distance(entry.node_addr)
+        existing = self.candidates.get(contact)
+        if existing is not None:
+            if existing[0] <= dist:
+                return None
+            self.shortlist.remove(existing)
+
+        item = (dist, next(self._seq), entry)
+        self.candidates[contact] = item
+        insort(self.shortlist, item)
+        if len(self.shortlist) > max(self.shortlist_size, self.num_peers):
+            _, _, dropped = self.shortlist.pop()
+            del self.candidates[dropped.contact_info]
+            if dropped is entry:
+                return None
+        return dist
+
+    def _next_candidate(self, limit=None):
+        """
+        Claims a shortlisted entry that hasn't been queried yet and whose
+        contact is reachable. Returns None if there isn't one.
+
+        Candidates are taken a distance tier at a time, closest tier first,
+        where a tier is every candidate sharing the same length of prefix
+        with the target. Within a tier, candidates we've measured lower RTTs
+        to go first. Any candidate in the closest tier gets us as near to the
+        target as any other, so this doesn't slow the lookup's convergence.
+        If limit is given, only the closest limit candidates that haven't
+        failed are considered.
+        """
+        while True:
+            tier = self._next_tier(limit)
+            if not tier:
+                return None
+            tier.sort(key=self._get_latency)  # stable, so ties stay in distance order
+            for entry in tier:
+                if self._claim(entry):
+                    return entry
+
+    def _next_tier(self, limit):
+        tier = []
+        bits = None
+        live = 0
+        for dist, _, entry in self.shortlist:
+            contact = entry.contact_info
+            if contact in self.failed:
+                continue
+            live += 1
+            if limit is not None and live > limit:
+                break
+            if contact in self.seen_set:
+                continue
+            if bits is None:
+                bits = dist.bit_length()
+            elif dist.bit_length() != bits:
+                break
+            tier.append(entry)
+        return tier
+
+    def _get_latency(self, entry):
+        rtt = self.local_peer.peer_tracker.get_rtt(entry.contact_info)
+        return self.unknown_rtt if rtt is None else rtt
+
+    def _claim(self, entry):
+        # marks entry's contact as queried. returns False if it can't be
+        contact = entry.contact_info
+        self.seen_set.add(contact)
+        if not self.local_peer.peer_tracker.is_reachable(contact):
+            self.failed.add(contact)
+            return False
+        return True
+
+    def _advance(self):
+        # queries can fail synchronously, which brings us back here; rather
+        # than recursing, have the outermost call take another pass
+        if self._advancing:
+            self._readvance = True
+            return
+
+        self._advancing = True
+        try:
+            self._readvance = True
+            while self._readvance and self.running:
+                self._readvance = False
+                self._step()
+        finally:
+            self._advancing = False
+
+    def _step(self):
+        # query the closest num_peers live candidates, alpha at a time. once
+        # they've all answered, we're done.
+        while len(self.pending) < self.alpha:
+            entry = self._next_candidate(self.num_peers)
+            if entry is None:
+                break
+            self._query(entry)
+
+        closest = []
+        done = True
+        for _, _, entry in self.shortlist:
+            contact = entry.contact_info
+            if contact in self.failed:
+                continue
+            if contact not in self.responded:
+                done = False
+            closest.append(entry)
+            if len(closest) == self.num_peers:
+                break
+
+        # (if a query finished synchronously, the shortlist may have changed
+        # under us, so we hold off until the next pass)
+        if done and not self._readvance:
+            self._finish(closest)
+
+    def _query(self, entry):
+        contact = entry.contact_info
+        try:
+            peer = self.local_peer.get_peer(contact)
+        except TheseusConnectionError:
+            self.failed.add(contact)
+            return
+
+        self.log.debug(self.prefix + "Querying {contact}", contact=contact)
+        d = self._query_find(peer, contact)
+        self.pending.append(d)
+        d.addCallbacks(self._on_response, self._on_query_failure)
+        d.addBoth(self._on_query_done, d)
+
+    def _query_find(self, peer, contact):
+        """
+        Sends a 'find' query to peer. If hedging is enabled and the peer hasn't
+        answered by the time its hedge delay (p90 RTT) elapses, or if its query
+        fails outright, the query is repeated to the closest candidate not yet
+        queried. The first successful response wins.
+
+        Contacts whose queries succeed are marked as responded, and contacts
+        whose queries fail are marked as failed. Queries overtaken by a winning
+        hedge aren't cancelled: they're added to the pending queries and run
+        to completion, so that a slow but live peer still counts toward the
+        results.
+        """
+        queries = {}  # query Deferred -> contact
+        hedge_call = None
+        settled = []  # non-empty once a query has won or the group was cancelled
+        cancelled = []  # non-empty once the group was cancelled
+
+        def cancel(_):
+            cancelled.append(True)
+            settled.append(True)
+            if hedge_call is not None and hedge_call.active():
+                hedge_call.cancel()
+            for query in list(queries):
+                query.cancel()
+
+        result = Deferred(canceller=cancel)
+
+        def settle():
+            # a query has won. any others in this group carry on by themselves
+            settled.append(True)
+            if hedge_call is not None and hedge_call.active():
+                hedge_call.cancel()
+            for query in queries:
+                self.pending.append(query)
+                query.addBoth(self._on_query_done, query)
+
+        def on_success(response, query):
+            contact = queries.pop(query)
+            self.responded.add(contact)
+            self._trace_done(contact)
+            if not settled:
+                settle()
+                result.callback((contact, response))
+            elif not cancelled and self.running:
+                self._on_response((contact, response))  # overtaken, but answered after all
+
+        def on_failure(failure, query):
+            contact = queries.pop(query)
+            self._trace_done(contact, failure)
+            if cancelled or not self.running:
+                return  # (overtaken queries are cancelled directly when the lookup ends)
+            self.failed.add(contact)
+            self.queries_failed += 1
+            if settled:
+                return
+            if hedge_call is not None and hedge_call.active():
+                hedge_call.cancel()
+                hedge()
+            if not queries:
+                result.errback(failure)
+
+        def send(peer, contact):
+            if self.trace is not None:
+                dist = self.candidates[contact][0] if contact in self.candidates else None
+                self.trace.query_sent(contact, dist, self._clock.seconds())
+            self.queries_sent += 1
+            query = peer.query('find', {'addr': self.target}, timeout=self.query_timeout, priority=self.priority)
+            queries[query] = contact
+            query.addCallbacks(on_success, on_failure, callbackArgs=(query,), errbackArgs=(query,))
+
+        def hedge():
+            while not settled:
+                entry = self._next_candidate()
+                if entry is None:
+                    return
+                try:
+                    backup = self.local_peer.get_peer(entry.contact_info)
+                except TheseusConnectionError:
+                    self.failed.add(entry.contact_info)
                     continue
+                self.log.debug(self.prefix + "Hedging find query with {contact}", contact=entry.contact_info)
+                send(backup, entry.contact_info)
+                return
+
+        if self.hedge:
+            hedge_call = self._clock.callLater(peer.get_hedge_delay(), hedge)
+        send(peer, contact)
+        return result
+
+    def _on_response(self, result):
+        # entries' addrs are trusted for the purposes of this lookup, which
+        # keeps it fast; they're only verified if they're to be kept around
+        contact, response = result
+        entries = RoutingEntry.parse_nodes(response.get(b'nodes', []))
+        added = []
+        for entry in entries:
+            dist = self._add_candidate(entry)
+            if dist is not None:
+                added.append((dist, entry))
+        if self.trace is not None:
+            closest = self.shortlist[0][0] if self.shortlist else None
+            self.trace.responded(contact, added, closest, self._clock.seconds())
+        if self.progress is not None and self.running:
+            self._report_progress()
+        if self.share_with is not None and entries:
+            for other in self.share_with(self):
+                other.offer(entries)
+        if self.discovered is not None and entries:
+            self.discovered(entries)
+
+    def _current_results(self):
+        # the closest num_peers candidates that haven't failed
+        results = []
+        for _, _, entry in self.shortlist:
+            if entry.contact_info not in self.failed:
+                results.append(entry)
+                if len(results) == self.num_peers:
+                    break
+        return results
+
+    def _report_progress(self):
+        results = self._current_results()
+        contacts = [entry.contact_info for entry in results]
+        if contacts != self._reported:
+            self._reported = contacts
+            self.progress(results)
+
+    def _on_deadline(self):
+        self._deadline_call = None
+        self.log.info(self.prefix + "Deadline reached; finishing with the best results so far.")
+        self.timed_out = True
+        self._finish(self._current_results())
+
+    def _trace_done(self, contact, failure=None):
+        if self.trace is not None:
+            self.trace.query_done(contact, failure, self._clock.seconds())
+
+    def _on_query_failure(self, failure):
+        if self.running:
+            self.log.debug(self.prefix + "Find query failed: {err}", err=failure.getErrorMessage())
 
-                # set contact -> routing info if no entry for contact in
-                # trimmed_results yet, or if new routing entry's addr is closer
-                addr = trimmed_results.setdefault(contact, routing_entry).node_addr
-                if self.get_distance(addr) > self.get_distance(routing_entry.node_addr):
-                    trimmed_results[contact] = routing_entry
+    def _on_query_done(self, _, d):
+        self.pending.remove(d)
+        self._advance()
 
-        sort_key = lambda routing_entry: self.get_distance(routing_entry.node_addr)
-        result = sorted(trimmed_results.values(), key=sort_key)[:self.num_peers]
+    def _finish(self, result):
+        self.running = False
+        if self._deadline_call is not None and self._deadline_call.active():
+            self._deadline_call.cancel()
+        for d in list(self.pending):
+            d.cancel()
 
+        self.log.info(self.prefix + "Lookup complete after querying {n} peers.", n=len(self.seen_set))
         self.log.debug(self.prefix + "{n} lookup results: {result}", n=len(result), result=result)
+        if self.trace is not None:
+            self.trace.finish(self._clock.seconds(), result)
+        self.query_counts = (self.queries_sent, self.queries_failed)
 
         while self.callbacks:
             self.callbacks.pop().callback(result)
 
-        self.running = False
-        self.seen_set = set()
+        self._reset()
         self._start_retry = AddrLookup._start_retry
 
-    @staticmethod
-    def _xor(addr1, addr2):
-        n = 0
-        for i, byte in enumerate(addr1):
-            n <<= 8
-            n += byte ^ addr2[i]
-        return n
 
-    def get_distance(self, node_addr):
-        return self._xor(node_addr.addr, self.target)
+class MultiAddrLookup:
+    """
+    Runs lookups for several targets at once, e.g. for all of our local addrs
+    after they've been regenerated.
 
-    @inlineCallbacks
-    def lookup_path(self, lookup_set, path_num):
-        try:
-            # trim the lookup set to get a list of peers to iterate on
-            self.log.debug(self.prefix + "(path {n}) Starting lookup step. Lookup set = {lookup_set}, seen set = {seen_set}", n=path_num, lookup_set=lookup_set, seen_set=self.seen_set)
-            candidates = {}
-            for entry in lookup_set:
-                if entry.contact_info in self.seen_set \
-                        or entry.contact_info in self.local_peer.blacklist \
-                        or entry.contact_info.key.public_bytes == self.local_peer.peer_key.public_bytes:
-                    continue
-                addr = candidates.setdefault(entry.contact_info, entry.node_addr)
-                if self.get_distance(addr) > self.get_distance(entry.node_addr):
-                    candidates[entry.contact_info] = entry.node_addr
-
-            # if we don't have any new peers to talk to, call it a day
-            if len(candidates) == 0:
-                self.log.debug(self.prefix + "(path {n}) End of lookup path reached. {m} results.", n=path_num, m=len(lookup_set))
-                return lookup_set
-
-            # otherwise, find the closest candidates and call dibs on them
-            targets = sorted(candidates, key=lambda c: self.get_distance(candidates[c]))[:self.path_width]
-            self.seen_set.update(targets)
-
-            if len(self.seen_set) > 10000:  # you may laugh, but it's been known to happen
-                self.log.warn(self.prefix + "(path {n}) Lookup is off the rails", n=path_num)
-                raise Exception("something's fucky")
-
-            self.log.debug(self.prefix + "(path {n}) Querying {m} peer(s): {targets}", n=path_num, m=len(targets), targets=targets)
-            queries = []
-            for contact in targets:
-                try:
-                    peer = self.local_peer.get_peer(contact)
-                except TheseusConnectionError:
-                    continue
-                queries.append(peer.query('find', {'addr': self.target}, timeout=self.query_timeout))
-
-            # wait on those query deferreds to fire, then combine the results
-            responses = yield DeferredList(queries)
-            new_peers = set(entry
-                    for success, peers in responses if success
-                    for entry in peers.get(b'nodes', []))
-
-            self.log.debug(self.prefix + "(path {n}) Lookup step's 'find' queries complete. Number of routing entries returned: {m}", n=path_num, m=len(new_peers))
-
-            # get routing entries for the returned results (TODO currently this will blindly trust addrs by default, which speeds things up but is very naive)
-            entries = yield DeferredList([RoutingEntry.from_bytes(peer, trusted=True) for peer in new_peers])
-            new_set = set(entry for success, entry in entries if success)
-
-            # iterate on this new set of routing entries, and augment the results if necessary
-            # (TODO since addr distance is not necessarily monotonically
-            # decreasing across iterated lookup steps, this might not end up
-            # adding the ideal peers -- is it worth trying to address this?)
-
-            results = (yield self.lookup_path(new_set, path_num))
-            if len(results) < self.num_peers:
-                self.log.debug(self.prefix + "(path {n}) Collecting results. Augmenting {x} returned entries with {y} local ones.", n=path_num, x=len(results), y=len(lookup_set))
-                results.update(lookup_set)
-            return results
-
-        except Exception:
-            self.log.failure(self.prefix + "Internal error in lookup")
-            return lookup_set  # try to fail well
+    'find' queries only take one target, so each target still gets its own
+    AddrLookup, but the lookups pool what they learn: every response any of
+    them gets is offered to all the others, and a peer whose query fails for
+    one lookup isn't tried again by the rest. Cnxns are shared through the
+    peer tracker as usual. Each target's lookup completes independently.
+    """
+
+    def __init__(self, local_peer=None):
+        self.local_peer = local_peer
+        self.lookups = []  # type: List[AddrLookup]
+        self.failed = set()  # contacts whose queries have failed for any of the lookups
+        self.share_with = None
+
+    def configure(self, targets, share_with=None, **kwargs):
+        # targets: list of bytes. share_with: as for AddrLookup. other kwargs
+        # are passed on to each target's AddrLookup.
+        self.share_with = share_with
+        self.lookups = []
+        for target in targets:
+            lookup = AddrLookup(self.local_peer)
+            lookup.configure(target=target, share_with=self._share_with, failed=self.failed, **kwargs)
+            self.lookups.append(lookup)
+
+    def start(self):
+        """
+        Starts every target's lookup. Returns a list of Deferreds, in the same
+        order as the targets.
+        """
+        return [lookup.start() for lookup in self.lookups]
+
+    def cancel(self):
+        for lookup in self.lookups:
+            lookup.cancel()
+
+    def _share_with(self, lookup):
+        others = [other for other in self.lookups if other is not lookup and other.running]
+        if self.share_with is not None:
+            others += [other for other in self.share_with(lookup) if other not in others]
+        return others
@@ -0,0 +1,79 @@
+from twisted.internet import reactor
+from twisted.logger import Logger
+
+from collections import OrderedDict
+
+
+class LookupCache:
+    """
+    Bounded cache of recent lookup results, keyed by target addr.
+
+    Results are kept for `ttl` seconds, which should be much shorter than the
+    node addr timeout window, and the least recently used results are evicted
+    once there are more than max_size of them. A cached result is dropped as
+    soon as any of its peers fails the `is_usable` check (e.g. because it has
+    been blacklisted or found dead since the lookup ran).
+    """
+
+    log = Logger()
+
+    max_size = 256
+    ttl = 60  # seconds
+
+    _clock = reactor
+
+    def __init__(self, is_usable=None, max_size=None, ttl=None):
+        # is_usable: optional callable taking a ContactInfo
+        self.is_usable = is_usable
+        self.max_size = max_size or self.max_size
+        self.ttl = ttl or self.ttl
+        self.results = OrderedDict()  # target -> (expiry time, num_peers, results)
+
+    def __len__(self):
+        return len(self.results)
+
+    def get(self, target, num_peers):
+        """
+        Returns the first num_peers results of a cached lookup for target, or
+        None if there's no usable cached result with that many peers.
+        """
+        cached = self.results.get(target)
+        if cached is None:
+            return None
+
+        expires_at, cached_num_peers, results = cached
+        if expires_at <= self._clock.seconds() or not self._all_usable(results):
+            del self.results[target]
+            return None
+        if cached_num_peers < num_peers:
+            return None
+
+        self.results.move_to_end(target)
+        return results[:num_peers]
+
+    def put(self, target, num_peers, results):
+        """
+        Caches the results of a lookup for target which asked for num_peers
+        peers.
+        """
+        cached = self.results.get(target)
+        if cached is not None and cached[1] > num_peers and cached[0] > self._clock.seconds():
+            return  # don't replace a bigger result set that's still fresh
+
+        self.results[target] = (self._clock.seconds() + self.ttl, num_peers, list(results))
+        self.results.move_to_end(target)
+        while len(self.results) > self.max_size:
+            self.results.popitem(last=False)
+
+    def invalidate(self, target=None):
+        """
+        Drops the cached result for target, or every cached result if no
+        target is given.
+        """
+        if target is None:
+            self.results.clear()
+        else:
+            self.results.pop(target, None)
+
+    def _all_usable(self, results):
+        return self.is_usable is None or all(self.is_usable(entry.contact_info) for entry in results)
@@ -0,0 +1,124 @@
+from twisted.internet.defer import CancelledError, TimeoutError
+
+from .errors import QueryRetriesExceededError
+
+from typing import List
+
+
+class QueryTrace:
+    """
+    Record of a single 'find' query sent during a lookup.
+    """
+
+    __slots__ = ("contact", "distance", "hop", "sent_at", "outcome", "rtt", "new_closer")
+
+    def __init__(self, contact, distance, hop, sent_at):
+        self.contact = contact
+        self.distance = distance  # from the contact's node addr to the target
+        self.hop = hop  # 1 for the lookup's starting peers, 2 for peers they returned, etc
+        self.sent_at = sent_at
+        self.outcome = None  # "response", "timeout", "error" or "cancelled" once done
+        self.rtt = None
+        self.new_closer = 0  # candidates the response added which are closer than this peer
+
+    def __repr__(self):
+        return "QueryTrace({}, hop={}, outcome={}, rtt={})".format(self.contact, self.hop, self.outcome, self.rtt)
+
+
+class LookupTrace:
+    """
+    Timeline of a single AddrLookup: every query it sent and how each one
+    turned out, plus how close the lookup had got to its target over time.
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self.started_at = None
+        self.finished_at = None
+        self.outcome = None  # "complete" or "cancelled" once finished
+        self.queries = []  # type: List[QueryTrace]
+        self.convergence = []  # (time, distance from the closest candidate to the target)
+        self.hops = 0
+        self._hop_of = {}  # contact -> hop of the first query it can be reached on
+        self._latest = {}  # contact -> its most recent QueryTrace
+
+    def begin(self, now):
+        self.started_at = now
+
+    def learned(self, contact, hop):
+        self._hop_of.setdefault(contact, hop)
+
+    def query_sent(self, contact, distance, now):
+        query = QueryTrace(contact, distance, self._hop_of.get(contact, 1), now)
+        self.queries.append(query)
+        self._latest[contact] = query
+        return query
+
+    def query_done(self, contact, failure, now):
+        query = self._latest.get(contact)
+        if query is None or query.outcome is not None:
+            return
+        query.rtt = now - query.sent_at
+        if failure is None:
+            query.outcome = "response"
+        elif failure.check(CancelledError):
+            query.outcome = "cancelled"
+        elif failure.check(QueryRetriesExceededError, TimeoutError):
+            query.outcome = "timeout"
+        else:
+            query.outcome = "error"
+
+    def responded(self, contact, new_entries, closest, now):
+        # new_entries: (distance, entry) pairs the response added to the shortlist
+        query = self._latest.get(contact)
+        if query is not None and query.distance is not None:
+            query.new_closer = sum(1 for dist, _ in new_entries if dist < query.distance)
+            for _, entry in new_entries:
+                self.learned(entry.contact_info, query.hop + 1)
+        self.convergence.append((now, closest))
+
+    def finish(self, now, results=None):
+        self.finished_at = now
+        self.outcome = "cancelled" if results is None else "complete"
+        if results:
+            self.hops = max(self._hop_of.get(entry.contact_info, 1) for entry in results)
+
+    @property
+    def duration(self):
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+    @property
+    def slowest_fraction(self):
+        """
+        Fraction of the lookup's duration spent waiting on its slowest
+        answered (or timed out) query.
+        """
+        rtts = [query.rtt for query in self.queries if query.outcome not in (None, "cancelled")]
+        if not rtts or not self.duration:
+            return 0.0
+        return min(1.0, max(rtts) / self.duration)
+
+
+def summarize(traces):
+    """
+    Aggregates a collection of LookupTraces into metrics for tuning lookup
+    parameters. Only completed lookups are counted.
+    """
+    done = [trace for trace in traces if trace.outcome == "complete"]
+    queries = [query for trace in done for query in trace.queries]
+
+    def mean(values):
+        values = list(values)
+        return sum(values) / len(values) if values else 0.0
+
+    return {
+        "lookups": len(done),
+        "mean_duration": mean(trace.duration for trace in done),
+        "mean_hops": mean(trace.hops for trace in done),
+        "mean_queries": mean(len(trace.queries) for trace in done),
+        "mean_slowest_fraction": mean(trace.slowest_fraction for trace in done),
+        "mean_rtt": mean(query.rtt for query in queries if query.outcome == "response"),
+        "timeout_rate": mean(query.outcome == "timeout" for query in queries),
+    }
@@ -0,0 +1,256 @@
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, CancelledError
+from twisted.internet.task import LoopingCall
+from twisted.logger import Logger
+
+from .constants import L
+from .enums import MAINTENANCE, LOW
+from .errors import TheseusConnectionError, LookupRetriesExceededError, ValidationError
+from .hasher import hasher
+from .nodeaddr import NodeAddress
+
+from collections import OrderedDict
+from random import SystemRandom
+from typing import List
+
+
+class BucketProber:
+    """
+    Keeps the routing table honest by periodically pinging whichever entry we
+    have gone longest without hearing from. Entries that answer are moved to
+    the back of their bucket; entries that don't are dropped, and the bucket's
+    most recently seen replacement takes their place.
+
+    Only one probe is ever in flight, and probes start at most once per
+    interval, so the prober's traffic stays bounded no matter how big the
+    table gets. Each tick also clears out entries whose node addrs have
+    expired.
+    """
+
+    log = Logger()
+
+    interval = 10  # seconds between probes
+    stale_after = 15*60  # entries seen more recently than this aren't probed
+    retries = 1
+
+    _clock = reactor
+
+    def __init__(self, local_peer):
+        self.local_peer = local_peer
+        self.looper = LoopingCall(self.probe)
+        self.pending = None
+
+    def start(self):
+        if not self.looper.running:
+            self.looper.clock = self._clock
+            self.looper.start(self.interval, now=False)
+
+    def stop(self):
+        if self.looper.running:
+            self.looper.stop()
+        if self.pending is not None:
+            self.pending.cancel()
+
+    def probe(self):
+        routing_table = self.local_peer.routing_table
+        routing_table.expire()
+
+        if self.pending is not None:
+            return
+
+        cutoff = self._clock.seconds() - self.stale_after
+        entry = routing_table.get_stalest(cutoff)
+        if entry is None:
+            return
+
+        # if we've heard from the peer lately for some other reason, that's
+        # as good as a ping
+        last_heard = self.local_peer.peer_tracker.get_last_heard(entry.contact_info)
+        if last_heard is not None and last_heard > cutoff:
+            routing_table.touch(entry)
+            return
+
+        if self.local_peer.peer_tracker.is_dead(entry.contact_info):
+            self._on_failure(None, entry)
+            return
+
+        try:
+            peer_state = self.local_peer.get_peer(entry.contact_info)
+        except TheseusConnectionError as e:
+            self.log.debug("Can't probe {entry}: {err}", entry=entry, err=e)
+            self._on_failure(None, entry)
+            return
+
+        self.log.debug("Probing stale routing entry {entry}", entry=entry)
+        self.pending = peer_state.query("info", {"keys": []}, retries=self.retries, priority=MAINTENANCE)
+        self.pending.addCallbacks(self._on_success, self._on_failure, callbackArgs=(entry,), errbackArgs=(entry,))
+        self.pending.addBoth(self._clear_pending)
+
+    def _on_success(self, _, entry):
+        self.local_peer.routing_table.touch(entry)
+
+    def _on_failure(self, failure, entry):
+        if failure is not None and failure.check(CancelledError):
+            return
+        self.log.info("Routing entry {entry} failed its liveness probe; dropping it", entry=entry)
+        self.local_peer.routing_table.remove(entry)
+
+    def _clear_pending(self, _):
+        self.pending = None
+
+
+class RefreshScheduler:
+    """
+    Keeps the routing table warm by running lookups for random addrs in
+    buckets that haven't seen any activity (inserts, successful probes or
+    lookups in their range) for a while.
+
+    Refresh lookups run at MAINTENANCE priority, so their cnxn attempts queue
+    behind those of user lookups, and no more than max_concurrent of them are
+    ever outstanding at once.
+    """
+
+    log = Logger()
+
+    interval = 60  # seconds between checks for stale buckets
+    refresh_after = 60*60  # seconds of inactivity before a bucket is refreshed
+    max_concurrent = 2
+
+    _clock = reactor
+    _rng = SystemRandom()
+
+    def __init__(self, local_peer):
+        self.local_peer = local_peer
+        self.looper = LoopingCall(self.refresh)
+        self.pending = []  # type: List[Deferred]
+
+    def start(self):
+        if not self.looper.running:
+            self.looper.clock = self._clock
+            self.looper.start(self.interval, now=False)
+
+    def stop(self):
+        if self.looper.running:
+            self.looper.stop()
+        for d in list(self.pending):
+            d.cancel()
+
+    def refresh(self):
+        routing_table = self.local_peer.routing_table
+        cutoff = self._clock.seconds() - self.refresh_after
+        for bucket in routing_table.get_stale_buckets(cutoff):
+            if len(self.pending) >= self.max_concurrent:
+                break
+
+            target = self._rng.randint(bucket.lower, bucket.upper).to_bytes(L//8, "big")
+            self.log.debug("Refreshing bucket 0x{low}~0x{high} with lookup for {target}", low=hex(bucket.lower), high=hex(bucket.upper), target=target.hex())
+            d = self.local_peer.do_lookup(target, priority=MAINTENANCE, fresh=True)  # marks the bucket active
+            self.pending.append(d)
+            d.addErrback(self._on_failure)
+            d.addBoth(self._clear_pending, d)
+
+    def _on_failure(self, failure):
+        if not failure.check(CancelledError, LookupRetriesExceededError):
+            self.log.failure("Refresh lookup failed", failure)
+
+    def _clear_pending(self, _, d):
+        self.pending.remove(d)
+
+
+class DiscoveryVerifier:
+    """
+    Lets lookups stock the routing table. Routing entries learned from 'find'
+    responses are queued here, their node addrs are verified in the
+    background, and the ones that check out are inserted into the routing
+    table, so each lookup leaves the next one with better starting peers.
+
+    Verification costs an Argon2 hash, so it's rate limited: at most one LOW
+    priority hash job is started per interval, none is started while more
+    urgent jobs (e.g. CRITICAL local addr generation) are waiting on the
+    hasher, and only one is ever in flight. That leaves the rest of the
+    hasher's workers free for everything else.
+
+    Entries the table couldn't use right away (ones it already holds, or
+    ones bound for full buckets that can't be split) aren't worth a hash and
+    are skipped. The queue is bounded; when it overflows, the oldest
+    discoveries are dropped.
+    """
+
+    log = Logger()
+
+    interval = 1  # seconds between verifications
+    max_queued = 256
+
+    _clock = reactor
+
+    def __init__(self, local_peer):
+        self.local_peer = local_peer
+        self.looper = LoopingCall(self.verify_next)
+        self.queue = OrderedDict()  # RoutingEntry -> None (i.e. an ordered set)
+        self.pending = None
+
+    def start(self):
+        if not self.looper.running:
+            self.looper.clock = self._clock
+            self.looper.start(self.interval, now=False)
+
+    def stop(self):
+        if self.looper.running:
+            self.looper.stop()
+        self.queue.clear()
+
+    def submit(self, entries):
+        """
+        Queues unverified routing entries for verification and insertion.
+        """
+        for entry in entries:
+            if self._is_wanted(entry):
+                self.queue.pop(entry, None)
+                self.queue[entry] = None
+        while len(self.queue) > self.max_queued:
+            self.queue.popitem(last=False)
+
+    def verify_next(self):
+        if self.pending is not None or hasher.is_busy(LOW):
+            return
+
+        # things may have changed since these were queued, so recheck them
+        while self.queue:
+            entry, _ = self.queue.popitem(last=False)
+            if self._is_wanted(entry):
+                break
+        else:
+            return
+
+        self.log.debug("Verifying discovered routing entry {entry}", entry=entry)
+        node_addr = entry.node_addr
+        self.pending = NodeAddress.from_preimage(node_addr.addr, node_addr.preimage, priority=LOW)
+        self.pending.addCallbacks(self._on_verified, self._on_invalid, callbackArgs=(entry,), errbackArgs=(entry,))
+        self.pending.addBoth(self._clear_pending)
+
+    def _is_wanted(self, entry):
+        contact, node_addr = entry.contact_info, entry.node_addr
+        routing_table = self.local_peer.routing_table
+        return (not node_addr.verified
+                and node_addr.preimage is not None
+                and entry.expires_at > self._clock.seconds()
+                and contact.key_bytes != self.local_peer.peer_key.public_bytes
+                and contact.host not in self.local_peer.blacklist
+                and not self.local_peer.peer_tracker.is_dead(contact)
+                and entry not in routing_table
+                and routing_table.has_room(node_addr.addr_int))
+
+    def _on_verified(self, node_addr, entry):
+        # from_preimage doesn't check the image against the addr we were
+        # given yet, so we do that here
+        if node_addr.addr != entry.node_addr.addr:
+            self.log.debug("Discovered routing entry {entry} failed verification", entry=entry)
+            return
+        self.local_peer.routing_table.insert(entry.contact_info, node_addr)
+
+    def _on_invalid(self, failure, entry):
+        failure.trap(ValidationError)
+        self.log.debug("Discovered routing entry {entry} failed verification: {err}", entry=entry, err=failure.getErrorMessage())
+
+    def _clear_pending(self, _):
+        self.pending = None
@@ -4,6 +4,7 @@ from .enums import CRITICAL, UNSET
 from .hasher import hasher
 from .constants import timeout_window
 from .errors import ValidationError
+from .distance import to_int
 
 from os import urandom
 from time import time
@@ -13,6 +14,8 @@ from typing import TYPE_CHECKING
 
 
 class Preimage:
+    __slots__ = ("ip_addr", "ts_bytes", "entropy", "_hash")
+
     def __init__(self, ts_bytes, ip_addr, entropy):
         if type(ip_addr) is str:
             ip_addr = inet_aton(ip_addr)
@@ -20,6 +23,14 @@ class Preimage:
         self.ip_addr = ip_addr
         self.ts_bytes = ts_bytes
         self.entropy = entropy
+        self._hash = hash((ts_bytes, ip_addr, entropy))
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        return isinstance(other, self.__class__) and self._hash == other._hash \
+                and self.ts_bytes == other.ts_bytes and self.ip_addr == other.ip_addr and self.entropy == other.entropy
 
     def __repr__(self):
         return "Preimage({}, {}, {})".format(self.ts_bytes, self.ip_addr, self.entropy)
@@ -36,10 +47,13 @@ class Preimage:
 
 
 class NodeAddress:
+    __slots__ = ("addr", "addr_int", "preimage", "verified")
+
     timeout_window = timeout_window
 
     def __init__(self, addr, preimage, verified=True):
         self.addr = addr
+        self.addr_int = to_int(addr)
         self.preimage = preimage
         self.verified = verified
 
@@ -54,6 +68,15 @@ class NodeAddress:
         # preimage (14 bytes), then image (20 bytes, for now): 34 bytes total
         return self.preimage.as_bytes() + self.addr
 
+    def get_expiry(self):
+        """
+        Returns the time after which this addr's timestamp stops passing
+        check_timestamp. Addrs without preimages never expire.
+        """
+        if self.preimage is None:
+            return float('inf')
+        return self._ts_bytes_to_int(self.preimage.ts_bytes) + self.timeout_window
+
     @classmethod
     @inlineCallbacks
     def new(cls, ip_addr, priority=CRITICAL):
@@ -103,10 +126,7 @@ class NodeAddress:
 
     @staticmethod
     def _ts_bytes_to_int(timestamp):
-        n = 0
-        for byte in timestamp:
-            n = (n << 8) + byte
-        return n
+        return int.from_bytes(timestamp, "big")
 
     @staticmethod
     def _ts_int_to_bytes(ts):
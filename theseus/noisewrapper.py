@@ -1,5 +1,6 @@
+from twisted.internet import reactor
 from twisted.logger import Logger
-from twisted.protocols.policies import ProtocolWrapper
+from twisted.protocols.policies import ProtocolWrapper, TimeoutMixin
 
 from noise.connection import NoiseConnection
 
@@ -29,10 +30,13 @@ import struct
 # would not support?
 
 
-class NoiseWrapper(ProtocolWrapper):
+class NoiseWrapper(ProtocolWrapper, TimeoutMixin):
     log = Logger()
     settings = None
     MAX_LENGTH = 2**20
+    handshake_timeout = 10  # seconds
+
+    _clock = reactor
 
     _noise = None
     _buf = b''
@@ -52,12 +56,24 @@ class NoiseWrapper(ProtocolWrapper):
         if self.settings is None:
             self.settings = self._get_default_config()
         self.factory.registerProtocol(self)
+        # the wrapped protocol's own timeouts only start once it's connected,
+        # so until then, a peer that stalls the handshake is dropped here
+        self.setTimeout(self.handshake_timeout)
         self._start_handshake()
 
     def connectionLost(self, reason):
         self.log.info('{peer} - Connection lost. Details: "{reason}"', peer=self._peer, reason=reason.getErrorMessage())
+        self.setTimeout(None)
         super().connectionLost(reason)
 
+    def callLater(self, period, func):
+        # used by TimeoutMixin
+        return self._clock.callLater(period, func)
+
+    def timeoutConnection(self):
+        self.log.info("{peer} - Noise handshake timed out after {s} seconds.", peer=self._peer, s=self.handshake_timeout)
+        super().timeoutConnection()
+
     def _start_handshake(self):
         if self._noise is not None:
             self.log.warn("{peer} - _start_handshake called with pre-existing Noise state", peer=self._peer)
@@ -139,6 +155,7 @@ class NoiseWrapper(ProtocolWrapper):
                 self.write(self._pending_writes.pop(0))
 
             self.log.info("{peer} - Noise handshake complete.", peer=self._peer)
+            self.setTimeout(None)
             super().makeConnection(self.transport)
 
     def _process_length(self, data):
@@ -4,25 +4,34 @@ from twisted.internet.defer import succeed, fail, maybeDeferred, DeferredList, D
 from twisted.internet.error import CannotListenError
 from twisted.logger import Logger
 from twisted.plugin import getPlugins
+from twisted.python.failure import Failure
 
-from noise.functions import DH, KeyPair25519
+from noise.functions import KeyPair25519
 
 from .config import config
 from .contactinfo import ContactInfo
 from .constants import k
 from .enums import DHTInfoKeys, MAX_VERSION, LISTEN_PORT, PEER_KEY, ADDRS, LOW
+from .enums import INTERACTIVE, MAINTENANCE, SPECULATIVE
+from .blacklist import Blacklist
+from .distance import shared_prefix_len
 from .errors import TheseusConnectionError, DuplicateContactError, LookupRetriesExceededError
 from .nodeaddr import NodeAddress
 from .peertracker import PeerTracker
 from .plugins import IPeerSource, IInfoProvider
 from .protocol import DHTProtocol
-from .routing import RoutingTable
+from .routing import FlatRoutingTable
 from .nodemanager import NodeManager
-from .lookup import AddrLookup
+from .lookup import AddrLookup, MultiAddrLookup
+from .lookupcache import LookupCache
+from .lookuptrace import LookupTrace, summarize
+from .maintenance import BucketProber, RefreshScheduler, DiscoveryVerifier
+from .snapshot import RoutingSnapshot
 from .statstracker import StatsTracker
 
 from collections import deque
 from random import SystemRandom
+from os import urandom
 from socket import inet_aton
 from typing import List
 
@@ -37,29 +46,50 @@ class PeerService(Service):
     - A registry and state tracker for remote peers
     - A manager for local node state
     - A peer blacklist
+    - A prober which checks routing table entries for liveness
+    - A scheduler which refreshes idle routing table buckets
+    - A verifier which adds peers discovered by lookups to the routing table
+    - A snapshot of the peer key and routing table, for warm restarts
+    - A cache of recent lookup results
+    - Optionally, traces of recent lookups
     """
 
     log = Logger()
     listener = None
     listen_port = None
-
-    blacklist_size = 500
+    snapshot_file = None  # where to keep this peer's key and routing table across restarts (None to disable)
+    lookup_share_bits = 16  # lookups whose targets share this many leading bits share find responses (None to disable)
+    trace_lookups = False
+    lookup_trace_size = 128  # number of recent lookup traces to keep
 
     _rng = SystemRandom()  # broken out for tests
 
-    def __init__(self, num_nodes=5):
+    def __init__(self, num_nodes=5, snapshot_file=None):
         super().__init__()
+        if snapshot_file is not None:
+            self.snapshot_file = snapshot_file
 
-        self.blacklist = deque(maxlen=self.blacklist_size)
-        self.peer_key = self._generate_keypair()
+        self.blacklist = Blacklist()
+        self.snapshot = RoutingSnapshot(self, self.snapshot_file)
+        saved = self.snapshot.load()
+        self.private_key = saved.private_key if saved else self._generate_private_key()
+        self.peer_key = KeyPair25519.from_private_bytes(self.private_key)
 
-        self.routing_table = RoutingTable()
         self.peer_tracker = PeerTracker(self)
+        self.routing_table = FlatRoutingTable(is_dead=self.peer_tracker.is_dead, get_rtt=self.peer_tracker.get_rtt)
+        if saved:
+            self.snapshot.restore(saved.entries)
         self.stats_tracker = StatsTracker(self)
+        self.lookup_cache = LookupCache(is_usable=self._is_usable_contact)
+        self.prober = BucketProber(self)
+        self.refresher = RefreshScheduler(self)
+        self.verifier = DiscoveryVerifier(self)
         self.node_manager = NodeManager(num_nodes)
         self.node_manager.add_listener(self.on_addr_change)
 
-        self._addr_lookups = []  # type: List[Deferred]
+        self._addr_lookups = []  # type: List[AddrLookup]
+        self._lookup_waiters = {}  # AddrLookup -> (Deferred, k) for each caller waiting on it
+        self.lookup_traces = deque(maxlen=self.lookup_trace_size)
 
     def startService(self):
         super().startService()
@@ -71,7 +101,7 @@ class PeerService(Service):
                 self.log.info("Peers from {source}: {peers}", source=peer_source, peers=peers)
                 for peer in peers:
                     try:
-                        self.get_peer(peer).connect()
+                        self.get_peer(peer).connect(SPECULATIVE).addErrback(lambda _: None)
                     except DuplicateContactError:
                         self.log.warn("Differing contact info records encountered for {host}:{port}", host=peer.host, port=peer.port)
 
@@ -83,6 +113,7 @@ class PeerService(Service):
             DHTProtocol.supported_info_keys.update(info_provider.provided)
 
         self.stats_tracker.start()
+        self.snapshot.verify()
 
     def stopService(self):
         super().stopService()
@@ -90,27 +121,36 @@ class PeerService(Service):
         self.log.info("Peer stopping")
 
         self.node_manager.stop()
+        self.peer_tracker.stop()
+        self.prober.stop()
+        self.refresher.stop()
+        self.verifier.stop()
         self.stats_tracker.stop()
+        self.snapshot.stop()
+        self.snapshot.save()
 
-        for lookup in self._addr_lookups:
+        for lookup in list(self._addr_lookups):
             lookup.cancel()
 
         self.log.info("Peer stopped")
 
     def on_addr_change(self, new_addrs):
-        self.routing_table.reload(new_addrs)  # TODO pass in full list of eligible peers?
+        restored, self.snapshot.restored = self.snapshot.restored, []
+        self.routing_table.reload(new_addrs, restored)  # TODO pass in full list of eligible peers?
         # TODO should we advertise this info change? probably, right?
 
-        # run lookups for all addresses
-        for addr in new_addrs:
+        # run lookups for all addresses, together
+        for d in self.do_lookups([addr.addr for addr in new_addrs], priority=MAINTENANCE, fresh=True):
             # TODO we need a way of allowing infinite retries on fixed
             # intervals, with retries cleanly cancelling on peer.stopService()
             # so we don't have to deal with this retries-exceeded bullshit
-            self.do_lookup(addr.addr).addErrback(lambda failure: failure.trap(LookupRetriesExceededError))
+            d.addErrback(lambda failure: failure.trap(LookupRetriesExceededError))
 
     @staticmethod
-    def _generate_keypair():
-        return DH("ed25519").generate_keypair()
+    def _generate_private_key():
+        # the key is generated as raw bytes (rather than through noise's DH
+        # helper) so that it can be saved and reloaded across restarts
+        return urandom(32)
 
     def _start_listening(self):
         """
@@ -147,10 +187,10 @@ class PeerService(Service):
         """
         self.listener = reactor.listenTCP(port, self.peer_tracker)
 
-    def add_to_blacklist(self, host):
+    def add_to_blacklist(self, host, duration=None):
         self.log.info("Blacklisting {host}", host=host)
-        # TODO add logic to terminate any existing cnxns with blacklisted host
-        self.blacklist.append(host)
+        self.blacklist.add(host, duration)
+        self.peer_tracker.drop_cnxns(self.blacklist)
 
     def get_peer(self, contact_info):
         if not self.running:
@@ -237,6 +277,11 @@ class PeerService(Service):
             contact = cnxn.peer_state.get_contact_info()
             for addr in info[ADDRS]:
                 self.routing_table.insert(contact, addr)
+            if self.running:
+                self.prober.start()
+                self.refresher.start()
+                self.verifier.start()
+                self.snapshot.start()
 
     def _maybe_register_contact(self, cnxn):
         """
@@ -282,20 +327,130 @@ class PeerService(Service):
 
         return fail(UnsupportedInfoError())
 
-    def do_lookup(self, addr, k=k):
+    def do_lookup(self, addr, k=k, priority=INTERACTIVE, fresh=False, deadline=None, progress=None):
+        # callers with a deadline or progress callback get a lookup of their
+        # own, since it runs on their schedule
+        d = self._cached_or_joined(addr, k, priority, fresh, join=deadline is None and progress is None)
+        if d is not None:
+            return d
+
         self.log.info("Setting up lookup for {a}", a=addr.hex())
         lookup = AddrLookup(self)
-        lookup.configure(target=addr, num_peers=k)
+        lookup.configure(target=addr, num_peers=k, priority=priority, share_with=self._nearby_lookups,
+                         discovered=self.verifier.submit, deadline=deadline, progress=progress,
+                         **self.stats_tracker.get_lookup_params())
+        self._register_lookup(lookup)
+        return self._watch_lookup(lookup, k, lookup.start())
+
+    def do_lookups(self, addrs, k=k, priority=INTERACTIVE, fresh=False):
+        """
+        Looks up several distinct addrs at once, pooling what the lookups
+        learn. Returns a list of Deferreds, one per addr, each of which fires
+        as soon as that addr's lookup is done.
+        """
+        results = {}
+        batch = []
+        for addr in addrs:
+            d = self._cached_or_joined(addr, k, priority, fresh)
+            if d is None:
+                batch.append(addr)
+            else:
+                results[addr] = d
+
+        if batch:
+            self.log.info("Setting up batched lookup for {n} addrs", n=len(batch))
+            multi = MultiAddrLookup(self)
+            multi.configure(targets=batch, num_peers=k, priority=priority, share_with=self._nearby_lookups,
+                            discovered=self.verifier.submit, **self.stats_tracker.get_lookup_params())
+            for lookup in multi.lookups:
+                self._register_lookup(lookup)
+            for lookup, d in zip(multi.lookups, multi.start()):
+                results[lookup.target] = self._watch_lookup(lookup, k, d)
+
+        return [results[addr] for addr in addrs]
+
+    def _cached_or_joined(self, addr, k, priority, fresh, join=True):
+        # returns a Deferred if addr can be looked up without a new lookup
+        self.routing_table.mark_active(addr)
+
+        if not fresh:
+            cached = self.lookup_cache.get(addr, k)
+            if cached is not None:
+                self.log.debug("Using cached lookup results for {a}", a=addr.hex())
+                return succeed(cached)
+
+        # if there's already a lookup underway for this addr, just wait on it
+        for lookup in self._addr_lookups if join else ():
+            if lookup.target == addr and lookup.num_peers >= k and lookup.deadline is None:
+                self.log.info("Joining in-flight lookup for {a}", a=addr.hex())
+                lookup.priority = min(lookup.priority, priority)
+                return self._add_waiter(lookup, k)
+
+        return None
+
+    def _register_lookup(self, lookup):
+        if self.trace_lookups:
+            lookup.configure(trace=LookupTrace(lookup.target))
+            self.lookup_traces.append(lookup.trace)
         self._addr_lookups.append(lookup)
+        self._lookup_waiters[lookup] = []
+
+    def _add_waiter(self, lookup, k):
+        # every caller gets a Deferred of its own, so that one of them
+        # cancelling doesn't cancel the lookup for the rest. the lookup
+        # itself is only cancelled once all of them have
+        waiters = self._lookup_waiters[lookup]
+
+        def cancel(d):
+            waiters.remove((d, k))
+            if not waiters:
+                self.log.info("Cancelling lookup for {a}: no callers remain", a=lookup.target.hex())
+                lookup.cancel()
+
+        d = Deferred(canceller=cancel)
+        waiters.append((d, k))
+        return d
+
+    def _watch_lookup(self, lookup, k, d):
+        # d: the lookup's Deferred. passes results on to the cache and to
+        # every caller waiting on the lookup. returns the Deferred for the
+        # caller who started it
+        addr = lookup.target
+        waiter = self._add_waiter(lookup, k)  # before d's callback, which may run right away
 
         def cb(val):
             self._addr_lookups.remove(lookup)
-            return val
+            if not isinstance(val, Failure):
+                self.stats_tracker.record_queries(*lookup.query_counts)
+                if not lookup.timed_out:
+                    if val:
+                        # (a lookup in a small network may find fewer than k)
+                        self.lookup_cache.put(addr, len(val), val)
+                    self.stats_tracker.record_lookup(addr, val)
+            for caller, n in self._lookup_waiters.pop(lookup):
+                if isinstance(val, Failure):
+                    caller.errback(val)
+                else:
+                    caller.callback(val[:n])
 
-        d = lookup.start()
         d.addBoth(cb)
-        self.stats_tracker.register_lookup(d, addr)
-        return d
+        return waiter
+
+    def get_lookup_stats(self):
+        """
+        Aggregates the traces of recent lookups (if trace_lookups is set)
+        into metrics such as mean hops and queries per lookup.
+        """
+        return summarize(self.lookup_traces)
+
+    def _is_usable_contact(self, contact_info):
+        return contact_info.host not in self.blacklist and not self.peer_tracker.is_dead(contact_info)
+
+    def _nearby_lookups(self, lookup):
+        if self.lookup_share_bits is None:
+            return []
+        return [other for other in self._addr_lookups
+                if other is not lookup and shared_prefix_len(other.target_int, lookup.target_int) >= self.lookup_share_bits]
 
     def dht_get(self, key, redundancy=1):
         ...  # TODO
@@ -1,19 +1,27 @@
 from twisted.internet import reactor
-from twisted.internet.defer import fail, succeed, inlineCallbacks, CancelledError
+from twisted.internet.defer import Deferred, fail, succeed, inlineCallbacks, CancelledError
 from twisted.internet.defer import TimeoutError as TwistedTimeoutError
 from twisted.internet.endpoints import TCP4ClientEndpoint
+from twisted.internet.error import ConnectingCancelledError
 from twisted.internet.protocol import Factory
+from twisted.internet.task import LoopingCall
 from twisted.logger import Logger
 from twisted.protocols.policies import WrappingFactory
 
+from .constants import timeout_window
 from .contactinfo import ContactInfo
+from .dialer import DialScheduler
 from .enums import DISCONNECTED, CONNECTING, CONNECTED
+from .enums import CLOSED, OPEN, HALF_OPEN
 from .enums import INITIATOR, RESPONDER
-from .enums import LISTEN_PORT, PEER_KEY
-from .errors import QueryRetriesExceededError, DuplicateContactError
+from .enums import INTERACTIVE
+from .enums import LISTEN_PORT, PEER_KEY, ADDRS
+from .errors import QueryRetriesExceededError, DuplicateContactError, PeerUnreachableError, TheseusConnectionError
 from .noisewrapper import NoiseWrapper, NoiseSettings
 from .protocol import DHTProtocol
 
+from collections import deque
+
 
 class PeerState(Factory):
     log = Logger()
@@ -22,16 +30,41 @@ class PeerState(Factory):
     host = None
     role = None
     state = None
+    last_heard = None  # when the peer last completed a cnxn or answered a query
 
+    # query timeouts are derived from smoothed RTT measurements, TCP-style
+    # (see RFC 6298). query_timeout is used until we have a measurement.
     query_timeout = 2  # seconds
+    min_timeout = 0.5  # seconds
+    max_timeout = 10  # seconds
+    srtt = None
+    rttvar = None
+    rtt_sample_size = 20
+
+    # connection failures put the peer into exponential backoff. after
+    # circuit_threshold consecutive failures, the peer's circuit opens and it
+    # is treated as dead until a trial connection succeeds.
+    circuit = CLOSED
+    failures = 0
+    retry_at = 0
+    backoff_base = 1  # seconds
+    backoff_max = 10*60  # seconds
+    circuit_threshold = 3
 
     _endpoint_deferred = None
+    _dial_priority = None
+    _dial_slot = None  # DialScheduler whose slot we hold, until the cnxn is set up or fails
+    _proto = None
 
     _reactor = reactor
     _clock = reactor
 
     def __init__(self):
         self.info = {}
+        self._connect_waiters = []
+        self._ready_waiters = []
+        self.rtt_samples = deque(maxlen=self.rtt_sample_size)
+        self.last_seen = self._clock.seconds()
 
     @classmethod
     def from_contact(cls, contact_info):
@@ -43,6 +76,21 @@ class PeerState(Factory):
         instance.info[PEER_KEY] = contact_info.key
         return instance
 
+    @classmethod
+    def from_record(cls, record):
+        PeerState.log.debug("Restoring PeerState from record: {record}", record=record)
+        instance = cls.from_contact(record.get_contact_info())
+        if record.addrs is not None:
+            instance.info[ADDRS] = list(record.addrs)
+        instance.last_seen = record.last_seen
+        instance.last_heard = record.last_heard
+        instance.failures = record.failures
+        instance.retry_at = record.retry_at
+        instance.circuit = OPEN if record.dead else CLOSED
+        instance.srtt = record.srtt
+        instance.rttvar = record.rttvar
+        return instance
+
     @classmethod
     def from_proto(cls, protocol):
         PeerState.log.debug("Building new PeerState from protocol: {proto}", proto=protocol)
@@ -56,27 +104,142 @@ class PeerState(Factory):
         if self.role is None or self.info.get(PEER_KEY) is None:
             return
         p = self.subfactory.buildProtocol(addr)
-        p.settings = NoiseSettings.for_peer_state(self)
+        if p is not None:
+            p.settings = NoiseSettings.for_peer_state(self)
         return p
 
-    def connect(self):
-        reactor = self._reactor
+    def connect(self, priority=INTERACTIVE):
+        """
+        Returns a Deferred which fires with this peer's DHTProtocol once a TCP
+        cnxn is up (the Noise handshake may still be in progress). Outbound
+        cnxn attempts wait their turn on the tracker's DialScheduler.
+
+        Every caller gets its own Deferred. Cancelling it withdraws that
+        caller's interest, and once nobody is waiting on an attempt anymore,
+        the attempt is abandoned.
+        """
+        if self.state is not DISCONNECTED and self._endpoint_deferred is None:
+            return succeed(self._proto or self.cnxn)
+        return self._wait(self._connect_waiters, priority)
+
+    def _when_ready(self, priority=INTERACTIVE):
+        """
+        Like connect, but fires only once the cnxn is ready to carry queries.
+        """
+        if self.cnxn is not None:
+            return succeed(self.cnxn)
+        return self._wait(self._ready_waiters, priority)
+
+    def _wait(self, waiters, priority):
+        if self.state is DISCONNECTED:
+            if not self.info.get(LISTEN_PORT):
+                return fail(Exception("remote listen port unknown"))
+
+            if not self.is_reachable():
+                self.log.debug("Not attempting cnxn to {peer}: backing off for {t} more seconds", peer=self._describe(), t=self.retry_at - self._clock.seconds())
+                return fail(PeerUnreachableError("peer is in connection backoff"))
+
+        d = Deferred(lambda d: self._remove_waiter(waiters, d))
+        waiters.append(d)
+
+        if self.state is DISCONNECTED:
+            self._start_dial(priority)
+        elif self._endpoint_deferred is not None and priority < self._dial_priority:
+            self._dial_priority = priority
+            self.subfactory.dial_scheduler.reprioritize(self._endpoint_deferred, priority)
+
+        return d
 
-        if self.state is not DISCONNECTED:  # FIXME should this be "if self.state is CONNECTING"? and should we add more logic for other cases if so?
-            return self._endpoint_deferred
+    def _remove_waiter(self, waiters, d):
+        waiters.remove(d)
+        if self._endpoint_deferred is not None and not self._connect_waiters and not self._ready_waiters:
+            self.log.debug("Abandoning cnxn attempt to {peer}: no callers remain", peer=self._describe())
+            self._endpoint_deferred.cancel()
 
-        if not self.info.get(LISTEN_PORT):
-            return fail(Exception("remote listen port unknown"))
+    def _start_dial(self, priority):
+        if self.circuit is OPEN:
+            self.log.info("Attempting trial cnxn to {peer} after backoff", peer=self._describe())
+            self.circuit = HALF_OPEN
 
-        self.log.info("Attempting cnxn to {ip}:{port}", ip=self.host, port=self.info.get(LISTEN_PORT))
         self.state = CONNECTING
         self.role = INITIATOR
+        self._dial_priority = priority
+
+        scheduler = self.subfactory.dial_scheduler
+        d = self._endpoint_deferred = scheduler.acquire(priority)
+        d.addCallback(self._dial, scheduler)
+        d.addCallbacks(self._on_dial_success, self._on_connect_failure)  # may clear _endpoint_deferred
+
+    def _dial(self, _, scheduler):
+        # the slot covers the Noise handshake as well as the TCP connect, so
+        # it's held until on_connect, on_disconnect or _on_connect_failure
+        self.log.info("Attempting cnxn to {ip}:{port}", ip=self.host, port=self.info.get(LISTEN_PORT))
+        self._dial_slot = scheduler
+        endpoint = TCP4ClientEndpoint(self._reactor, self.host, self.info[LISTEN_PORT])
+        return endpoint.connect(self)
 
-        endpoint = TCP4ClientEndpoint(reactor, self.host, self.info[LISTEN_PORT])
-        self._endpoint_deferred = endpoint.connect(self)
-        self._endpoint_deferred.addCallback(lambda wrapper: wrapper.wrappedProtocol)
-        # TODO maybe add an errback for updating peer state on cnxn failure?
-        return self._endpoint_deferred
+    def _release_dial_slot(self):
+        scheduler, self._dial_slot = self._dial_slot, None
+        if scheduler is not None:
+            scheduler.release()
+
+    def _on_dial_success(self, wrapper):
+        self._endpoint_deferred = None
+        self._proto = wrapper.wrappedProtocol
+        self._fire_waiters(self._connect_waiters, self._proto)
+        return self._proto
+
+    def _on_connect_failure(self, failure):
+        self.log.info("Cnxn to {peer} failed: {err}", peer=self._describe(), err=failure.getErrorMessage())
+        self.state = DISCONNECTED
+        self._endpoint_deferred = None
+        self._release_dial_slot()
+        if not failure.check(CancelledError, ConnectingCancelledError):
+            self.record_failure()
+        self._fail_waiters(failure)
+
+    @staticmethod
+    def _fire_waiters(waiters, result):
+        while waiters:
+            waiters.pop(0).callback(result)
+
+    def _fail_waiters(self, failure):
+        for waiters in (self._connect_waiters, self._ready_waiters):
+            while waiters:
+                waiters.pop(0).errback(failure)
+
+    def record_failure(self):
+        """
+        Notes a failed connection attempt (or an unresponsive connection) and
+        pushes back the earliest time at which we'll try this peer again.
+        """
+        self.failures += 1
+        backoff = min(self.backoff_base * 2**(self.failures - 1), self.backoff_max)
+        self.retry_at = self._clock.seconds() + backoff
+
+        if self.circuit is HALF_OPEN or self.failures >= self.circuit_threshold:
+            if self.circuit is not OPEN:
+                self.log.info("Opening circuit for {peer} after {n} failure(s)", peer=self._describe(), n=self.failures)
+            self.circuit = OPEN
+
+    def record_success(self):
+        if self.circuit is not CLOSED:
+            self.log.info("Closing circuit for {peer}", peer=self._describe())
+        self.circuit = CLOSED
+        self.failures = 0
+        self.retry_at = 0
+
+    def is_reachable(self):
+        """
+        Returns False while the peer is backing off after a connection failure.
+        """
+        return self.failures == 0 or self._clock.seconds() >= self.retry_at
+
+    def is_dead(self):
+        return self.circuit is OPEN
+
+    def _describe(self):
+        return "{}:{}".format(self.host, self.info.get(LISTEN_PORT))
 
     @inlineCallbacks
     def on_connect(self, proto):
@@ -84,8 +247,12 @@ class PeerState(Factory):
         try:
             self.log.debug("{peer} - Updating state: connected", peer=proto.transport.getPeer())
             self.state = CONNECTED
+            self.last_seen = self.last_heard = self._clock.seconds()
+            self._release_dial_slot()
+            self.record_success()
             self.cnxn = proto
             self.host = proto.transport.getPeer().host
+            self._fire_waiters(self._ready_waiters, proto)
             if self.role is INITIATOR:
                 # make an introduction
                 self.log.debug("{peer} - Making introduction", peer=self.cnxn.transport.getPeer())
@@ -105,36 +272,92 @@ class PeerState(Factory):
         self.cnxn.transport.loseConnection()
 
     def on_disconnect(self):
+        self._release_dial_slot()
+        if self.role is INITIATOR and self.state is CONNECTING:
+            # our cnxn dropped before the handshake finished
+            self.log.info("Cnxn to {peer} lost before it was established", peer=self._describe())
+            self.record_failure()
+        self.state = DISCONNECTED
         self.cnxn = None
+        self._proto = None
         self._endpoint_deferred = None
-
-    def query(self, query_name, args, retries=2, timeout=None):
+        self.last_seen = self._clock.seconds()
+        self._fail_waiters(TheseusConnectionError("cnxn lost"))
+
+    def is_idle(self, max_age):
+        """
+        Returns True if we have no connection (or pending connection) to this
+        peer and haven't heard from it in at least max_age seconds.
+        """
+        return (self.state is DISCONNECTED and self._endpoint_deferred is None
+                and self._clock.seconds() - self.last_seen >= max_age)
+
+    def record_rtt(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75*self.rttvar + 0.25*abs(self.srtt - rtt)
+            self.srtt = 0.875*self.srtt + 0.125*rtt
+        self.rtt_samples.append(rtt)
+
+    def get_timeout(self):
+        if self.srtt is None:
+            return self.query_timeout
+        return min(max(self.srtt + 4*self.rttvar, self.min_timeout), self.max_timeout)
+
+    def get_rtt_percentile(self, p):
+        if not self.rtt_samples:
+            return None
+        samples = sorted(self.rtt_samples)
+        return samples[min(int(p * len(samples)), len(samples) - 1)]
+
+    def get_hedge_delay(self):
+        """
+        Returns how long a lookup should wait on this peer before hedging its
+        query to another candidate: our p90 RTT for the peer if we've measured
+        it, or half the current query timeout if not.
+        """
+        p90 = self.get_rtt_percentile(0.9)
+        return self.get_timeout() / 2 if p90 is None else p90
+
+    def _on_response(self, response, sent_at):
+        self.last_seen = self.last_heard = self._clock.seconds()
+        self.record_rtt(self.last_seen - sent_at)
+        return response
+
+    def query(self, query_name, args, retries=2, timeout=None, priority=INTERACTIVE):
         clock = self._clock
-        timeout = timeout or self.query_timeout
+        timeout = timeout or self.get_timeout()
 
         def errback(failure):
-            # retry, unless the error came from running out of retries or from cancellation
-            if failure.check(QueryRetriesExceededError, CancelledError):
-                self.log.debug("{peer} Query errback: Re-raising caught error {f}", peer=self.cnxn.transport.getPeer(), f=failure.getErrorMessage())
+            # retry, unless the error came from running out of retries, from
+            # cancellation, or from the peer being in connection backoff
+            if failure.check(QueryRetriesExceededError, CancelledError, PeerUnreachableError):
+                self.log.debug("{peer} Query errback: Re-raising caught error {f}", peer=self._describe(), f=failure.getErrorMessage())
                 failure.raiseException()
             self.log.debug("Errback on {name} query: {failure}. {n} retries left.", name=query_name, failure=failure.value, n=retries)
-            return self.query(query_name, args, retries-1)
+            # back off exponentially on timeouts, as with TCP retransmissions
+            next_timeout = max(timeout, min(2*timeout, self.max_timeout)) if failure.check(TwistedTimeoutError) else timeout
+            return self.query(query_name, args, retries-1, next_timeout, priority)
 
         def timeout_logger(failure):
             failure.trap(TwistedTimeoutError)
-            self.log.debug("{peer} - {name} query timed out", peer=self.cnxn.transport.getPeer(), name=query_name)
+            self.log.debug("{peer} - {name} query timed out", peer=self._describe(), name=query_name)
             return failure
 
         if retries < 0:
-            self.log.info("{peer} - {name} query failed (retries exceeded)", peer=self.cnxn.transport.getPeer(), name=query_name)
+            self.log.info("{peer} - {name} query failed (retries exceeded)", peer=self._describe(), name=query_name)
+            self.record_failure()
             return fail(QueryRetriesExceededError())
 
         if self.cnxn is None:
             self.log.debug("Attempting to connect to {host}:{port} to send {name} query", host=self.host, port=self.info[LISTEN_PORT], name=query_name)
-            d = self.connect()
-            d.addCallback(lambda _: self.query(query_name, args, retries-1))
+            d = self._when_ready(priority)
+            d.addCallback(lambda _: self.query(query_name, args, retries-1, priority=priority))
         else:
             d = self.cnxn.send_query(query_name, args)
+            d.addCallback(self._on_response, clock.seconds())
 
         d.addTimeout(timeout, clock)
         d.addErrback(timeout_logger)
@@ -163,33 +386,128 @@ class PeerState(Factory):
         return result
 
 
+class PeerRecord:
+    """
+    Compact stand-in for the PeerState of a peer we're not connected to and
+    haven't heard from in a while. Holds just enough to rebuild the PeerState
+    if the peer becomes relevant again.
+    """
+
+    __slots__ = ("host", "port", "key", "last_seen", "addrs", "failures", "retry_at", "dead", "srtt", "rttvar", "last_heard")
+
+    def __init__(self, host, port, key, last_seen, addrs=None, failures=0, retry_at=0, dead=False, srtt=None, rttvar=None, last_heard=None):
+        # key: bytes
+        # addrs: tuple of verified NodeAddresses, or None if unknown
+        self.host = host
+        self.port = port
+        self.key = key
+        self.last_seen = last_seen
+        self.addrs = addrs
+        self.failures = failures
+        self.retry_at = retry_at
+        self.dead = dead
+        self.srtt = srtt
+        self.rttvar = rttvar
+        self.last_heard = last_heard
+
+    def __repr__(self):
+        return "PeerRecord({}, {}, {})".format(self.host, self.port, self.key)
+
+    @classmethod
+    def from_state(cls, peer_state):
+        addrs = peer_state.info.get(ADDRS)
+        return cls(
+                peer_state.host,
+                peer_state.info[LISTEN_PORT],
+                peer_state.info[PEER_KEY].public_bytes,
+                peer_state.last_seen,
+                None if addrs is None else tuple(addrs),
+                peer_state.failures,
+                peer_state.retry_at,
+                peer_state.is_dead(),
+                peer_state.srtt,
+                peer_state.rttvar,
+                peer_state.last_heard,
+                )
+
+    def get_contact_info(self):
+        return ContactInfo(self.host, self.port, self.key)
+
+    def is_reachable(self):
+        return self.failures == 0 or PeerState._clock.seconds() >= self.retry_at
+
+    def is_dead(self):
+        return self.dead
+
+
 class PeerTracker(Factory):
     """
     Responsible for maintaining a registry of PeerState instances corresponding
     to remote peers.
+
+    PeerStates for peers that have gone idle are periodically demoted to
+    compact PeerRecords, and records which stay idle past expire_after are
+    dropped unless the routing table still references them.
     """
 
     log = Logger()
     protocol = DHTProtocol
 
+    sweep_interval = 60  # seconds
+    demote_after = 5*60  # seconds
+    expire_after = timeout_window
+
+    _clock = reactor
+
     def __init__(self, local_peer):
         self.local_peer = local_peer
 
         self.addr_to_contact = {}
         self.contact_to_state = {}
+        self.records = {}  # (host, port) -> PeerRecord
 
         self.subfactory = WrappingFactory.forProtocol(NoiseWrapper, Factory.forProtocol(self.protocol))
+        self.dial_scheduler = DialScheduler()
+        self.looper = LoopingCall(self.sweep)
+
+    def _maybe_start_sweeping(self):
+        if not self.looper.running:
+            self.looper.clock = self._clock
+            self.looper.start(self.sweep_interval, now=False)
+
+    def stop(self):
+        if self.looper.running:
+            self.looper.stop()
 
     def buildProtocol(self, addr):
+        if addr.host in self.local_peer.blacklist:
+            self.log.debug("Refusing cnxn with blacklisted host {host}", host=addr.host)
+            return None
+
         p = self.subfactory.buildProtocol(addr)
-        contact = self.addr_to_contact.get((addr.host, addr.port))
-        peer_state = self.contact_to_state.get(contact) or PeerState.from_proto(p.wrappedProtocol)
+        addr_tup = (addr.host, addr.port)
+        if addr_tup in self.records:
+            self._promote(addr_tup)
+        contact = self.addr_to_contact.get(addr_tup)
+        peer_state = self.contact_to_state.get(contact)
+        if peer_state is None:
+            peer_state = PeerState.from_proto(p.wrappedProtocol)
+            peer_state.subfactory = self
         p.wrappedProtocol.peer_state = peer_state
         p.wrappedProtocol.local_peer = self.local_peer
         return p
 
     def register_contact(self, contact_info, state=None):
         addr_tup = (contact_info.host, contact_info.port)
+        record = self.records.get(addr_tup)
+        if record is not None:
+            if record.key != contact_info.key_bytes:
+                self.log.warn("Tried to re-register {addr_tup} to {contact}", addr_tup=addr_tup, contact=contact_info)
+                raise DuplicateContactError()
+            if state is None:
+                return self._promote(addr_tup)
+            del self.records[addr_tup]
+
         if self.addr_to_contact.get(addr_tup, contact_info) != contact_info:
             self.log.warn("Tried to re-register {addr_tup} to {contact}", addr_tup=addr_tup, contact=contact_info)
             self.log.debug("new contact is {contact}; addr_to_contact is {val}", contact=contact_info, val=self.addr_to_contact)
@@ -202,13 +520,105 @@ class PeerTracker(Factory):
                 state = PeerState.from_contact(contact_info)
                 state.subfactory = self
             self.contact_to_state[contact_info] = state
+            self._maybe_start_sweeping()
 
         return self.contact_to_state[contact_info]
 
     def get(self, contact_info):
-        return self.contact_to_state.get(contact_info)
+        state = self.contact_to_state.get(contact_info)
+        if state is None and self._get_record(contact_info) is not None:
+            state = self._promote((contact_info.host, contact_info.port))
+        return state
+
+    def _get_record(self, contact_info):
+        record = self.records.get((contact_info.host, contact_info.port))
+        if record is not None and record.key == contact_info.key_bytes:
+            return record
+
+    def is_reachable(self, contact_info):
+        """
+        Returns False if the given contact is backing off after failed
+        connection attempts. Contacts we have no state for are presumed
+        reachable.
+        """
+        state = self.contact_to_state.get(contact_info) or self._get_record(contact_info)
+        return state is None or state.is_reachable()
+
+    def is_dead(self, contact_info):
+        """
+        Returns True if the given contact's circuit is open, i.e. if it has
+        failed enough consecutive connection attempts to be considered dead.
+        """
+        state = self.contact_to_state.get(contact_info) or self._get_record(contact_info)
+        return state is not None and state.is_dead()
+
+    def get_rtt(self, contact_info):
+        """
+        Returns our smoothed RTT estimate for the given contact, or None if
+        we haven't measured one.
+        """
+        state = self.contact_to_state.get(contact_info) or self._get_record(contact_info)
+        return None if state is None else state.srtt
+
+    def get_last_heard(self, contact_info):
+        """
+        Returns when the given contact last completed a cnxn or answered a
+        query, or None if it never has (as far as we know).
+        """
+        state = self.contact_to_state.get(contact_info) or self._get_record(contact_info)
+        return None if state is None else state.last_heard
+
+    def drop_cnxns(self, blacklist):
+        """
+        Closes any open cnxns with hosts in the given blacklist.
+        """
+        for wrapper in list(self.subfactory.protocols):
+            host = wrapper.transport.getPeer().host
+            if host in blacklist:
+                self.log.info("Dropping cnxn with blacklisted host {host}", host=host)
+                wrapper.transport.loseConnection()
 
     def get_from_addr(self, addr):
+        if addr in self.records:
+            return self._promote(addr)
         if addr not in self.addr_to_contact:
             return
         return self.contact_to_state[self.addr_to_contact[addr]]
+
+    def _promote(self, addr_tup):
+        record = self.records.pop(addr_tup)
+        state = PeerState.from_record(record)
+        state.subfactory = self
+        contact = state.get_contact_info()
+        self.addr_to_contact[addr_tup] = contact
+        self.contact_to_state[contact] = state
+        return state
+
+    def _demote(self, contact_info):
+        state = self.contact_to_state.pop(contact_info)
+        addr_tup = (contact_info.host, contact_info.port)
+        del self.addr_to_contact[addr_tup]
+        self.records[addr_tup] = PeerRecord.from_state(state)
+
+    def sweep(self):
+        """
+        Demotes idle PeerStates to PeerRecords, and drops records that have
+        been idle past expire_after and aren't referenced by the routing table.
+        """
+        idle = [contact for contact, state in self.contact_to_state.items() if state.is_idle(self.demote_after)]
+        for contact in idle:
+            self._demote(contact)
+
+        cutoff = self._clock.seconds() - self.expire_after
+        expired = [addr_tup for addr_tup, record in self.records.items() if record.last_seen <= cutoff]
+        if expired:
+            referenced = set((contact.host, contact.port) for contact in self.local_peer.routing_table.get_contacts())
+            expired = [addr_tup for addr_tup in expired if addr_tup not in referenced]
+            for addr_tup in expired:
+                del self.records[addr_tup]
+
+        self.log.debug("Peer tracker sweep: {d} state(s) demoted, {e} record(s) dropped. {s} states and {r} records remain.",
+                d=len(idle), e=len(expired), s=len(self.contact_to_state), r=len(self.records))
+
+        if not self.contact_to_state and not self.records and self.looper.running:
+            self.looper.stop()
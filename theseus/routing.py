@@ -1,49 +1,107 @@
 from twisted.logger import Logger
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks, succeed, fail
 
 from .constants import k, L
-from .nodeaddr import NodeAddress
+from .distance import to_int
+from .nodeaddr import NodeAddress, Preimage
 from .contactinfo import ContactInfo
 from .enums import UNSET
+from .timerwheel import TimerWheel
 
+from bisect import bisect_left, bisect_right
+from heapq import heapify, heappop
 from random import SystemRandom
 from socket import inet_ntoa
 
+import struct
+
 
 class RoutingEntry:
-    def __init__(self, contact_info, node_addr):
+    log = Logger()
+
+    # entries are compared and hashed constantly (bucket membership checks,
+    # lookup sets) so the hash is computed once, up front
+    __slots__ = ("contact_info", "node_addr", "last_seen", "expires_at", "_hash")
+
+    # preimage (timestamp, ip, entropy: 14 bytes), then addr (20 bytes), then
+    # port (2 bytes), then key (32 bytes): 68 bytes (!)
+    wire_format = struct.Struct("!4s4s6s20sH32s")
+
+    def __init__(self, contact_info, node_addr, last_seen=0):
         self.contact_info = contact_info
         self.node_addr = node_addr
+        self.last_seen = last_seen  # when we last heard from this contact
+        self.expires_at = node_addr.get_expiry()
+        self._hash = hash((contact_info, node_addr.addr, node_addr.preimage))
 
     def __repr__(self):
         return "RoutingEntry({}, {})".format(self.contact_info, self.node_addr)
 
-    def __key(self):
-        contact_key = (self.contact_info.host, self.contact_info.port, self.contact_info.key)
-        node_key = (self.node_addr.addr, self.node_addr.preimage)
-        return contact_key + node_key
-
     def __eq__(self, other):
-        return isinstance(other, self.__class__) and other.__key() == self.__key()
+        return isinstance(other, self.__class__) and self._hash == other._hash \
+                and self.node_addr.addr == other.node_addr.addr and self.contact_info == other.contact_info \
+                and self.node_addr.preimage == other.node_addr.preimage
 
     def __hash__(self):
-        return hash(self.__key())
+        return self._hash
 
     def as_bytes(self):
         # address (34 bytes), then port (2 bytes), then key (32 bytes): 68 bytes (!)
         port = self.contact_info.port
         port_bytes = bytes([port >> 8, port & 0xFF])
-        return self.node_addr.as_bytes() + port_bytes + self.contact_info.key.public_bytes
+        return self.node_addr.as_bytes() + port_bytes + self.contact_info.key_bytes
+
+    @classmethod
+    def parse(cls, bytestring):
+        """
+        Synchronously parses a wire-format routing entry without verifying its
+        node addr. Raises ValueError if the entry is malformed.
+        """
+        entries = cls.parse_nodes([bytestring])
+        if not entries:
+            raise ValueError("malformed RoutingEntry")
+        return entries[0]
+
+    @classmethod
+    def parse_nodes(cls, nodes):
+        """
+        Parses a list of wire-format routing entries, e.g. from a 'find'
+        response, in one synchronous pass. Node addrs are not verified.
+        Malformed entries are skipped.
+        """
+        # this is on the hot path for lookups, so it's written for speed
+        unpack = cls.wire_format.unpack
+        entries = []
+        for bytestring in nodes:
+            try:
+                ts_bytes, ip_addr, entropy, addr, port, key_bytes = unpack(bytestring)
+                contact = ContactInfo(inet_ntoa(ip_addr), port, key_bytes)
+            except (struct.error, ValueError, TypeError):
+                cls.log.debug("Skipping malformed routing entry {entry}", entry=bytestring)
+                continue
+            entries.append(cls(contact, NodeAddress(addr, Preimage(ts_bytes, ip_addr, entropy), verified=False)))
+        return entries
 
     @classmethod
-    @inlineCallbacks
     def from_bytes(cls, bytestring, trusted=False, priority=UNSET):
-        # address (34 bytes), then port (2 bytes), then key (32 bytes): 68 bytes (!)
+        # returns a Deferred. trusted entries are parsed right away; untrusted
+        # ones wait on verification of their node addrs.
+        if trusted:
+            try:
+                return succeed(cls.parse(bytestring))
+            except ValueError:
+                return fail()
+        return cls._from_untrusted_bytes(bytestring, priority)
+
+    @classmethod
+    @inlineCallbacks
+    def _from_untrusted_bytes(cls, bytestring, priority):
         if len(bytestring) != 68:
-            raise Exception("wrong number of bytes for RoutingEntry (68 expected)")
+            raise ValueError("wrong number of bytes for RoutingEntry (68 expected)")
 
         addr_bytes, port_bytes, key_bytes = bytestring[:34], bytestring[34:36], bytestring[36:]
-        address = yield NodeAddress.from_bytes(addr_bytes, trusted, priority)
+        address = yield NodeAddress.from_bytes(addr_bytes, False, priority)
 
         ip = inet_ntoa(address.preimage.ip_addr)
         port = (port_bytes[0] << 8) + port_bytes[1]
@@ -59,14 +117,21 @@ class RoutingTable:
     L = L
 
     _rng = SystemRandom()
+    _clock = reactor
 
     class Bucket:
-        def __init__(self, lower, upper, k):
+        def __init__(self, lower, upper, k, on_drop=None):
+            # on_drop: optional callable taking each entry the bucket lets go
+            # of without it being removed from the table (e.g. an evicted
+            # dead entry or a surplus replacement)
             self.lower = lower
             self.upper = upper
             self.k = k
+            self.on_drop = on_drop
 
             self.contents = []
+            self.replacements = []  # entries that didn't fit, most recent last
+            self.last_activity = RoutingTable._clock.seconds()  # last insert, touch or lookup in range
             self.left_child = None
             self.right_child = None
 
@@ -78,22 +143,25 @@ class RoutingTable:
                 yield from self.left_child
                 yield from self.right_child
 
-        def insert(self, entry, local_addrs=None, quiet=False):
-            # TODO if insert succeeds, add a timer to clean up the node ID when it expires
+        def insert(self, entry, local_addrs=None, quiet=False, is_dead=None):
             # NOTE: returns True if insert succeeds _or_ entry is already in table
+            # is_dead: optional callable taking a ContactInfo; entries whose
+            # contacts it flags may be evicted to make room in a full bucket
 
-            local_addrs = [node_addr for node_addr in (local_addrs or []) if self.covers(node_addr.addr)]
+            local_addrs = [node_addr for node_addr in (local_addrs or []) if self.covers(node_addr.addr_int)]
 
             if self.contents is None:
                 # bucket is split
-                if self.left_child.covers(entry.node_addr.addr):
-                    return self.left_child.insert(entry, local_addrs, quiet=quiet)
-                return self.right_child.insert(entry, local_addrs, quiet=quiet)
+                if self.left_child.covers(entry.node_addr.addr_int):
+                    return self.left_child.insert(entry, local_addrs, quiet=quiet, is_dead=is_dead)
+                return self.right_child.insert(entry, local_addrs, quiet=quiet, is_dead=is_dead)
+
+            if entry in self.contents:
+                return True
 
             if len(self.contents) < self.k:
                 # bucket has room
-                if entry not in self.contents:
-                    self.contents.append(entry)
+                self.contents.append(entry)
                 if not quiet:
                     RoutingTable.log.debug("Routing insert succeeded for {entry}", entry=entry)
                 return True
@@ -101,38 +169,85 @@ class RoutingTable:
             if local_addrs:
                 # bucket has no room, but can be split
                 self.split()
-                return self.insert(entry, local_addrs)
+                return self.insert(entry, local_addrs, is_dead=is_dead)
+
+            if is_dead is not None:
+                # bucket has no room and can't be split, but may be holding dead weight
+                for i, existing in enumerate(self.contents):
+                    if is_dead(existing.contact_info):
+                        self.contents[i] = entry
+                        self._drop(existing)
+                        if not quiet:
+                            RoutingTable.log.debug("Routing insert succeeded for {entry} by evicting dead entry {dead}", entry=entry, dead=existing)
+                        return True
 
             if not quiet:
-                RoutingTable.log.debug("Routing insert failed for {entry}", entry=entry)
+                RoutingTable.log.debug("Routing insert failed for {entry}; keeping it as a replacement", entry=entry)
+            self.add_replacement(entry)
             return False
 
+        def add_replacement(self, entry):
+            if entry in self.contents:
+                return
+            if entry in self.replacements:
+                self.replacements.remove(entry)
+            self.replacements.append(entry)
+            for dropped in self.replacements[:-self.k]:
+                self._drop(dropped)
+            del self.replacements[:-self.k]
+
+        def _drop(self, entry):
+            if self.on_drop is not None:
+                self.on_drop(entry)
+
+        def fill(self):
+            """
+            Moves replacements into the bucket while it has room, most recently
+            seen first.
+            """
+            while self.replacements and len(self.contents) < self.k:
+                self.contents.append(self.replacements.pop())
+
+        def adopt(self, contents, replacements=()):
+            """
+            Takes over whichever of the given entries fall within this bucket's
+            range, e.g. after a split or merge. Entries past the bucket's
+            capacity are kept as replacements.
+            """
+            contents = [entry for entry in contents if self.covers(entry.node_addr.addr_int)]
+            self.contents = contents[:self.k]
+            self.replacements = []
+            for entry in replacements:
+                if self.covers(entry.node_addr.addr_int):
+                    self.add_replacement(entry)
+            for entry in contents[self.k:]:
+                self.add_replacement(entry)
+            self.fill()
+
         def split(self):
             bisector = (self.lower + self.upper) // 2
             RoutingTable.log.debug("Splitting bucket 0x{low}~0x{high} into 0x{low}~0x{mid} and 0x{mid}~0x{high}", low=hex(self.lower), mid=hex(bisector), high=hex(self.upper))
-            contents = self.contents
+            self.left_child = RoutingTable.Bucket(self.lower, bisector, self.k, self.on_drop)
+            self.right_child = RoutingTable.Bucket(bisector + 1, self.upper, self.k, self.on_drop)
+            for child in (self.left_child, self.right_child):
+                child.adopt(self.contents, self.replacements)
             self.contents = None
-            self.left_child = RoutingTable.Bucket(self.lower, bisector, self.k)
-            self.right_child = RoutingTable.Bucket(bisector + 1, self.upper, self.k)
-            for entry in contents:
-                self.insert(entry, [], quiet=True)  # we don't need local addrs here b/c we know there'll be room in the split buckets
+            self.replacements = None
 
-        def covers(self, addr: bytes):
-            return self.lower <= RoutingTable.bytes_to_int(addr) <= self.upper
-
-        def query(self, addr):
-            addr_int = RoutingTable.bytes_to_int(addr)
+        def covers(self, addr_int: int):
+            return self.lower <= addr_int <= self.upper
 
+        def query(self, addr_int: int):
             if self.contents is not None:
                 yield from sorted(self.contents,
-                        key=lambda entry: addr_int ^ RoutingTable.bytes_to_int(entry.node_addr.addr))
+                        key=lambda entry: addr_int ^ entry.node_addr.addr_int)
             else:
                 if addr_int & (self.left_child.lower ^ self.right_child.lower):
                     closer, further = self.right_child, self.left_child
                 else:
                     closer, further = self.left_child, self.right_child
-                yield from closer.query(addr)
-                yield from further.query(addr)
+                yield from closer.query(addr_int)
+                yield from further.query(addr_int)
 
         def get_contents(self):
             if self.contents is not None:
@@ -159,52 +274,354 @@ class RoutingTable:
 #                        print(entry)
 #                    print(spacing + "({} entries)".format(len(self.contents)))
 
-    def __init__(self, local_addrs=None):
+    def __init__(self, local_addrs=None, is_dead=None, get_rtt=None):
+        # get_rtt: optional callable taking a ContactInfo and returning our
+        # RTT estimate for it, or None; used to break ties in queries
         self.local_addrs = local_addrs or []
-        self.root = self.Bucket(0, 2**self.L - 1, self.k)
+        self.is_dead = is_dead
+        self.get_rtt = get_rtt
+        self.expiries = TimerWheel()  # every entry we're holding, by node addr expiry
+        self._reset()
+
+    def __iter__(self):
+        yield from self.root
+
+    def __contains__(self, entry):
+        # true for replacements as well as bucket contents
+        bucket = self._bucket_for(entry.node_addr.addr_int)
+        return entry in bucket.contents or entry in bucket.replacements
+
+    def _reset(self):
+        self.root = self.Bucket(0, 2**self.L - 1, self.k, self.expiries.discard)
+
+    def _insert(self, entry, quiet=False):
+        return self.root.insert(entry, self.local_addrs, quiet=quiet, is_dead=self.is_dead)
+
+    def _closest(self, addr_int):
+        # yields entries in order of increasing distance from addr_int
+        return self.root.query(addr_int)
 
     def query(self, addr, lookup_size=None):
         lookup_size = lookup_size or self.k
+        addr_int = to_int(addr)
         peers = set()
         results = []
+        cutoff = None  # prefix tier of the lookup_size'th result
+
+        # the wheel may report expiries a little late, so entries are also
+        # checked individually; remote peers would reject expired ones
+        now = self._clock.seconds()
+        self.expire(now)
 
-        for entry in self.root.query(addr):
-            if entry.contact_info not in peers:
-                peers.add(entry.contact_info)
-                results.append(entry)
+        for entry in self._closest(addr_int):
+            if entry.expires_at < now or entry.contact_info in peers:
+                continue
             if len(results) == lookup_size:
-                break
+                if self.get_rtt is None:
+                    break
+                cutoff = (addr_int ^ results[-1].node_addr.addr_int).bit_length()
+            if cutoff is not None:
+                # past the cutoff, keep gathering (a bounded number of) the
+                # entries in its tier, so that the fastest of them can be used
+                if (addr_int ^ entry.node_addr.addr_int).bit_length() != cutoff or len(results) == 2*lookup_size:
+                    break
+            peers.add(entry.contact_info)
+            results.append(entry)
+
+        if len(results) > lookup_size:
+            results = self._prefer_fast(results, lookup_size, addr_int, cutoff)
         return results
 
-    def insert(self, contact_info, node_addr):
-        entry = RoutingEntry(contact_info, node_addr)
+    def _prefer_fast(self, results, lookup_size, addr_int, cutoff):
+        # results are in order of distance; trims them to lookup_size by
+        # dropping the slowest entries in the cutoff tier. entries with
+        # measured RTTs are preferred to those without.
+        start = 0
+        while (addr_int ^ results[start].node_addr.addr_int).bit_length() != cutoff:
+            start += 1
+
+        def key(entry):
+            rtt = self.get_rtt(entry.contact_info)
+            return (rtt is None, rtt or 0)
+
+        keep = set(sorted(results[start:], key=key)[:lookup_size - start])
+        return results[:start] + [entry for entry in results[start:] if entry in keep]
+
+    def insert(self, contact_info, node_addr, last_seen=None):
+        now = self._clock.seconds()
+        entry = RoutingEntry(contact_info, node_addr, now if last_seen is None else last_seen)
+        if entry.expires_at < now:
+            self.log.debug("Rejecting routing insert for {entry}: node addr has expired", entry=entry)
+            return False
+
         self.log.debug("Trying an insert for {entry} with local addrs {addrs}", entry=entry, addrs=self.local_addrs)
-        return self.root.insert(entry, self.local_addrs)
+        self._track(entry)
+        result = self._insert(entry)
+        if result:
+            self._bucket_for(node_addr.addr_int).last_activity = self._clock.seconds()
+        return result
+
+    def has_room(self, addr_int):
+        """
+        Checks whether an insert for addr_int could go into a bucket right
+        away, rather than ending up as a replacement.
+        """
+        bucket = self._bucket_for(addr_int)
+        return len(bucket.contents) < bucket.k or any(bucket.covers(node_addr.addr_int) for node_addr in self.local_addrs)
+
+    def mark_active(self, addr):
+        """
+        Notes that a lookup was run for an addr (given as bytes), which counts
+        as activity for the bucket covering it.
+        """
+        self._bucket_for(to_int(addr)).last_activity = self._clock.seconds()
+
+    def get_stale_buckets(self, active_before):
+        """
+        Returns the buckets with no activity since active_before, least
+        recently active first.
+        """
+        stale = [bucket for bucket in self._leaves() if bucket.last_activity <= active_before]
+        return sorted(stale, key=lambda bucket: bucket.last_activity)
+
+    def touch(self, entry):
+        """
+        Marks an entry as just seen, moving it to the back of its bucket.
+        """
+        bucket = self._bucket_for(entry.node_addr.addr_int)
+        if entry in bucket.contents:
+            entry = bucket.contents.pop(bucket.contents.index(entry))
+            entry.last_seen = bucket.last_activity = self._clock.seconds()
+            bucket.contents.append(entry)
+
+    def remove(self, entry):
+        """
+        Drops an entry (e.g. because its contact stopped responding) and
+        promotes a replacement into its place, if there is one.
+        """
+        self.expiries.discard(entry)
+        bucket = self._bucket_for(entry.node_addr.addr_int)
+        if entry in bucket.contents:
+            self.log.debug("Removing routing entry {entry}", entry=entry)
+            bucket.contents.remove(entry)
+            bucket.fill()
+        elif entry in bucket.replacements:
+            bucket.replacements.remove(entry)
+
+    def expire(self, now=None):
+        """
+        Removes entries whose node addrs have expired, promoting replacements
+        in their place.
+        """
+        now = self._clock.seconds() if now is None else now
+        for entry in self.expiries.pop_expired(now):
+            self.log.debug("Routing entry {entry} has expired", entry=entry)
+            self.remove(entry)
+
+    def _track(self, entry):
+        if entry.expires_at != float('inf'):
+            self.expiries.add(entry, entry.expires_at)
+
+    def get_stalest(self, seen_before):
+        """
+        Returns the least recently seen entry not seen since seen_before, or
+        None if every entry has been seen since then.
+        """
+        stalest = None
+        for bucket in self._leaves():
+            for entry in bucket.contents:
+                if entry.last_seen <= seen_before and (stalest is None or entry.last_seen < stalest.last_seen):
+                    stalest = entry
+        return stalest
+
+    def get_contents(self):
+        return self.root.get_contents()
+
+    def get_contacts(self):
+        return set(entry.contact_info for entry in self)
+
+    def get_replacements(self):
+        return [entry for bucket in self._leaves() for entry in bucket.replacements]
+
+    def _bucket_for(self, addr_int):
+        bucket = self.root
+        while bucket.contents is None:
+            bucket = bucket.left_child if bucket.left_child.covers(addr_int) else bucket.right_child
+        return bucket
+
+    def _leaves(self):
+        def walk(bucket):
+            if bucket.contents is not None:
+                yield bucket
+            else:
+                yield from walk(bucket.left_child)
+                yield from walk(bucket.right_child)
+        return walk(self.root)
 
     def reload(self, new_addrs=None, new_peers=None):
         # to be called after a local addr is replaced
+        # new_peers: optional iterable of RoutingEntries to (try to) insert,
+        # e.g. peers whose inserts were previously denied but which we might
+        # accept now
         self.log.debug("Reloading routing table.")
         self.log.debug("New addrs: {new}", new=new_addrs)
         self.local_addrs = new_addrs or []
 
-        contents = self.root.get_contents()
+        contents = self.get_contents()
+        replacements = self.get_replacements()
         self._rng.shuffle(contents)
-        self.root = self.Bucket(0, 2**self.L - 1, self.k)
-        for entry in contents:
-            self.root.insert(entry, self.local_addrs, quiet=True)
-
-        # TODO figure out how new_peers will be formatted. loop through values and (try to) insert them
-        # (to support this, make sure that we gracefully handle attempted duplicate inserts)
-        # this allows us to catch peers whose inserts were previously denied but which we might accept now
-        for peer in new_peers or []:
-            pass # TODO
-
-        self.log.debug("New contents: {new}", new=[node for node in self.root])
-
-    @staticmethod
-    def bytes_to_int(bytestring):
-        n = 0
-        for byte in bytestring:
-            n <<= 8
-            n += byte
-        return n
+        self._reset()
+        new_peers = list(new_peers or [])
+        for entry in new_peers:
+            self._track(entry)
+        for entry in contents + replacements + new_peers:
+            self._insert(entry, quiet=True)
+
+        self.log.debug("New contents: {new}", new=[node for node in self])
+
+
+class FlatRoutingTable(RoutingTable):
+    """
+    Routing table engine which keeps its leaf buckets in a flat list, sorted by
+    range, instead of in a tree. The bucket covering an address is found by
+    bisecting the buckets' lower bounds.
+
+    k-closest queries start from the target's bucket and walk outward one XOR
+    prefix tier at a time: every entry in the sibling region at a given prefix
+    length is closer to the target than every entry beyond it. Tiers are only
+    ordered as they're reached, so a query only pays for the tiers it needs to
+    fill its result set.
+
+    Reloads are incremental: only the buckets around added or removed local
+    addrs are touched.
+    """
+
+    sort_threshold = 4*k
+
+    def __iter__(self):
+        for bucket in self.buckets:
+            yield from bucket.contents
+
+    def _reset(self):
+        self.buckets = [self.Bucket(0, 2**self.L - 1, self.k, self.expiries.discard)]
+        self.bounds = [0]  # lower bound of each bucket, for bisection
+
+    def _leaves(self):
+        return iter(self.buckets)
+
+    def _find(self, addr_int):
+        return bisect_right(self.bounds, addr_int) - 1
+
+    def _bucket_for(self, addr_int):
+        return self.buckets[self._find(addr_int)]
+
+    def _covers_local(self, bucket):
+        return any(bucket.covers(node_addr.addr_int) for node_addr in self.local_addrs)
+
+    def _insert(self, entry, quiet=False):
+        addr_int = entry.node_addr.addr_int
+        while True:
+            i = self._find(addr_int)
+            bucket = self.buckets[i]
+            if len(bucket.contents) >= bucket.k and self._covers_local(bucket) and entry not in bucket.contents:
+                self._split(i)
+                continue
+            return bucket.insert(entry, quiet=quiet, is_dead=self.is_dead)
+
+    def _split(self, i):
+        bucket = self.buckets[i]
+        bisector = (bucket.lower + bucket.upper) // 2
+        self.log.debug("Splitting bucket 0x{low}~0x{high} into 0x{low}~0x{mid} and 0x{mid}~0x{high}", low=hex(bucket.lower), mid=hex(bisector), high=hex(bucket.upper))
+        left = self.Bucket(bucket.lower, bisector, self.k, self.expiries.discard)
+        right = self.Bucket(bisector + 1, bucket.upper, self.k, self.expiries.discard)
+        for child in (left, right):
+            child.adopt(bucket.contents, bucket.replacements)
+        self.buckets[i:i+1] = [left, right]
+        self.bounds.insert(i+1, bisector + 1)
+
+    def _merge(self, start, end):
+        buckets = self.buckets[start:end]
+        merged = self.Bucket(buckets[0].lower, buckets[-1].upper, self.k, self.expiries.discard)
+        self.log.debug("Merging {n} buckets into 0x{low}~0x{high}", n=len(buckets), low=hex(merged.lower), high=hex(merged.upper))
+        merged.adopt([entry for bucket in buckets for entry in bucket.contents],
+                     [entry for bucket in buckets for entry in bucket.replacements])
+        self.buckets[start:end] = [merged]
+        del self.bounds[start+1:end]
+
+    def _covers_local_range(self, lower, upper):
+        return any(lower <= node_addr.addr_int <= upper for node_addr in self.local_addrs)
+
+    def _collapse(self, addr_int):
+        # merges the buckets around a former local addr back into the widest
+        # aligned region that no longer covers any local addr
+        bucket = self.buckets[self._find(addr_int)]
+        lower, upper = bucket.lower, bucket.upper
+        for j in range((upper - lower).bit_length() + 1, self.L + 1):
+            wider_lower = (addr_int >> j) << j
+            wider_upper = wider_lower + (1 << j) - 1
+            if self._covers_local_range(wider_lower, wider_upper):
+                break
+            lower, upper = wider_lower, wider_upper
+
+        start, end = bisect_left(self.bounds, lower), bisect_right(self.bounds, upper)
+        if end - start > 1:
+            self._merge(start, end)
+
+    def reload(self, new_addrs=None, new_peers=None):
+        new_addrs = new_addrs or []
+        self.log.debug("Reloading routing table. New addrs: {new}", new=new_addrs)
+
+        old_ints = set(node_addr.addr_int for node_addr in self.local_addrs)
+        new_ints = set(node_addr.addr_int for node_addr in new_addrs)
+        self.local_addrs = new_addrs
+
+        for addr_int in old_ints - new_ints:
+            self._collapse(addr_int)
+
+        # buckets around a new local addr may now be splittable, so give
+        # their replacements another shot
+        for addr_int in new_ints - old_ints:
+            bucket = self.buckets[self._find(addr_int)]
+            pending, bucket.replacements = bucket.replacements, []
+            for entry in reversed(pending):
+                self._insert(entry, quiet=True)
+
+        for entry in new_peers or []:
+            self._track(entry)
+            self._insert(entry, quiet=True)
+
+    def _closest(self, addr_int):
+        lo = hi = self._find(addr_int)
+        bucket = self.buckets[lo]
+        yield from self._by_distance(bucket.contents, addr_int)
+
+        # buckets[lo:hi+1] cover an aligned block of 2**level addrs around
+        # addr_int. widening that block one bit at a time adds a sibling
+        # region, on one side or the other, whose entries are all further
+        # away than anything already yielded.
+        level = (bucket.upper - bucket.lower).bit_length()
+        for j in range(level, self.L):
+            lower = ((addr_int >> j) ^ 1) << j
+            if lower > addr_int:
+                end = bisect_right(self.bounds, lower + (1 << j) - 1, hi + 1)
+                tier, hi = self.buckets[hi+1:end], end - 1
+            else:
+                start = bisect_left(self.bounds, lower, 0, lo)
+                tier, lo = self.buckets[start:lo], start
+            if len(tier) == 1:
+                yield from self._by_distance(tier[0].contents, addr_int)
+            else:
+                yield from self._by_distance([entry for bucket in tier for entry in bucket.contents], addr_int)
+
+    def _by_distance(self, entries, addr_int):
+        # small tiers are cheapest to sort outright. big ones are drained
+        # through a heap so that we only pay for the entries we consume.
+        if len(entries) <= self.sort_threshold:
+            return sorted(entries, key=lambda entry: addr_int ^ entry.node_addr.addr_int)
+        heap = [(addr_int ^ entry.node_addr.addr_int, i, entry) for i, entry in enumerate(entries)]
+        heapify(heap)
+        return (heappop(heap)[2] for _ in range(len(heap)))
+
+    def get_contents(self):
+        return [entry for bucket in self.buckets
+                for entry in sorted(bucket.contents, key=lambda entry: entry.node_addr.addr)]
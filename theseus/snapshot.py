@@ -0,0 +1,175 @@
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+from twisted.logger import Logger
+
+from .enums import LOW
+from .errors import ValidationError
+from .nodeaddr import NodeAddress
+from .routing import RoutingEntry
+
+from collections import namedtuple
+
+import os
+import struct
+import tempfile
+
+
+SavedState = namedtuple("SavedState", ("private_key", "entries"))
+
+
+class RoutingSnapshot:
+    """
+    Periodically saves the peer's private key and routing table to disk, so a
+    restarted peer can skip bootstrapping and start lookups right away.
+
+    The snapshot is a small binary file: a header carrying a magic number,
+    format version, save time, the 32-byte private key and an entry count,
+    followed by one record per routing entry holding its 68-byte wire form,
+    its last-seen time and whether its node addr has been verified. Snapshots
+    are written to a temp file and moved into place, so a crash mid-write
+    can't leave a truncated snapshot behind.
+
+    Restored entries are usable immediately. Any whose addrs weren't verified
+    when the snapshot was taken are verified in the background at LOW hash
+    priority, and dropped from the routing table if they fail.
+    """
+
+    log = Logger()
+
+    interval = 5*60  # seconds between saves
+
+    magic = b'THRS'
+    version = 1
+    header = struct.Struct("!4sBd32sI")
+    record = struct.Struct("!68sd?")
+
+    _clock = reactor
+
+    def __init__(self, local_peer, path):
+        self.local_peer = local_peer
+        self.path = path
+        self.looper = LoopingCall(self.save)
+        self.restored = []  # entries to re-offer once we have local addrs
+        self.unverified = []
+
+    def start(self):
+        if self.path is not None and not self.looper.running:
+            self.looper.clock = self._clock
+            self.looper.start(self.interval, now=False)
+
+    def stop(self):
+        if self.looper.running:
+            self.looper.stop()
+
+    def save(self):
+        """
+        Writes the peer key and routing table to disk, atomically replacing
+        any existing snapshot.
+        """
+        if self.path is None:
+            return
+
+        entries = list(self.local_peer.routing_table)
+        chunks = [self.header.pack(self.magic, self.version, self._clock.seconds(), self.local_peer.private_key, len(entries))]
+        chunks.extend(self.record.pack(entry.as_bytes(), entry.last_seen, entry.node_addr.verified) for entry in entries)
+
+        # each save gets a temp file of its own, so concurrent saves (e.g.
+        # from several peers misconfigured to share a path) can't clobber
+        # each other's half-written files
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".",
+                                            prefix=os.path.basename(self.path) + ".", suffix=".tmp")
+        except OSError:
+            self.log.failure("Failed to save routing snapshot to {path}", path=self.path)
+            return
+
+        try:
+            with os.fdopen(fd, "wb") as f:  # mkstemp makes it owner-only, as it holds our private key
+                f.write(b''.join(chunks))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except OSError:
+            self.log.failure("Failed to save routing snapshot to {path}", path=self.path)
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+        else:
+            self.log.debug("Saved routing snapshot with {n} entries to {path}", n=len(entries), path=self.path)
+
+    def load(self):
+        """
+        Reads the snapshot from disk. Returns a SavedState, or None if there is
+        no usable snapshot. Entries whose node addrs have expired are skipped.
+        """
+        if self.path is None or not os.path.exists(self.path):
+            return None
+
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+            magic, version, _, private_key, count = self.header.unpack_from(data)
+            if magic != self.magic or version != self.version:
+                raise ValueError("unrecognized snapshot format")
+            if len(data) != self.header.size + count*self.record.size:
+                raise ValueError("snapshot is truncated")
+        except (OSError, ValueError, struct.error) as e:
+            self.log.warn("Ignoring unusable routing snapshot at {path}: {err}", path=self.path, err=e)
+            return None
+
+        entries = []
+        for entry_bytes, last_seen, verified in self.record.iter_unpack(memoryview(data)[self.header.size:]):
+            try:
+                entry = RoutingEntry.parse(entry_bytes)
+            except ValueError as e:
+                self.log.warn("Skipping bad routing snapshot record: {err}", err=e)
+                continue
+            if NodeAddress.check_timestamp(NodeAddress._ts_bytes_to_int(entry.node_addr.preimage.ts_bytes)):
+                entry.last_seen = last_seen
+                entry.node_addr.verified = verified
+                entries.append(entry)
+
+        self.log.info("Loaded routing snapshot from {path}: {n} usable entries", path=self.path, n=len(entries))
+        return SavedState(private_key, entries)
+
+    def restore(self, entries):
+        """
+        Inserts previously saved entries into the routing table. Until the
+        peer has local addrs, the table can only hold a single bucket's worth,
+        so the entries are also kept in `restored` to be offered again on the
+        first reload.
+        """
+        routing_table = self.local_peer.routing_table
+        for entry in entries:
+            routing_table.insert(entry.contact_info, entry.node_addr, entry.last_seen)
+        self.restored = list(entries)
+        self.unverified = [entry for entry in entries if not entry.node_addr.verified]
+
+    def verify(self):
+        """
+        Starts background verification of restored entries whose node addrs
+        haven't been checked yet.
+        """
+        unverified, self.unverified = self.unverified, []
+        for entry in unverified:
+            d = NodeAddress.from_preimage(entry.node_addr.addr, entry.node_addr.preimage, priority=LOW)
+            d.addCallbacks(self._on_verified, self._on_invalid, callbackArgs=(entry,), errbackArgs=(entry,))
+
+    def _on_verified(self, node_addr, entry):
+        # from_preimage doesn't check the image against the addr we were given
+        # yet, so we do that here
+        if node_addr.addr != entry.node_addr.addr:
+            self._drop(entry)
+        else:
+            entry.node_addr.verified = True
+
+    def _on_invalid(self, failure, entry):
+        failure.trap(ValidationError)
+        self._drop(entry)
+
+    def _drop(self, entry):
+        self.log.info("Restored routing entry {entry} failed verification", entry=entry)
+        self.local_peer.routing_table.remove(entry)
+        if entry in self.restored:
+            self.restored.remove(entry)
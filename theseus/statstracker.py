@@ -1,11 +1,13 @@
 from random import SystemRandom
 from collections import deque
+from math import ceil
 from time import clock
 
 from twisted.logger import Logger
 
 from .errors import NotEnoughLookupsError
 from .constants import k, L
+from .distance import to_int, distance
 
 
 class StatsTracker:
@@ -14,19 +16,13 @@ class StatsTracker:
     _clock = clock
     time_window = 3600
     min_sample_size = 3
+    min_queries = 20  # 'find' queries needed before the loss rate is trusted
 
     def __init__(self, local_peer):
         self.measurements = deque(maxlen=1024)
+        self.query_outcomes = deque(maxlen=256)  # (queries sent, queries failed) per lookup
         self.local_peer = local_peer
 
-    @staticmethod
-    def _xor(addr1, addr2):
-        n = 0
-        for i, byte in enumerate(addr1):
-            n <<= 8
-            n += byte ^ addr2[i]
-        return n
-
     def start(self):
         ...  # TODO recurring lookups for addrs from self._rand
 
@@ -34,7 +30,7 @@ class StatsTracker:
         ...  # TODO stop recurring lookups
 
     def trim_old_measurements(self):
-        while self._clock() - self.measurements[0][0] > self.time_window:
+        while self.measurements and self._clock() - self.measurements[0][0] > self.time_window:
             self.measurements.popleft()
 
     def get_size(self):
@@ -50,24 +46,84 @@ class StatsTracker:
         for ts, distances in self.measurements:
             for i, d in enumerate(distances):
                 d_i[i] += d / sample_size
-        estimate = k*(k+1)*(2*k+1) / (6*sum(i*d/2**L for i, d in enumerate(d_i, 1)))
+        denominator = 6*sum(i*d/2**L for i, d in enumerate(d_i, 1))
+        if denominator == 0:
+            self.log.debug("Size estimate samples are degenerate")
+            raise NotEnoughLookupsError
+        estimate = k*(k+1)*(2*k+1) / denominator
         self.log.debug("Current network size estimate: {n}", n=estimate)
         return estimate
 
+    def record_queries(self, sent, failed):
+        """
+        Notes how many of a finished lookup's 'find' queries failed.
+        """
+        if sent:
+            self.query_outcomes.append((sent, failed))
+
+    def get_loss_rate(self):
+        """
+        Returns the fraction of recent lookup queries that failed, or 0 if
+        there haven't been enough queries to say.
+        """
+        sent = sum(sent for sent, _ in self.query_outcomes)
+        if sent < self.min_queries:
+            return 0.0
+        return sum(failed for _, failed in self.query_outcomes) / sent
+
+    def get_lookup_params(self):
+        """
+        Suggests lookup concurrency (alpha) and shortlist size for the
+        current network size estimate and query loss rate. Larger networks
+        take more hops, so they get more queries in flight at each one;
+        lossy networks get more again, so that about as many queries are
+        answered. The shortlist never holds more than the whole network.
+        Returns an empty dict (i.e. use the defaults) if there's no size
+        estimate to go on.
+        """
+        try:
+            size = self.get_size()
+        except NotEnoughLookupsError:
+            return {}
+
+        if size < 10**4:
+            alpha = 3
+        elif size < 10**6:
+            alpha = 4
+        else:
+            alpha = 5
+
+        reliability = max(1 - self.get_loss_rate(), 0.25)
+        alpha = min(ceil(alpha / reliability), 8)
+        shortlist_size = min(ceil(4*k / reliability), 8*k, max(k, int(size)))
+        return {"alpha": alpha, "shortlist_size": shortlist_size}
+
+    def record_lookup(self, addr, nodes):
+        """
+        Adds a finished lookup's results to the size estimate's samples.
+        Results with fewer than k nodes (e.g. from lookups which timed out or
+        whose queries all failed) would skew the estimate, so they're skipped.
+        """
+        if len(nodes) < k:
+            self.log.debug("Not sampling lookup for {addr}: only {n} results", addr=addr.hex(), n=len(nodes))
+            return
+        addr_int = to_int(addr)
+        distances = sorted(
+            distance(addr_int, routing_entry.node_addr)
+            for routing_entry in nodes
+        )
+        self.measurements.append((self._clock(), distances[:k]))
+        self.trim_old_measurements()
+        try:
+            n = self.get_size()
+            self.log.debug("Lookup recorded. Current size estimate: {n}", n=n)
+        except NotEnoughLookupsError:
+            self.log.debug("Not enough lookups to make a size estimate...")
+
     def register_lookup(self, d, addr):
         def cb(nodes):
             self.log.debug("Callback on lookup for {addr} starting.", addr=addr.hex())
-            distances = sorted(
-                self._xor(addr, routing_entry.node_addr.addr)
-                for routing_entry in nodes
-            )
-            self.measurements.append((self._clock(), distances))
-            self.trim_old_measurements()
-            try:
-                n = self.get_size()
-                self.log.debug("Lookup callback hit. Current size estimate: {n}", n=n)
-            except NotEnoughLookupsError:
-                self.log.debug("Not enough lookups to make a size estimate...")
+            self.record_lookup(addr, nodes)
             return nodes
 
         self.log.debug("Registering lookup for {addr}", addr=addr.hex())
@@ -0,0 +1,77 @@
+from twisted.trial import unittest
+from twisted.internet.address import IPv4Address
+from twisted.internet.task import Clock
+
+from theseus.blacklist import Blacklist
+from theseus.contactinfo import ContactInfo
+
+from noise.functions import KeyPair25519
+
+import ipaddress
+
+
+class BlacklistTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self._clock = Blacklist._clock
+        Blacklist._clock = self.clock
+        self.blacklist = Blacklist(max_size=4, default_duration=60)
+
+    def tearDown(self):
+        Blacklist._clock = self._clock
+
+    def test_key_types(self):
+        self.assertNotIn("10.0.0.1", self.blacklist)
+        self.blacklist.add(IPv4Address("TCP", "10.0.0.1", 1234))
+        self.blacklist.add(ipaddress.IPv4Address("10.0.0.2"))
+
+        key = KeyPair25519.from_public_bytes(bytes(32))
+        for host in ("10.0.0.1", "10.0.0.2"):
+            self.assertIn(host, self.blacklist)
+            self.assertIn(ipaddress.IPv4Address(host), self.blacklist)
+            self.assertIn(IPv4Address("TCP", host, 4321), self.blacklist)
+            self.assertIn(ContactInfo(host, 4321, key), self.blacklist)
+        self.assertNotIn("10.0.0.3", self.blacklist)
+
+    def test_cidr(self):
+        self.blacklist.add("192.168.0.0/16")
+        self.assertIn("192.168.1.1", self.blacklist)
+        self.assertIn("192.168.255.0", self.blacklist)
+        self.assertNotIn("192.169.0.1", self.blacklist)
+
+        self.blacklist.add("10.1.2.3/8")  # host bits get masked off
+        self.assertIn("10.200.0.1", self.blacklist)
+
+        self.blacklist.remove("192.168.0.0/16")
+        self.assertNotIn("192.168.1.1", self.blacklist)
+        self.assertIn("10.200.0.1", self.blacklist)
+
+    def test_expiry(self):
+        self.blacklist.add("10.0.0.1")
+        self.blacklist.add("10.0.0.2", duration=120)
+        self.blacklist.add("10.0.0.3", duration=float('inf'))
+        self.blacklist.add("10.0.0.4", duration=0)  # already expired, not the default
+        self.assertNotIn("10.0.0.4", self.blacklist)
+
+        self.clock.advance(60)
+        self.assertNotIn("10.0.0.1", self.blacklist)
+        self.assertIn("10.0.0.2", self.blacklist)
+
+        # re-adding extends an entry, but never shortens it
+        self.blacklist.add("10.0.0.2", duration=10)
+        self.clock.advance(60)
+        self.blacklist.prune()
+        self.assertNotIn("10.0.0.2", self.blacklist)
+        self.assertIn("10.0.0.3", self.blacklist)
+        self.assertEqual(len(self.blacklist), 1)
+
+    def test_max_size(self):
+        for i in range(4):
+            self.blacklist.add("10.0.0.{}".format(i), duration=100+i)
+        self.blacklist.add("10.0.0.4", duration=50)
+        self.assertEqual(len(self.blacklist), 4)
+
+        # the entry closest to expiring is evicted first
+        self.assertNotIn("10.0.0.4", self.blacklist)
+        for i in range(4):
+            self.assertIn("10.0.0.{}".format(i), self.blacklist)
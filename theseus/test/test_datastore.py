@@ -9,6 +9,12 @@ class DataStoreTests(unittest.TestCase):
         if data_store.looper.running:
             data_store.looper.stop()
 
+    def test_distance(self):
+        ds = DataStore(local_addr=b'\x80' + bytes(L//8 - 1))
+        self.assertEqual(ds._get_distance(b'\x80' + bytes(L//8 - 1)), 0)
+        self.assertEqual(ds._get_distance(bytes(L//8)), 2**(L-1))
+        self.assertEqual(DataStore()._get_distance(bytes(L//8)), 0)
+
     def test_init(self):
         ds2_local_addr = bytes(L//8)
         ds3_memlimit = 2**16
@@ -0,0 +1,53 @@
+from twisted.trial import unittest
+from twisted.internet.defer import CancelledError
+
+from theseus.dialer import DialScheduler
+from theseus.enums import INTERACTIVE, MAINTENANCE, SPECULATIVE
+
+
+class DialSchedulerTests(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = DialScheduler(max_dials=2)
+
+    def test_limit(self):
+        d1 = self.scheduler.acquire()
+        d2 = self.scheduler.acquire()
+        d3 = self.scheduler.acquire()
+        self.successResultOf(d1)
+        self.successResultOf(d2)
+        self.assertNoResult(d3)
+        self.assertEqual(self.scheduler.active, 2)
+
+        self.scheduler.release()
+        self.successResultOf(d3)
+        self.assertEqual(self.scheduler.active, 2)
+
+    def test_priority_order(self):
+        self.scheduler.acquire()
+        self.scheduler.acquire()
+        speculative = self.scheduler.acquire(SPECULATIVE)
+        maintenance = self.scheduler.acquire(MAINTENANCE)
+        interactive = self.scheduler.acquire(INTERACTIVE)
+
+        self.scheduler.release()
+        self.successResultOf(interactive)
+        self.assertNoResult(maintenance)
+        self.assertNoResult(speculative)
+
+        self.scheduler.reprioritize(speculative, INTERACTIVE)
+        self.scheduler.release()
+        self.successResultOf(speculative)
+        self.assertNoResult(maintenance)
+
+    def test_cancel(self):
+        self.scheduler.acquire()
+        self.scheduler.acquire()
+        d1 = self.scheduler.acquire()
+        d2 = self.scheduler.acquire()
+
+        d1.cancel()
+        self.failureResultOf(d1, CancelledError)
+        self.scheduler.release()
+        self.successResultOf(d2)
+        self.assertEqual(self.scheduler.active, 2)
+        self.assertEqual(len(self.scheduler.queue), 0)
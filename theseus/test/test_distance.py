@@ -0,0 +1,30 @@
+from twisted.trial import unittest
+
+from theseus.distance import to_int, distance, shared_prefix_len
+from theseus.nodeaddr import NodeAddress
+from theseus.constants import L
+
+
+class DistanceTests(unittest.TestCase):
+    def test_to_int(self):
+        self.assertEqual(to_int(bytes(L//8)), 0)
+        self.assertEqual(to_int(b'\x01\x00'), 256)
+        self.assertEqual(to_int(b'\xff'*(L//8)), 2**L - 1)
+
+    def test_cached_int(self):
+        addr = bytes(range(L//8))
+        node_addr = NodeAddress(addr, None)
+        self.assertEqual(node_addr.addr_int, int.from_bytes(addr, "big"))
+
+    def test_distance(self):
+        a = NodeAddress(b'\x0f' + bytes(L//8 - 1), None)
+        b = NodeAddress(b'\xf0' + bytes(L//8 - 1), None)
+        self.assertEqual(distance(a, a), 0)
+        self.assertEqual(distance(a, b), 0xff << (L - 8))
+        self.assertEqual(distance(a, b.addr_int), distance(b, a))
+
+    def test_shared_prefix_len(self):
+        self.assertEqual(shared_prefix_len(0, 0), L)
+        self.assertEqual(shared_prefix_len(0, 2**L - 1), 0)
+        self.assertEqual(shared_prefix_len(0b1010, 0b1000, bits=4), 2)
+        self.assertEqual(shared_prefix_len(0b1010, 0b1011, bits=4), 3)
@@ -1,12 +1,19 @@
 from twisted.trial import unittest
 from twisted.internet.defer import Deferred, DeferredList
 
-from theseus.hasher import Hasher
+from concurrent.futures import Future, CancelledError
+from unittest.mock import Mock
+import threading
+
+from theseus import hasher as hasher_module
+from theseus.hasher import Hasher, ProcessExecutor, default_workers
+from theseus.enums import CRITICAL, MEDIUM, LOW
 
 
 class HasherTests(unittest.TestCase):
     def setUp(self):
         self.hasher = Hasher()
+        self.addCleanup(self.hasher.executor.stop)
 
     def tearDown(self):
         pending = []
@@ -23,3 +30,92 @@ class HasherTests(unittest.TestCase):
         self.assertIsInstance(d, Deferred)
         #self.assertEqual(expected, self.successResultOf(d))
         d.addCallback(lambda result: self.assertEqual(result, expected))
+
+    def test_is_busy(self):
+        self.hasher.active_jobs = self.hasher.executor.workers  # hold jobs in the queue
+        self.assertFalse(self.hasher.is_busy(LOW))
+        self.hasher.do_hash(b'low', b'saltsaltsaltsalt', LOW)
+        self.assertFalse(self.hasher.is_busy(LOW))
+        self.hasher.do_hash(b'critical', b'saltsaltsaltsalt', CRITICAL)
+        self.assertTrue(self.hasher.is_busy(LOW))
+        self.assertFalse(self.hasher.is_busy(CRITICAL))
+
+        self.hasher.active_jobs = 0
+        self.hasher._update_jobs()
+        self.hasher._update_jobs()
+
+    def test_process_executor(self):
+        self.hasher = Hasher("process", 2)
+        self.addCleanup(self.hasher.executor.stop)
+        expected = b'e\x90^]\x1b\\\xcb\xc5\xb1+wD\x9e.\x06Rz\xb6\x05u'
+        d = self.hasher.do_hash(b'secret', b'saltsaltsaltsalt')
+        d.addCallback(lambda result: self.assertEqual(result, expected))
+        return d
+
+    def test_process_executor_stop(self):
+        executor = ProcessExecutor(2)
+        executor._reactor = Mock(callFromThread=lambda f, *args: f(*args))
+        executor.pool = pool = Mock()
+        running, queued = Future(), Future()
+        running.set_running_or_notify_cancel()
+
+        pool.submit.return_value = running
+        d1 = executor.submit(len, b'')
+        pool.submit.return_value = queued
+        d2 = executor.submit(len, b'')
+
+        # stopping doesn't wait on the running job, and drops the queued one
+        executor.stop()
+        self.assertIsNone(executor.pool)
+        self.assertNoResult(d1)
+        self.failureResultOf(d2, CancelledError)
+        self.assertEqual(executor.futures, {running})
+        for thread in threading.enumerate():
+            if thread.name == "hasher shutdown":
+                thread.join()
+        pool.shutdown.assert_called_once_with()
+
+    def test_priority_order(self):
+        self.hasher = Hasher(workers=2)
+        started = []
+
+        def submit(f, message, salt, opslimit, memlimit):
+            d = Deferred()
+            started.append((message, d))
+            return d
+        self.patch(self.hasher.executor, "submit", submit)
+
+        results = {}
+        for message, priority in ((b'low', LOW), (b'medium', MEDIUM), (b'critical', CRITICAL), (b'low2', LOW)):
+            d = self.hasher.do_hash(message, b'saltsaltsaltsalt', priority)
+            d.addBoth(lambda result, message: results.__setitem__(message, result), message)
+        self.assertEqual([message for message, _ in started], [b'low', b'medium'])
+
+        # only as many jobs run as there are workers, so freed workers go to
+        # the most urgent jobs still waiting
+        started[0][1].callback(b'image')
+        self.assertEqual([message for message, _ in started], [b'low', b'medium', b'critical'])
+        started[1][1].errback(RuntimeError())
+        self.assertEqual([message for message, _ in started], [b'low', b'medium', b'critical', b'low2'])
+        self.assertEqual(results[b'low'], b'image')
+        self.assertTrue(results[b'medium'].check(RuntimeError))
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+
+        # finished jobs are cached
+        started[2][1].callback(b'image2')
+        started[3][1].callback(b'image3')
+        d = self.hasher.do_hash(b'critical', b'saltsaltsaltsalt', LOW)
+        self.assertEqual(self.successResultOf(d), b'image2')
+        self.assertEqual(len(started), 4)
+
+    def test_default_workers(self):
+        memlimit = Hasher.MEMLIMIT
+        self.patch(hasher_module.os, "cpu_count", lambda: 8)
+        self.patch(hasher_module, "_available_memory", lambda: 100*memlimit)
+        self.assertEqual(default_workers(memlimit), 8)
+        self.patch(hasher_module, "_available_memory", lambda: 3*memlimit)
+        self.assertEqual(default_workers(memlimit), 3)
+        self.patch(hasher_module, "_available_memory", lambda: memlimit // 2)
+        self.assertEqual(default_workers(memlimit), 1)
+        self.patch(hasher_module, "_available_memory", lambda: None)
+        self.assertEqual(default_workers(memlimit), 8)
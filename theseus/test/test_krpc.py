@@ -1,3 +1,4 @@
+from twisted.internet.defer import CancelledError
 from twisted.internet.error import ConnectionDone
 from twisted.trial import unittest
 from twisted.test import proto_helpers
@@ -114,6 +115,32 @@ class KRPCTests(unittest.TestCase):
         self.assertEqual(self.proto.remote_data, b"dolla dolla bill yall")
         return d
 
+    def test_cancelled_query(self):
+        d, txn = self._start_info_query()
+        d.cancel()
+        self.failureResultOf(d, CancelledError)
+        self.assertEqual(self.proto.open_queries, {})
+
+        # a late response is dropped without fuss
+        self.proto.stringReceived(bencode({"t": txn, "y": "r", "r": {"info": "too late"}}))
+        self.assertIsNone(self.proto.remote_data)
+        self.assertTrue(self.transport.connected)
+        self.assertEqual(self.proto.abandoned_queries, {})
+
+    def test_abandoned_queries_bounded(self):
+        self.proto.max_abandoned_queries = 2
+        txns = []
+        for _ in range(3):
+            d, txn = self._start_info_query()
+            d.cancel()
+            self.failureResultOf(d, CancelledError)
+            txns.append(txn)
+        self.assertEqual(list(self.proto.abandoned_queries), txns[1:])
+
+        # a late response to a forgotten query is treated like any other stray
+        self.proto.stringReceived(bencode({"t": txns[0], "y": "r", "r": {"info": "too late"}}))
+        self.assertFalse(self.transport.connected)
+
     def test_error_response_handling(self):
         # krpc error response
         d, txn = self._start_info_query()
@@ -0,0 +1,320 @@
+from twisted.trial import unittest
+from twisted.internet.defer import Deferred, CancelledError
+from twisted.internet.task import Clock
+
+from theseus.lookup import AddrLookup, MultiAddrLookup
+from theseus.lookuptrace import LookupTrace, summarize
+from theseus.errors import QueryRetriesExceededError
+from theseus.routing import RoutingEntry
+from theseus.contactinfo import ContactInfo
+from theseus.nodeaddr import NodeAddress, Preimage
+
+from noise.functions import KeyPair25519
+
+from unittest.mock import Mock
+
+
+class FakePeer:
+    def __init__(self, hedge_delay=1):
+        self.hedge_delay = hedge_delay
+        self.queries = []
+
+    def query(self, query_name, args, timeout=None, priority=None):
+        d = Deferred()
+        self.queries.append((query_name, args, d))
+        return d
+
+    def get_hedge_delay(self):
+        return self.hedge_delay
+
+
+class LookupTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self._clock = AddrLookup._clock
+        AddrLookup._clock = self.clock
+
+        self.peers = {}
+        self.local_peer = Mock()
+        self.local_peer.blacklist = []
+        self.local_peer.peer_key = KeyPair25519.from_public_bytes(b'L'*32)
+        self.local_peer.peer_tracker.is_reachable.return_value = True
+        self.local_peer.peer_tracker.is_dead.return_value = False
+        self.local_peer.peer_tracker.get_rtt.return_value = None
+        self.local_peer.get_peer.side_effect = lambda contact: self.peers[contact]
+
+    def tearDown(self):
+        AddrLookup._clock = self._clock
+
+    def _make_entries(self, n):
+        entries = []
+        for i in range(1, n+1):
+            contact = ContactInfo('127.0.0.1', 1024 + i, KeyPair25519.from_public_bytes(bytes([i])*32))
+            entries.append(RoutingEntry(contact, NodeAddress(bytes([i])*20, Preimage(bytes(4), '127.0.0.1', bytes(6)))))
+            self.peers[contact] = FakePeer()
+        return entries
+
+    def _start_lookup(self, entries, **kwargs):
+        self.local_peer.routing_table.query.return_value = entries
+        lookup = AddrLookup(self.local_peer)
+        kwargs.setdefault('alpha', 1)
+        lookup.configure(target=bytes(20), **kwargs)
+        return lookup.start()
+
+    def test_hedged_find(self):
+        entries = self._make_entries(2)
+        first, second = (self.peers[entry.contact_info] for entry in entries)
+        d = self._start_lookup(entries)
+
+        self.assertEqual(len(first.queries), 1)
+        self.assertEqual(len(second.queries), 0)
+
+        # first peer is slow, so the find gets hedged to the next-best candidate
+        self.clock.advance(first.hedge_delay)
+        self.assertEqual(len(second.queries), 1)
+        second.queries[0][2].callback({b'nodes': []})
+
+        # the slow peer's query is left running, and the lookup waits on it
+        self.assertFalse(first.queries[0][2].called)
+        self.assertNoResult(d)
+        first.queries[0][2].callback({b'nodes': []})
+        self.assertEqual(self.successResultOf(d), entries)
+
+    def test_hedged_find_overtaken_failure(self):
+        entries = self._make_entries(3)
+        first, second, third = (self.peers[entry.contact_info] for entry in entries)
+        d = self._start_lookup(entries, num_peers=2)
+
+        self.clock.advance(first.hedge_delay)
+        second.queries[0][2].callback({b'nodes': []})
+
+        # an overtaken query that goes on to fail counts as a failure
+        first.queries[0][2].errback(Exception("nope"))
+        self.assertEqual(len(third.queries), 1)
+        third.queries[0][2].callback({b'nodes': []})
+        self.assertEqual(self.successResultOf(d), entries[1:])
+
+    def test_unhedged_find(self):
+        entries = self._make_entries(2)
+        first, second = (self.peers[entry.contact_info] for entry in entries)
+        d = self._start_lookup(entries, hedge=False)
+
+        self.clock.advance(first.hedge_delay)
+        self.assertEqual(len(second.queries), 0)
+        first.queries[0][2].callback({b'nodes': []})
+
+        # the lookup isn't done until both of the closest peers have answered
+        self.assertNoResult(d)
+        self.assertEqual(len(second.queries), 1)
+        second.queries[0][2].callback({b'nodes': []})
+
+        self.assertEqual(self.successResultOf(d), entries)
+
+    def test_query_counts(self):
+        entries = self._make_entries(3)
+        skipped, lost, answered = entries
+        self.local_peer.peer_tracker.is_reachable.side_effect = lambda contact: contact != skipped.contact_info
+        lookup = AddrLookup(self.local_peer)
+        self.local_peer.routing_table.query.return_value = entries
+        lookup.configure(target=bytes(20), alpha=3, hedge=False)
+        d = lookup.start()
+
+        # a contact that's backing off is skipped, not counted as a lost query
+        self.peers[lost.contact_info].queries[0][2].errback(Exception("nope"))
+        self.peers[answered.contact_info].queries[0][2].callback({b'nodes': []})
+        self.assertEqual(self.successResultOf(d), [answered])
+        self.assertEqual(lookup.query_counts, (2, 1))
+
+    def test_concurrency(self):
+        entries = self._make_entries(6)
+        peers = [self.peers[entry.contact_info] for entry in entries]
+        d = self._start_lookup(entries, alpha=3, hedge=False)
+        self.assertEqual([len(peer.queries) for peer in peers], [1, 1, 1, 0, 0, 0])
+
+        # a new query goes out as soon as any one query returns
+        peers[1].queries[0][2].callback({b'nodes': []})
+        self.assertEqual([len(peer.queries) for peer in peers], [1, 1, 1, 1, 0, 0])
+        peers[3].queries[0][2].errback(Exception("nope"))
+        self.assertEqual([len(peer.queries) for peer in peers], [1, 1, 1, 1, 1, 0])
+
+        for i in (0, 2, 4):
+            peers[i].queries[0][2].callback({b'nodes': []})
+        peers[5].queries[0][2].callback({b'nodes': []})
+
+        # the peer that failed is left out of the results
+        self.assertEqual(self.successResultOf(d), entries[:3] + entries[4:])
+
+    def test_latency_preference(self):
+        entries = self._make_entries(3)
+        peers = [self.peers[entry.contact_info] for entry in entries]
+        rtts = {entries[0].contact_info: 2, entries[2].contact_info: 0.01}
+        self.local_peer.peer_tracker.get_rtt.side_effect = rtts.get
+        d = self._start_lookup(entries, hedge=False)
+
+        # the closest peer is the only one with its prefix length, so it goes
+        # first however slow it is...
+        self.assertEqual([len(peer.queries) for peer in peers], [1, 0, 0])
+        peers[0].queries[0][2].callback({b'nodes': []})
+
+        # ...but the other two are equally close, so the faster one goes next
+        self.assertEqual([len(peer.queries) for peer in peers], [1, 0, 1])
+        peers[2].queries[0][2].callback({b'nodes': []})
+        peers[1].queries[0][2].callback({b'nodes': []})
+        self.assertEqual(self.successResultOf(d), entries)
+
+    def test_shared_responses(self):
+        entries = self._make_entries(3)
+        lookups = [AddrLookup(self.local_peer) for _ in range(2)]
+        self.local_peer.routing_table.query.return_value = entries[1:]
+        for lookup in lookups:
+            lookup.configure(target=bytes(20), alpha=2, num_peers=1, hedge=False,
+                             share_with=lambda lookup: [other for other in lookups if other is not lookup])
+        first, second = (lookup.start() for lookup in lookups)
+
+        # both lookups start out querying the second entry's peer. the first
+        # lookup's answer is shared with the second, so both move on to the
+        # closer peer it turned up without waiting on anything else
+        peer = self.peers[entries[1].contact_info]
+        self.assertEqual(len(peer.queries), 2)
+        peer.queries[0][2].callback({b'nodes': [entries[0].as_bytes()]})
+        self.assertEqual(len(self.peers[entries[0].contact_info].queries), 2)
+
+    def test_deadline_and_progress(self):
+        closest, *entries = self._make_entries(3)
+        progress = []
+        lookup = AddrLookup(self.local_peer)
+        self.local_peer.routing_table.query.return_value = entries
+        lookup.configure(target=bytes(20), alpha=1, num_peers=2, hedge=False, deadline=5, progress=progress.append)
+        d = lookup.start()
+
+        self.clock.advance(1)
+        self.peers[entries[0].contact_info].queries[0][2].callback({b'nodes': [closest.as_bytes()]})
+        self.assertEqual(progress, [[closest, entries[0]]])
+
+        # the closest peer is slow, so the lookup settles for what it has
+        query = self.peers[closest.contact_info].queries[0][2]
+        self.clock.advance(4)
+        self.assertEqual(self.successResultOf(d), [closest, entries[0]])
+        self.assertTrue(lookup.timed_out)
+        self.assertTrue(query.called)  # cancelled
+        self.assertEqual(len(self.peers[entries[1].contact_info].queries), 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_deadline_without_peers(self):
+        lookup = AddrLookup(self.local_peer)
+        self.local_peer.routing_table.query.return_value = []
+        lookup.configure(target=bytes(20), alpha=1, deadline=12)
+        d = lookup.start()
+        self.clock.advance(5)
+        self.assertNoResult(d)
+        self.clock.advance(10)
+        self.assertEqual(self.successResultOf(d), [])
+        self.assertTrue(lookup.timed_out)
+
+    def test_cancel(self):
+        entries = self._make_entries(3)
+        lookup = AddrLookup(self.local_peer)
+        self.local_peer.routing_table.query.return_value = entries
+        lookup.configure(target=bytes(20), alpha=2, deadline=30)
+        d = lookup.start()
+        queries = [query for entry in entries for _, _, query in self.peers[entry.contact_info].queries]
+        self.assertEqual(len(queries), 2)
+
+        d.cancel()
+        self.failureResultOf(d, CancelledError)
+        self.assertTrue(lookup.cancelled)
+        self.assertFalse(lookup.running)
+        self.assertTrue(all(query.called for query in queries))  # cancelled
+
+        # no more traffic: hedges and the deadline were called off too
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.clock.advance(60)
+        self.assertEqual(sum(len(peer.queries) for peer in self.peers.values()), 2)
+        lookup.cancel()  # harmless
+
+    def test_cancel_while_retrying(self):
+        lookup = AddrLookup(self.local_peer)
+        self.local_peer.routing_table.query.return_value = []
+        lookup.configure(target=bytes(20), alpha=1)
+        d = lookup.start()
+        lookup.cancel()
+        self.failureResultOf(d, CancelledError)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_discovered(self):
+        closest, entry = self._make_entries(2)
+        discovered = []
+        self._start_lookup([entry], num_peers=1, hedge=False, discovered=discovered.extend)
+        self.peers[entry.contact_info].queries[0][2].callback({b'nodes': [closest.as_bytes()]})
+        self.assertEqual(discovered, [closest])
+        self.assertFalse(discovered[0].node_addr.verified)
+
+    def test_termination(self):
+        closest, *entries = self._make_entries(3)
+        peers = [self.peers[entry.contact_info] for entry in entries]
+        d = self._start_lookup(entries, alpha=2, num_peers=2, hedge=False)
+        self.assertEqual([len(peer.queries) for peer in peers], [1, 1])
+
+        # the first peer knows of one closer to the target, which gets queried
+        # right away...
+        peers[0].queries[0][2].callback({b'nodes': [closest.as_bytes()]})
+        self.assertEqual(len(self.peers[closest.contact_info].queries), 1)
+
+        # ...and once it answers, the two closest peers have both responded,
+        # so the lookup is done without waiting on the further one
+        self.peers[closest.contact_info].queries[0][2].callback({b'nodes': []})
+        self.assertEqual(self.successResultOf(d), [closest, entries[0]])
+        self.assertTrue(peers[1].queries[0][2].called)  # cancelled
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_trace(self):
+        closest, *entries = self._make_entries(3)
+        peers = [self.peers[entry.contact_info] for entry in entries]
+        trace = LookupTrace(bytes(20))
+        d = self._start_lookup(entries, alpha=2, num_peers=2, hedge=False, trace=trace)
+
+        self.clock.advance(1)
+        peers[1].queries[0][2].errback(QueryRetriesExceededError())
+        peers[0].queries[0][2].callback({b'nodes': [closest.as_bytes()]})
+        self.clock.advance(2)
+        self.peers[closest.contact_info].queries[0][2].callback({b'nodes': []})
+        self.assertEqual(self.successResultOf(d), [closest, entries[0]])
+
+        self.assertEqual([(query.contact, query.hop, query.outcome, query.rtt) for query in trace.queries], [
+            (entries[0].contact_info, 1, "response", 1),
+            (entries[1].contact_info, 1, "timeout", 1),
+            (closest.contact_info, 2, "response", 2)])
+        self.assertEqual(trace.queries[0].new_closer, 1)
+        self.assertEqual([t for t, _ in trace.convergence], [1, 3])
+        self.assertEqual((trace.outcome, trace.duration, trace.hops), ("complete", 3, 2))
+        self.assertAlmostEqual(trace.slowest_fraction, 2/3)
+
+        stats = summarize([trace, LookupTrace(bytes(20))])
+        self.assertEqual((stats["lookups"], stats["mean_queries"], stats["mean_hops"]), (1, 3, 2))
+        self.assertAlmostEqual(stats["timeout_rate"], 1/3)
+        self.assertAlmostEqual(stats["mean_rtt"], 1.5)
+
+    def test_multi_target(self):
+        entries = self._make_entries(4)
+        peers = [self.peers[entry.contact_info] for entry in entries]
+        self.local_peer.routing_table.query.return_value = [entries[0], entries[3]]
+        multi = MultiAddrLookup(self.local_peer)
+        multi.configure(targets=[bytes(20), b'\xff'*20], alpha=1, num_peers=2, hedge=False)
+        near, far = multi.start()
+        self.assertEqual([len(peer.queries) for peer in peers], [1, 0, 0, 1])
+
+        # the far lookup's first pick fails, so neither lookup tries it again
+        peers[3].queries[0][2].errback(QueryRetriesExceededError())
+        self.assertEqual([len(peer.queries) for peer in peers], [2, 0, 0, 1])
+
+        # the far lookup learns of another peer, and so does the near one
+        peers[0].queries[1][2].callback({b'nodes': [entries[1].as_bytes()]})
+        peers[0].queries[0][2].callback({b'nodes': []})
+        self.assertEqual([len(peer.queries) for peer in peers], [2, 2, 0, 1])
+
+        # each lookup finishes on its own
+        peers[1].queries[1][2].callback({b'nodes': []})
+        self.assertEqual(self.successResultOf(near), [entries[0], entries[1]])
+        self.assertNoResult(far)
+        peers[1].queries[0][2].callback({b'nodes': []})
+        self.assertEqual(self.successResultOf(far), [entries[1], entries[0]])
@@ -0,0 +1,60 @@
+from twisted.trial import unittest
+from twisted.internet.task import Clock
+
+from theseus.lookupcache import LookupCache
+from theseus.routing import RoutingEntry
+from theseus.contactinfo import ContactInfo
+from theseus.nodeaddr import NodeAddress
+
+
+class LookupCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self._clock = LookupCache._clock
+        LookupCache._clock = self.clock
+
+        self.unusable = set()
+        self.cache = LookupCache(is_usable=lambda contact: contact not in self.unusable, max_size=3, ttl=10)
+        self.entries = [RoutingEntry(ContactInfo('127.0.0.1', 1024 + i, bytes([i])*32), NodeAddress(bytes([i])*20, None))
+                        for i in range(8)]
+
+    def tearDown(self):
+        LookupCache._clock = self._clock
+
+    def test_get_and_put(self):
+        target = bytes(20)
+        self.assertIsNone(self.cache.get(target, 8))
+        self.cache.put(target, 8, self.entries)
+        self.assertEqual(self.cache.get(target, 8), self.entries)
+        self.assertEqual(self.cache.get(target, 4), self.entries[:4])
+        self.assertIsNone(self.cache.get(target, 16))
+
+        # a smaller, later result doesn't clobber a bigger fresh one
+        self.cache.put(target, 4, self.entries[4:])
+        self.assertEqual(self.cache.get(target, 8), self.entries)
+
+    def test_expiry(self):
+        self.cache.put(bytes(20), 8, self.entries)
+        self.clock.advance(9)
+        self.assertIsNotNone(self.cache.get(bytes(20), 8))
+        self.clock.advance(1)
+        self.assertIsNone(self.cache.get(bytes(20), 8))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_eviction(self):
+        targets = [bytes([i])*20 for i in range(4)]
+        for target in targets[:3]:
+            self.cache.put(target, 8, self.entries)
+        self.cache.get(targets[0], 8)  # now the most recently used
+        self.cache.put(targets[3], 8, self.entries)
+        self.assertEqual(list(self.cache.results), [targets[2], targets[0], targets[3]])
+
+    def test_invalidation(self):
+        self.cache.put(bytes(20), 8, self.entries)
+        self.cache.put(b'\xff'*20, 8, self.entries)
+        self.unusable.add(self.entries[5].contact_info)
+        self.assertIsNone(self.cache.get(bytes(20), 8))
+        self.assertEqual(len(self.cache), 1)
+
+        self.cache.invalidate()
+        self.assertEqual(len(self.cache), 0)
@@ -0,0 +1,271 @@
+from twisted.trial import unittest
+from twisted.internet.defer import Deferred, inlineCallbacks
+from twisted.internet.task import Clock
+
+from theseus.maintenance import BucketProber, RefreshScheduler, DiscoveryVerifier
+from theseus.routing import RoutingEntry, RoutingTable, FlatRoutingTable
+from theseus.contactinfo import ContactInfo
+from theseus.nodeaddr import NodeAddress, Preimage
+from theseus.hasher import hasher
+from theseus.errors import QueryRetriesExceededError, LookupRetriesExceededError
+from theseus.enums import MAINTENANCE
+
+from noise.functions import KeyPair25519
+
+from socket import inet_aton
+from time import time
+from unittest.mock import Mock
+
+
+class FakePeer:
+    last_heard = None
+
+    def __init__(self):
+        self.queries = []
+
+    def query(self, query_name, args, retries=2, timeout=None, priority=None):
+        d = Deferred()
+        self.queries.append((query_name, args, d))
+        return d
+
+
+class BucketProberTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.clock.advance(BucketProber.stale_after)
+        self._clocks = BucketProber._clock, RoutingTable._clock
+        BucketProber._clock = RoutingTable._clock = self.clock
+
+        self.peers = {}
+        self.local_peer = Mock()
+        self.local_peer.routing_table = FlatRoutingTable()
+        self.local_peer.peer_tracker.get_last_heard.return_value = None
+        self.local_peer.peer_tracker.is_dead.return_value = False
+        self.local_peer.get_peer.side_effect = lambda contact: self.peers[contact]
+
+        self.prober = BucketProber(self.local_peer)
+        self.addCleanup(self.prober.stop)
+
+    def tearDown(self):
+        BucketProber._clock, RoutingTable._clock = self._clocks
+
+    def _fill_bucket(self):
+        table = self.local_peer.routing_table
+        for i in range(table.k + 1):
+            contact = ContactInfo('127.0.0.1', 1024 + i, KeyPair25519.from_public_bytes(bytes([i])*32))
+            self.peers[contact] = FakePeer()
+            table.insert(contact, NodeAddress(bytes([i])*20, None))
+            self.clock.advance(1)
+        return table.get_contents(), table.get_replacements()
+
+    def test_stale_entries_probed(self):
+        (oldest, *rest), (replacement,) = self._fill_bucket()
+        self.prober.start()
+
+        # nothing is stale yet
+        self.clock.advance(self.prober.interval)
+        self.assertEqual(sum(len(peer.queries) for peer in self.peers.values()), 0)
+
+        # the oldest entry gets probed first, and answers
+        self.clock.advance(self.prober.stale_after)
+        peer = self.peers[oldest.contact_info]
+        self.assertEqual(len(peer.queries), 1)
+        self.assertEqual(peer.queries[0][0], "info")
+
+        # only one probe is in flight at a time
+        self.clock.advance(self.prober.interval)
+        self.assertEqual(sum(len(peer.queries) for peer in self.peers.values()), 1)
+
+        peer.queries[0][2].callback({})
+        self.assertEqual(list(self.local_peer.routing_table)[-1].last_seen, self.clock.seconds())
+
+        # the next-oldest doesn't answer, so its replacement takes its place
+        self.clock.advance(self.prober.interval)
+        peer = self.peers[rest[0].contact_info]
+        peer.queries[0][2].errback(QueryRetriesExceededError())
+        contents = self.local_peer.routing_table.get_contents()
+        self.assertNotIn(rest[0], contents)
+        self.assertIn(replacement, contents)
+
+    def test_recently_seen_peer_not_probed(self):
+        (oldest, *_), _ = self._fill_bucket()
+        self.local_peer.peer_tracker.get_last_heard.side_effect = lambda contact: self.peers[contact].last_heard
+        self.peers[oldest.contact_info].last_heard = self.clock.seconds() + self.prober.stale_after
+
+        self.prober.start()
+        self.clock.advance(self.prober.stale_after + self.prober.interval)
+        self.assertEqual(len(self.peers[oldest.contact_info].queries), 0)
+        self.assertEqual(list(self.local_peer.routing_table)[-1], oldest)
+
+    def test_dead_peer_dropped(self):
+        (oldest, *_), (replacement,) = self._fill_bucket()
+        self.local_peer.peer_tracker.is_dead.side_effect = lambda contact: contact == oldest.contact_info
+
+        self.prober.start()
+        self.clock.advance(self.prober.stale_after + self.prober.interval)
+        self.assertEqual(len(self.peers[oldest.contact_info].queries), 0)
+        contents = self.local_peer.routing_table.get_contents()
+        self.assertNotIn(oldest, contents)
+        self.assertIn(replacement, contents)
+
+
+class RefreshSchedulerTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self._clocks = RefreshScheduler._clock, RoutingTable._clock
+        RefreshScheduler._clock = RoutingTable._clock = self.clock
+
+        self.lookups = []
+        self.local_peer = Mock()
+        self.local_peer.routing_table = FlatRoutingTable([NodeAddress(bytes(20), None)])
+        self.local_peer.do_lookup.side_effect = self._do_lookup
+
+        self.scheduler = RefreshScheduler(self.local_peer)
+        self.addCleanup(self.scheduler.stop)
+
+    def tearDown(self):
+        RefreshScheduler._clock, RoutingTable._clock = self._clocks
+
+    def _do_lookup(self, addr, priority, fresh=False):
+        self.assertEqual(priority, MAINTENANCE)
+        self.assertTrue(fresh)
+        self.local_peer.routing_table.mark_active(addr)
+        d = Deferred()
+        self.lookups.append((addr, d))
+        return d
+
+    def _split(self, n):
+        table = self.local_peer.routing_table
+        for _ in range(n):
+            table._split(0)
+        return table.buckets
+
+    def test_refresh(self):
+        buckets = self._split(3)
+        self.scheduler.start()
+
+        self.clock.advance(self.scheduler.interval)
+        self.assertEqual(self.lookups, [])
+
+        # everything's stale now, but only max_concurrent lookups run at once
+        self.clock.advance(self.scheduler.refresh_after)
+        self.assertEqual(len(self.lookups), self.scheduler.max_concurrent)
+        for (addr, _), bucket in zip(self.lookups, buckets):
+            self.assertTrue(bucket.covers(int.from_bytes(addr, "big")))
+
+        self.clock.advance(self.scheduler.interval)
+        self.assertEqual(len(self.lookups), self.scheduler.max_concurrent)
+
+        # as lookups finish, the remaining stale buckets get their turn
+        self.lookups[0][1].callback([])
+        self.lookups[1][1].errback(LookupRetriesExceededError())
+        self.clock.advance(self.scheduler.interval)
+        self.assertEqual(len(self.lookups), len(buckets))
+        refreshed = set()
+        for addr, _ in self.lookups:
+            refreshed.update(bucket for bucket in buckets if bucket.covers(int.from_bytes(addr, "big")))
+        self.assertEqual(refreshed, set(buckets))
+
+    def test_stop(self):
+        self._split(1)
+        self.scheduler.start()
+        self.clock.advance(self.scheduler.refresh_after)
+        self.assertEqual(len(self.lookups), 2)
+
+        self.scheduler.stop()
+        for _, d in self.lookups:
+            self.assertTrue(d.called)  # cancelled, with the CancelledError swallowed
+        self.assertEqual(self.scheduler.pending, [])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+class DiscoveryVerifierTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.clock.advance(time())
+        self._clocks = DiscoveryVerifier._clock, RoutingTable._clock
+        DiscoveryVerifier._clock = RoutingTable._clock = self.clock
+
+        self.local_peer = Mock()
+        self.local_peer.routing_table = FlatRoutingTable()
+        self.local_peer.blacklist = []
+        self.local_peer.peer_key.public_bytes = b'L'*32
+        self.local_peer.peer_tracker.is_dead.return_value = False
+
+        self.verifier = DiscoveryVerifier(self.local_peer)
+        self.addCleanup(self.verifier.stop)
+
+    def tearDown(self):
+        DiscoveryVerifier._clock, RoutingTable._clock = self._clocks
+
+    def _entry(self, i, node_addr=None):
+        if node_addr is None:
+            preimage = Preimage(NodeAddress._ts_int_to_bytes(int(time())), inet_aton('127.0.0.1'), bytes(6))
+            node_addr = NodeAddress(i.to_bytes(20, "big"), preimage, verified=False)
+        contact = ContactInfo('127.0.0.1', 1024 + i, i.to_bytes(32, "big"))
+        return RoutingEntry(contact, node_addr)
+
+    @inlineCallbacks
+    def _tick(self):
+        self.clock.advance(self.verifier.interval)
+        _ = yield hasher.exhaust()
+
+    @inlineCallbacks
+    def test_verified_entries_inserted(self):
+        good_addr = yield NodeAddress.new('127.0.0.1')
+        good_addr.verified = False
+        hasher.cache.clear()  # so that verifying it takes a real hash job
+        good, bad = self._entry(1, good_addr), self._entry(2)  # bad's addr doesn't match its preimage
+        self.verifier.submit([bad, good, bad])
+        self.assertEqual(list(self.verifier.queue), [good, bad])
+        self.verifier.start()
+
+        # one verification at a time
+        self.clock.advance(self.verifier.interval)
+        self.assertIsNotNone(self.verifier.pending)
+        self.clock.advance(self.verifier.interval)
+        self.assertEqual(list(self.verifier.queue), [bad])
+
+        _ = yield hasher.exhaust()
+        _ = yield self._tick()
+        self.assertIsNone(self.verifier.pending)
+        self.assertEqual(len(self.verifier.queue), 0)
+
+        contents = self.local_peer.routing_table.get_contents()
+        self.assertEqual(contents, [good])
+        self.assertTrue(contents[0].node_addr.verified)
+
+        # now that it's in the table, there's no need to verify it again
+        self.verifier.submit([good])
+        self.assertEqual(len(self.verifier.queue), 0)
+
+    def test_unwanted_entries_skipped(self):
+        table = self.local_peer.routing_table
+        self.local_peer.blacklist = ['10.0.0.1']
+        own = self._entry(3)
+        own.contact_info = ContactInfo('127.0.0.1', 2000, b'L'*32)
+        blacklisted = self._entry(4)
+        blacklisted.contact_info = ContactInfo('10.0.0.1', 2000, b'b'*32)
+        expired = self._entry(5, NodeAddress(bytes([5])*20, Preimage(bytes(4), bytes(4), bytes(6)), verified=False))
+        verified = self._entry(6)
+        verified.node_addr.verified = True
+        self.verifier.submit([own, blacklisted, expired, verified])
+        self.assertEqual(len(self.verifier.queue), 0)
+
+        # the table has no local addrs, so once its only bucket is full,
+        # further discoveries could only be replacements
+        for i in range(table.k):
+            table.insert(ContactInfo('127.0.0.1', 3000 + i, bytes([i])*32), NodeAddress(bytes([100 + i])*20, None))
+        self.verifier.submit([self._entry(7)])
+        self.assertEqual(len(self.verifier.queue), 0)
+
+    def test_rate_limited(self):
+        entries = [self._entry(i) for i in range(self.verifier.max_queued + 10)]
+        self.verifier.submit(entries)
+        self.assertEqual(list(self.verifier.queue), entries[10:])
+
+        self.patch(hasher, "is_busy", lambda priority: True)
+        self.verifier.start()
+        self.clock.advance(self.verifier.interval * 5)
+        self.assertIsNone(self.verifier.pending)
+        self.assertEqual(len(self.verifier.queue), self.verifier.max_queued)
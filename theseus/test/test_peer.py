@@ -3,10 +3,12 @@ import twisted.internet.base
 from twisted.logger import Logger
 from twisted.trial import unittest
 from twisted.test.proto_helpers import _FakePort
-from twisted.internet.defer import DeferredList, succeed, inlineCallbacks
+from twisted.internet.defer import Deferred, DeferredList, succeed, inlineCallbacks, CancelledError
 from twisted.internet.task import Clock, deferLater
 from twisted.internet.address import IPv4Address
+from twisted.internet.error import ConnectionRefusedError, ConnectionDone
 from twisted.internet import reactor
+from twisted.python.failure import Failure
 from twisted.test.proto_helpers import MemoryReactor, RaisingMemoryReactor, StringTransport
 from twisted.plugin import IPlugin
 from twisted import plugins
@@ -15,15 +17,25 @@ from twisted.internet.protocol import Factory
 
 from zope.interface import implementer
 
+from noise.functions import KeyPair25519
+
+from unittest.mock import Mock
+
 from theseus.contactinfo import ContactInfo
 from theseus.peer import PeerService
-from theseus.peertracker import PeerState
+from theseus.peertracker import PeerState, PeerTracker, PeerRecord
+from theseus.routing import RoutingTable, RoutingEntry
 from theseus.nodemanager import NodeManager
 from theseus.enums import MAX_VERSION, LISTEN_PORT, PEER_KEY, ADDRS, CONNECTING, INITIATOR, RESPONDER
-from theseus.errors import LookupRetriesExceededError, Error202
+from theseus.enums import DISCONNECTED, OPEN, HALF_OPEN
+from theseus.enums import INTERACTIVE, MAINTENANCE, SPECULATIVE
+from theseus.errors import LookupRetriesExceededError, Error202, PeerUnreachableError, QueryRetriesExceededError
+from theseus.errors import DuplicateContactError, TheseusConnectionError
 from theseus.plugins import IPeerSource
 from theseus.nodeaddr import NodeAddress, Preimage
 from theseus.lookup import AddrLookup
+from theseus.maintenance import BucketProber, DiscoveryVerifier
+from theseus.snapshot import RoutingSnapshot
 from theseus.protocol import DHTProtocol
 from theseus.noisewrapper import NoiseWrapper, NoiseSettings
 from theseus.constants import timeout_window
@@ -47,16 +59,23 @@ class SingleNodeTests(unittest.TestCase):
         self._rng = PeerService._rng
         self._listen = PeerService._listen
         self._reactor = PeerState._reactor
+        self._snapshot_file = PeerService.snapshot_file
 
         self.clock = Clock()
         PeerState._clock = self.clock
+        PeerTracker._clock = self.clock
         NodeManager._clock = self.clock
         AddrLookup._clock = self.clock
+        BucketProber._clock = self.clock
+        DiscoveryVerifier._clock = self.clock
+        RoutingSnapshot._clock = self.clock
+        NoiseWrapper._clock = self.clock
 
         self.memory_reactor = MemoryReactor()
         PeerState._reactor = self.memory_reactor
         PeerService._rng = Fake_RNG()
         PeerService._listen = fake_listen
+        PeerService.snapshot_file = self.mktemp()
 
         self.peer = PeerService(self.num_nodes)
 
@@ -77,10 +96,16 @@ class SingleNodeTests(unittest.TestCase):
 
         PeerService._rng = self._rng
         PeerService._listen = self._listen
+        PeerService.snapshot_file = self._snapshot_file
         PeerState._reactor = self._reactor
         PeerState._clock = self._reactor
+        PeerTracker._clock = self._reactor
         NodeManager._clock = self._reactor
         AddrLookup._clock = self._reactor
+        BucketProber._clock = self._reactor
+        DiscoveryVerifier._clock = self._reactor
+        RoutingSnapshot._clock = self._reactor
+        NoiseWrapper._clock = self._reactor
 
     def _start_service(self):
         self.peer.startService()
@@ -121,7 +146,8 @@ class SingleNodeTests(unittest.TestCase):
         target = ContactInfo('127.0.0.1', 12345, self.peer.peer_key) # this is lazy & recycles the peer's key as the remote key, but... hey
         d = self.peer.get_peer(target).connect()
         d2 = self.peer.get_peer(target).connect()
-        self.assertEqual(d, d2)
+        self.assertNoResult(d)
+        self.assertNoResult(d2)
         self.assertEqual(len(self.memory_reactor.tcpClients), 1)
 
     def test_doomed_cnxn_attempt(self):
@@ -131,6 +157,226 @@ class SingleNodeTests(unittest.TestCase):
         d = self.peer.get_peer(target).connect()
         self.failureResultOf(d)
 
+    def _fail_cnxn(self, index=-1):
+        factory = self.memory_reactor.tcpClients[index][2]
+        factory.clientConnectionFailed(None, Failure(ConnectionRefusedError()))
+
+    def test_cnxn_failure_backoff(self):
+        self._start_service()
+        target = ContactInfo('127.0.0.1', 12345, self.peer.peer_key)
+        peer_state = self.peer.get_peer(target)
+
+        d = peer_state.connect()
+        self._fail_cnxn()
+        self.failureResultOf(d, ConnectionRefusedError)
+        self.assertEqual(peer_state.state, DISCONNECTED)
+        self.assertEqual(peer_state.failures, 1)
+        self.assertFalse(peer_state.is_reachable())
+        self.assertFalse(self.peer.peer_tracker.is_reachable(target))
+
+        # attempts made during backoff should fail fast without dialing
+        self.failureResultOf(peer_state.connect(), PeerUnreachableError)
+        self.assertEqual(len(self.memory_reactor.tcpClients), 1)
+
+        self.clock.advance(peer_state.backoff_base)
+        self.assertTrue(peer_state.is_reachable())
+        peer_state.connect()
+        self.assertEqual(len(self.memory_reactor.tcpClients), 2)
+
+    def test_circuit_breaker(self):
+        self._start_service()
+        target = ContactInfo('127.0.0.1', 12345, self.peer.peer_key)
+        peer_state = self.peer.get_peer(target)
+
+        for _ in range(peer_state.circuit_threshold):
+            self.assertFalse(self.peer.peer_tracker.is_dead(target))
+            self.clock.advance(peer_state.retry_at - self.clock.seconds())
+            d = peer_state.connect()
+            self._fail_cnxn()
+            self.failureResultOf(d, ConnectionRefusedError)
+
+        self.assertIs(peer_state.circuit, OPEN)
+        self.assertTrue(self.peer.peer_tracker.is_dead(target))
+
+        # once the backoff elapses, a single trial cnxn is allowed
+        self.clock.advance(peer_state.retry_at - self.clock.seconds())
+        d = peer_state.connect()
+        self.assertIs(peer_state.circuit, HALF_OPEN)
+        self._fail_cnxn()
+        self.failureResultOf(d, ConnectionRefusedError)
+        self.assertIs(peer_state.circuit, OPEN)
+        self.assertEqual(peer_state.retry_at - self.clock.seconds(), peer_state.backoff_base * 2**peer_state.circuit_threshold)
+
+        peer_state.record_success()
+        self.assertFalse(self.peer.peer_tracker.is_dead(target))
+        self.assertTrue(peer_state.is_reachable())
+
+    def test_lookup_coalescing(self):
+        target = bytes(20)
+        first = self.peer.do_lookup(target, k=8)
+        second = self.peer.do_lookup(target, k=4, priority=INTERACTIVE)
+        third = self.peer.do_lookup(target, k=8)
+        bigger = self.peer.do_lookup(target, k=16)  # wants more peers than the first lookup will find
+        self.assertEqual(len(self.peer._addr_lookups), 2)
+
+        third.cancel()
+        self.failureResultOf(third, CancelledError)
+
+        # the routing table is empty, so the lookups give up after a while
+        self.clock.pump([5]*30)
+        for d in (first, second, bigger):
+            self.failureResultOf(d, LookupRetriesExceededError)
+        self.assertEqual(self.peer._addr_lookups, [])
+        self.assertEqual(self.peer._lookup_waiters, {})
+
+    def test_lookup_cancel(self):
+        target = bytes(20)
+        first = self.peer.do_lookup(target)
+        second = self.peer.do_lookup(target)
+        lookup, = self.peer._addr_lookups
+
+        # the caller who started the lookup can give up on it without
+        # taking it away from anyone who joined
+        first.cancel()
+        self.failureResultOf(first, CancelledError)
+        self.assertFalse(lookup.cancelled)
+        self.assertNoResult(second)
+
+        # once nobody's waiting, the lookup itself is cancelled
+        second.cancel()
+        self.failureResultOf(second, CancelledError)
+        self.assertTrue(lookup.cancelled)
+        self.assertEqual(self.peer._addr_lookups, [])
+        self.assertEqual(self.peer._lookup_waiters, {})
+
+    def test_lookup_deadline(self):
+        target = bytes(20)
+        first = self.peer.do_lookup(target)
+        bounded = self.peer.do_lookup(target, deadline=10)  # doesn't join the first
+        self.assertEqual(len(self.peer._addr_lookups), 2)
+
+        self.clock.pump([5]*30)
+        self.assertEqual(self.successResultOf(bounded), [])
+        self.failureResultOf(first, LookupRetriesExceededError)
+        self.assertIsNone(self.peer.lookup_cache.get(target, 8))
+
+    def test_empty_lookups_not_sampled(self):
+        # lookups that time out empty-handed used to be taken as size
+        # estimate samples, which broke the estimate and every later lookup
+        target = bytes(20)
+        for _ in range(self.peer.stats_tracker.min_sample_size):
+            d = self.peer.do_lookup(target, deadline=1)
+            self.clock.advance(1)
+            self.assertEqual(self.successResultOf(d), [])
+        self.assertEqual(len(self.peer.stats_tracker.measurements), 0)
+
+        d = self.peer.do_lookup(target)
+        self.clock.pump([5]*30)
+        self.failureResultOf(d, LookupRetriesExceededError)
+
+    def test_batched_lookups(self):
+        targets = [bytes(20), b'\xff'*20, b'\x0f'*20]
+        entries = [RoutingEntry(ContactInfo('127.0.0.1', 1024 + i, bytes([i])*32), NodeAddress(bytes([i])*20, None)) for i in range(8)]
+        self.peer.lookup_cache.put(targets[2], 8, entries)
+        first, second, cached = self.peer.do_lookups(targets)
+        self.assertEqual(self.successResultOf(cached), entries)
+        self.assertEqual([lookup.target for lookup in self.peer._addr_lookups], targets[:2])
+
+        # the routing table is empty, so the lookups give up after a while
+        self.clock.pump([5]*30)
+        for d in (first, second):
+            self.failureResultOf(d, LookupRetriesExceededError)
+        self.assertEqual(self.peer._addr_lookups, [])
+
+    def test_lookup_cache(self):
+        target = bytes(20)
+        entries = [RoutingEntry(ContactInfo('127.0.0.1', 1024 + i, bytes([i])*32), NodeAddress(bytes([i])*20, None)) for i in range(8)]
+        self.peer.lookup_cache.put(target, 8, entries)
+        self.assertEqual(self.successResultOf(self.peer.do_lookup(target, k=4)), entries[:4])
+        self.assertEqual(self.peer._addr_lookups, [])
+
+        d = self.peer.do_lookup(target, fresh=True)
+        self.assertEqual(len(self.peer._addr_lookups), 1)
+        self.clock.pump([5]*30)
+        self.failureResultOf(d, LookupRetriesExceededError)
+
+        self.peer.add_to_blacklist('127.0.0.1')
+        self.assertIsNone(self.peer.lookup_cache.get(target, 4))
+
+    def test_short_lookups_cached(self):
+        target = bytes(20)
+        entries = [RoutingEntry(ContactInfo('127.0.0.1', 1024 + i, bytes([i])*32), NodeAddress(bytes([i])*20, None)) for i in range(3)]
+
+        def finish(results):
+            lookup = AddrLookup(self.peer)
+            lookup.configure(target=target)
+            self.peer._register_lookup(lookup)
+            d = Deferred()
+            caller = self.peer._watch_lookup(lookup, 8, d)
+            d.callback(results)
+            return self.successResultOf(caller)
+
+        # lookups that come up empty aren't cached at all...
+        self.assertEqual(finish([]), [])
+        self.assertIsNone(self.peer.lookup_cache.get(target, 1))
+
+        # ...and short ones are cached for only as many peers as they found
+        self.assertEqual(finish(entries), entries)
+        self.assertIsNone(self.peer.lookup_cache.get(target, 8))
+        self.assertEqual(self.peer.lookup_cache.get(target, 3), entries)
+
+    def test_dial_limit(self):
+        self._start_service()
+        self.peer.peer_tracker.dial_scheduler.max_dials = 1
+        first, second, third = (self.peer.get_peer(ContactInfo('127.0.0.1', port, self.peer.peer_key)) for port in (12345, 12346, 12347))
+
+        d1 = first.connect()
+        d2 = second.connect(SPECULATIVE)
+        d3 = third.connect(MAINTENANCE)
+        self.assertEqual(len(self.memory_reactor.tcpClients), 1)
+
+        # cancelling the only caller waiting on a queued dial abandons it
+        d3.cancel()
+        self.failureResultOf(d3, CancelledError)
+        self.assertEqual(third.state, DISCONNECTED)
+        self.assertEqual(third.failures, 0)
+
+        # a higher-priority caller bumps a queued dial
+        d3 = third.connect(MAINTENANCE)
+        d2b = second.connect(INTERACTIVE)
+        self._fail_cnxn(0)
+        self.failureResultOf(d1, ConnectionRefusedError)
+        self.assertEqual(len(self.memory_reactor.tcpClients), 2)
+        self.assertEqual(self.memory_reactor.tcpClients[1][1], 12346)
+
+        # cancelling an in-progress dial frees its slot for the next one
+        d2.cancel()
+        self.failureResultOf(d2, CancelledError)
+        self.assertNoResult(d2b)
+        d2b.cancel()
+        self.failureResultOf(d2b, CancelledError)
+        self.assertEqual(second.failures, 0)
+        self.assertEqual(len(self.memory_reactor.tcpClients), 3)
+        self.assertEqual(self.memory_reactor.tcpClients[2][1], 12347)
+        self.assertNoResult(d3)
+
+    def test_query_cancel_abandons_dial(self):
+        self._start_service()
+        self.peer.peer_tracker.dial_scheduler.max_dials = 1
+        first, second = (self.peer.get_peer(ContactInfo('127.0.0.1', port, self.peer.peer_key)) for port in (12345, 12346))
+
+        d1 = first.connect()
+        d2 = second.query('find', {'addr': bytes(20)})
+        self.assertEqual(second.state, CONNECTING)
+        d2.cancel()
+        self.failureResultOf(d2, CancelledError)
+        self.assertEqual(second.state, DISCONNECTED)
+
+        # with the query gone, its queued dial never happens
+        self._fail_cnxn(0)
+        self.failureResultOf(d1, ConnectionRefusedError)
+        self.assertEqual(len(self.memory_reactor.tcpClients), 1)
+
     def test_cnxn_success(self):
         self.test_cnxn_attempt()
         target = ContactInfo('127.0.0.1', 12345, self.peer.peer_key) # this is lazy & recycles the peer's key as the remote key, but... hey
@@ -148,6 +394,63 @@ class SingleNodeTests(unittest.TestCase):
         self.assertEqual(self.p.peer_state.role, INITIATOR)
         self.assertFalse(self.t.disconnecting)
 
+    def test_dial_slot_held_through_handshake(self):
+        self.test_cnxn_success()
+        scheduler = self.peer.peer_tracker.dial_scheduler
+        scheduler.max_dials = 1
+        self.assertEqual(scheduler.active, 1)
+
+        # TCP is up but the Noise handshake isn't, so the next dial waits
+        other = self.peer.get_peer(ContactInfo('127.0.0.1', 12346, self.peer.peer_key))
+        d = other.connect()
+        self.assertEqual(len(self.memory_reactor.tcpClients), 1)
+
+        self.wrapper.connectionLost(Failure(ConnectionDone()))
+        self.assertEqual(len(self.memory_reactor.tcpClients), 2)
+        self.assertEqual(scheduler.active, 1)
+
+        # the slot is only given back once
+        self.p.peer_state.on_disconnect()
+        self.assertEqual(scheduler.active, 1)
+        self.assertNoResult(d)
+
+    def test_handshake_failure(self):
+        self.test_cnxn_success()
+        peer_state = self.p.peer_state
+        peer_state.circuit = HALF_OPEN  # as if this were a trial cnxn
+
+        self.wrapper.connectionLost(Failure(ConnectionDone()))
+        self.assertEqual(peer_state.state, DISCONNECTED)
+        self.assertEqual(peer_state.failures, 1)
+        self.assertIs(peer_state.circuit, OPEN)
+        self.assertFalse(peer_state.is_reachable())
+        self.assertIsNone(peer_state.last_heard)
+
+    def test_handshake_timeout(self):
+        self.test_cnxn_success()
+        peer_state = self.p.peer_state
+
+        # the peer accepts our cnxn, then never answers the handshake
+        self.clock.advance(NoiseWrapper.handshake_timeout)
+        self.assertTrue(self.t.disconnecting)
+        self.wrapper.connectionLost(Failure(ConnectionDone()))
+        self.assertEqual(peer_state.state, DISCONNECTED)
+        self.assertEqual(peer_state.failures, 1)
+        self.assertEqual(self.peer.peer_tracker.dial_scheduler.active, 0)
+
+    def test_dial_slot_released_on_connect(self):
+        self._do_handshake()
+        self.assertEqual(self.peer.peer_tracker.dial_scheduler.active, 0)
+
+    def test_blacklist(self):
+        self.test_cnxn_success()
+        self.peer.add_to_blacklist(IPv4Address('TCP', '127.0.0.1', 12345))
+        self.assertTrue(self.t.disconnecting)
+
+        other = ContactInfo('127.0.0.1', 23456, self.peer.peer_key)
+        self.assertRaises(TheseusConnectionError, self.peer.get_peer, other)
+        self.assertIsNone(self.peer.peer_tracker.buildProtocol(other.get_addr()))
+
     @inlineCallbacks
     def test_info_updates_1(self):
         self.test_cnxn_success()
@@ -256,7 +559,8 @@ class SingleNodeTests(unittest.TestCase):
 
         self.log.info("==== handshake and introductory info query done")
 
-        _ = yield self.peer.node_manager.get_addrs()  # won't have data stores until we have node addrs
+        addrs = yield self.peer.node_manager.get_addrs()  # won't have data stores until we have node addrs
+        target = addrs[0].addr  # storage durations shrink with distance from our addrs
 
         self.t.clear()
         self.t2.clear()
@@ -264,13 +568,13 @@ class SingleNodeTests(unittest.TestCase):
         self.p2.response_handlers[b'put'] = lambda d: self.assertTrue(len(d) == 1 and type(d[b'd']) is int and d[b'd'] > 0)
         self.p2.response_handlers[b'get'] = lambda d: self.assertTrue(len(d) == 1 and d[b'data'] == [b'bearseatgoatsandgoatseatoats'])
 
-        self.p2.send_query(b'put', {b'addr': bytes(20), b'data': b'bearseatgoatsandgoatseatoats'})
+        self.p2.send_query(b'put', {b'addr': target, b'data': b'bearseatgoatsandgoatseatoats'})
         self.wrapper.dataReceived(self.t2.value())
         self.t2.clear()
         self.wrapper2.dataReceived(self.t.value())
         self.t.clear()
 
-        self.p2.send_query(b'get', {b'addr': bytes(20)})
+        self.p2.send_query(b'get', {b'addr': target})
         self.wrapper.dataReceived(self.t2.value())
         self.t2.clear()
         self.wrapper2.dataReceived(self.t.value())
@@ -285,3 +589,125 @@ class SingleNodeTests(unittest.TestCase):
 
 class MultiNodeTests(SingleNodeTests):
     num_nodes = 3
+
+
+class PeerStateTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.state = PeerState()
+        self.state._clock = self.clock
+        self.state.cnxn = Mock()
+        self.sent = []
+
+        def send_query(name, args):
+            d = Deferred()
+            self.sent.append(d)
+            return d
+        self.state.cnxn.send_query.side_effect = send_query
+
+    def test_default_timeout(self):
+        self.assertEqual(self.state.get_timeout(), PeerState.query_timeout)
+        self.assertIsNone(self.state.get_rtt_percentile(0.9))
+        self.assertEqual(self.state.get_hedge_delay(), PeerState.query_timeout / 2)
+
+    def test_rtt_tracking(self):
+        d = self.state.query("info", {})
+        self.clock.advance(0.25)
+        self.sent[0].callback({b'info': {}})
+        self.assertEqual(self.successResultOf(d), {b'info': {}})
+
+        self.assertEqual(self.state.srtt, 0.25)
+        self.assertEqual(self.state.rttvar, 0.125)
+        self.assertEqual(self.state.get_timeout(), 0.75)
+        self.assertEqual(self.state.get_hedge_delay(), 0.25)
+
+    def test_timeout_bounds(self):
+        for _ in range(20):
+            self.state.record_rtt(0.001)
+        self.assertEqual(self.state.get_timeout(), PeerState.min_timeout)
+
+        for _ in range(20):
+            self.state.record_rtt(100)
+        self.assertEqual(self.state.get_timeout(), PeerState.max_timeout)
+
+    def test_timeout_backoff(self):
+        d = self.state.query("info", {}, retries=2)
+        timeout = self.state.get_timeout()
+
+        self.clock.advance(timeout)
+        self.assertEqual(len(self.sent), 2)
+        self.clock.advance(timeout)
+        self.assertEqual(len(self.sent), 2)  # second attempt waits twice as long
+        self.clock.advance(timeout)
+        self.assertEqual(len(self.sent), 3)
+        self.clock.advance(4*timeout)
+        self.failureResultOf(d, QueryRetriesExceededError)
+
+
+class PeerTrackerTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self._clock = PeerState._clock
+        PeerState._clock = self.clock
+        PeerTracker._clock = self.clock
+
+        self.local_peer = Mock()
+        self.local_peer.routing_table = RoutingTable()
+        self.tracker = PeerTracker(self.local_peer)
+
+        self.contact = ContactInfo('127.0.0.1', 12345, KeyPair25519.from_public_bytes(b'z'*32))
+
+    def tearDown(self):
+        self.tracker.stop()
+        PeerState._clock = self._clock
+        PeerTracker._clock = self._clock
+
+    def test_demotion(self):
+        state = self.tracker.register_contact(self.contact)
+        for _ in range(state.circuit_threshold):
+            state.record_failure()
+
+        self.clock.advance(PeerTracker.demote_after)
+        self.clock.advance(PeerTracker.sweep_interval)
+        self.assertEqual(len(self.tracker.contact_to_state), 0)
+        self.assertEqual(len(self.tracker.addr_to_contact), 0)
+        self.assertIsInstance(self.tracker.records[('127.0.0.1', 12345)], PeerRecord)
+
+        # records still answer liveness checks and still claim their addr
+        self.assertTrue(self.tracker.is_dead(self.contact))
+        with self.assertRaises(DuplicateContactError):
+            self.tracker.register_contact(ContactInfo('127.0.0.1', 12345, KeyPair25519.from_public_bytes(b'y'*32)))
+
+        promoted = self.tracker.get(self.contact)
+        self.assertIsInstance(promoted, PeerState)
+        self.assertIsNot(promoted, state)
+        self.assertEqual(promoted.get_contact_info(), self.contact)
+        self.assertEqual(promoted.failures, state.circuit_threshold)
+        self.assertTrue(promoted.is_dead())
+        self.assertIs(self.tracker.register_contact(self.contact), promoted)
+        self.assertEqual(len(self.tracker.records), 0)
+
+    def test_last_heard(self):
+        state = self.tracker.register_contact(self.contact)
+        self.assertIsNone(self.tracker.get_last_heard(self.contact))
+        state._on_response({}, self.clock.seconds())
+        heard = self.clock.seconds()
+
+        self.clock.advance(PeerTracker.demote_after)
+        self.clock.advance(PeerTracker.sweep_interval)
+        self.assertEqual(self.tracker.get_last_heard(self.contact), heard)
+        self.assertEqual(len(self.tracker.contact_to_state), 0)  # reading it doesn't promote the record
+
+    def test_expiry(self):
+        self.tracker.register_contact(self.contact)
+        self.clock.pump([PeerTracker.sweep_interval] * (PeerTracker.expire_after // PeerTracker.sweep_interval + 1))
+        self.assertEqual(len(self.tracker.contact_to_state), 0)
+        self.assertEqual(len(self.tracker.records), 0)
+        self.assertIsNone(self.tracker.get(self.contact))
+
+    def test_routing_table_pins_records(self):
+        self.tracker.register_contact(self.contact)
+        self.local_peer.routing_table.insert(self.contact, NodeAddress(bytes(20), None))
+        self.clock.pump([PeerTracker.sweep_interval] * (PeerTracker.expire_after // PeerTracker.sweep_interval + 1))
+        self.assertEqual(len(self.tracker.contact_to_state), 0)
+        self.assertEqual(len(self.tracker.records), 1)
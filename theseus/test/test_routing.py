@@ -1,8 +1,9 @@
 from twisted.trial import unittest
+from twisted.internet.task import Clock
 
-from theseus.routing import RoutingTable
+from theseus.routing import RoutingEntry, RoutingTable, FlatRoutingTable
 
-from theseus.nodeaddr import NodeAddress
+from theseus.nodeaddr import NodeAddress, Preimage
 from theseus.contactinfo import ContactInfo
 
 from random import Random
@@ -11,15 +12,51 @@ from pprint import pprint
 from noise.functions import KeyPair25519
 
 
+class RoutingEntryTests(unittest.TestCase):
+    def test_value_equality(self):
+        wire = bytes(4) + b'\x7f\x00\x00\x01' + bytes(range(26)) + b'\x08\x00' + b'k'*32
+        first = RoutingEntry.from_bytes(wire, trusted=True).result
+        second = RoutingEntry.from_bytes(wire, trusted=True).result
+        self.assertIsNot(first.contact_info, second.contact_info)
+        self.assertEqual(first, second)
+        self.assertEqual(hash(first), hash(second))
+        self.assertEqual(len({first, second}), 1)
+        self.assertEqual(first.as_bytes(), wire)
+
+        other = RoutingEntry.from_bytes(wire[:-1] + b'K', trusted=True).result
+        self.assertNotEqual(first, other)
+
+    def test_parse_nodes(self):
+        wire = [bytes(4) + b'\x7f\x00\x00\x01' + bytes(6) + bytes([i])*20 + b'\x08\x00' + bytes([i])*32 for i in range(3)]
+        bad_port = bytes(4) + b'\x7f\x00\x00\x01' + bytes(26) + b'\x00\x10' + bytes(32)
+        entries = RoutingEntry.parse_nodes([wire[0], wire[1][:-1], bad_port, None, wire[2]])
+        self.assertEqual([entry.as_bytes() for entry in entries], [wire[0], wire[2]])
+        self.assertEqual(entries[0], RoutingEntry.from_bytes(wire[0], trusted=True).result)
+        self.assertFalse(entries[0].node_addr.verified)
+
+        self.assertEqual(RoutingEntry.parse(wire[1]).as_bytes(), wire[1])
+        self.assertRaises(ValueError, RoutingEntry.parse, bad_port)
+
+    def test_lazy_contact_key(self):
+        contact = ContactInfo('127.0.0.1', 2048, b'k'*32)
+        self.assertIsNone(contact._key)
+        self.assertEqual(contact.key.public_bytes, b'k'*32)
+        self.assertIs(contact.key, contact.key)
+        self.assertEqual(contact, ContactInfo('127.0.0.1', 2048, contact.key))
+        self.assertRaises(AttributeError, setattr, contact, 'extra', None)
+
+
 class RoutingTests(unittest.TestCase):
+    table_class = RoutingTable
+
     def setUp(self):
-        self.table = RoutingTable()
+        self.table = self.table_class()
         self.rng = Random(7**17-1)
 
     def _get_contacts(self, addr):
         # utility: generate fake contact info
         contact = ContactInfo('127.0.0.1', self.rng.randint(1025, 2**16-1), KeyPair25519.from_public_bytes(b'z'*32))
-        address = NodeAddress(addr, b'placeholder for preimage')
+        address = NodeAddress(addr, None)
         return contact, address
 
     def test_basic_inserts(self):
@@ -29,11 +66,27 @@ class RoutingTests(unittest.TestCase):
         for addr in good_addrs:
             self.assertTrue(self.table.insert(*self._get_contacts(addr)))
         self.assertFalse(self.table.insert(*self._get_contacts(b'\xFF'*20)))
-        self.assertEqual(good_addrs, [entry.node_addr.addr for entry in self.table.root.get_contents()])
+        self.assertEqual(good_addrs, [entry.node_addr.addr for entry in self.table.get_contents()])
+
+    def test_dead_entry_eviction(self):
+        dead = set()
+        self.table = self.table_class(is_dead=lambda contact: contact in dead)
+        entries = [self._get_contacts(bytes([i])*20) for i in range(self.table.k)]
+        for contact, address in entries:
+            self.assertTrue(self.table.insert(contact, address))
+
+        newcomer = self._get_contacts(b'\xFF'*20)
+        self.assertFalse(self.table.insert(*newcomer))
+
+        dead.add(entries[3][0])
+        self.assertTrue(self.table.insert(*newcomer))
+        contents = [entry.node_addr.addr for entry in self.table.get_contents()]
+        self.assertNotIn(entries[3][1].addr, contents)
+        self.assertIn(b'\xFF'*20, contents)
 
     def test_basic_splits(self):
         k = 8
-        self.table = RoutingTable([NodeAddress(b'\x00'*20, None), NodeAddress(b'\xFF' + b'\x00'*19, None)])
+        self.table = self.table_class([NodeAddress(b'\x00'*20, None), NodeAddress(b'\xFF' + b'\x00'*19, None)])
         self.table.k = k
 
         low_addrs = [bytes([i])*20 for i in range(k)]
@@ -51,12 +104,12 @@ class RoutingTests(unittest.TestCase):
         self.assertFalse(self.table.insert(*self._get_contacts(b'\x82'+bytes(19))))
         self.assertEqual(
                 low_addrs + med_addrs + high_addrs,
-                [entry.node_addr.addr for entry in self.table.root.get_contents()]
+                [entry.node_addr.addr for entry in self.table.get_contents()]
                 )
 
     def test_basic_queries(self):
         k = 8
-        self.table = RoutingTable([NodeAddress(b'\x00'*20, b'placeholder'), NodeAddress(b'\xFF' + b'\x00'*19, b'second placeholder')])
+        self.table = self.table_class([NodeAddress(b'\x00'*20, None), NodeAddress(b'\xFF' + b'\x00'*19, None)])
         self.table.k = k
 
         self.assertEqual(self.table.query(bytes(20)), [])
@@ -85,6 +138,26 @@ class RoutingTests(unittest.TestCase):
                 [entry.node_addr.addr for entry in self.table.query(b'\xF0\x00\x07' + bytes(17), lookup_size=k+1)]
                 )
 
+    def test_latency_tiebreak(self):
+        rtts = {}
+        self.table = self.table_class([NodeAddress(b'\xFF'*20, None)], get_rtt=lambda contact: rtts.get(contact))
+        entries = []
+        for i in range(1, 8):
+            contact, address = self._get_contacts(bytes([i])*20)
+            self.assertTrue(self.table.insert(contact, address))
+            entries.append(contact)
+
+        # entries 2-3 share a prefix length with the target, as do 4-7, so
+        # the last slots go to the measured, faster peers in that tier
+        rtts.update({entries[4]: 0.5, entries[6]: 0.1})
+        result = [entry.contact_info for entry in self.table.query(bytes(20), lookup_size=5)]
+        self.assertEqual(result, entries[:3] + [entries[4], entries[6]])
+
+        # without any RTTs, it's just the closest entries
+        rtts.clear()
+        result = [entry.contact_info for entry in self.table.query(bytes(20), lookup_size=5)]
+        self.assertEqual(result, entries[:5])
+
     def test_basic_reloads(self):
         k = 8
         self.table.reload()
@@ -95,16 +168,143 @@ class RoutingTests(unittest.TestCase):
 
     def test_complex_reloads(self):
         self.test_basic_queries()
-        contents = self.table.root.get_contents()
+        contents = self.table.get_contents()
 
         self.table.reload(self.table.local_addrs)
-        self.assertEqual(contents, self.table.root.get_contents())
+        self.assertEqual(contents, self.table.get_contents())
 
         self.table.reload(self.table.local_addrs + [NodeAddress(b'\x420'*10, None)])
-        self.assertEqual(contents, self.table.root.get_contents())
+        self.assertEqual(contents, self.table.get_contents())
 
         self.table.reload([self.table.local_addrs[0]])
         # we don't actually know exactly which nodes will be in here: some get
         # dropped because we're down to one node ID. which ones depends on the
         # ordering after they're shuffled with an algorithm backed by a CSPRNG.
-        self.assertEqual(len(self.table.root.get_contents()), 16)
+        self.assertEqual(len(self.table.get_contents()), 16)
+
+    def test_replacements(self):
+        self.test_basic_queries()
+        rejected = [b'\x81' + bytes([i])*19 for i in range(3)]
+        for addr in rejected:
+            self.assertFalse(self.table.insert(*self._get_contacts(addr)))
+        self.assertEqual(rejected, [entry.node_addr.addr for entry in self.table.get_replacements()])
+
+        # giving up the second local addr frees up room for the replacements
+        # (or they stay available as replacements, depending on where they land)
+        self.table.reload([self.table.local_addrs[0]])
+        entries = self.table.get_contents() + self.table.get_replacements()
+        self.assertEqual(len(entries), len(set(entries)))
+        self.assertEqual(len(self.table.get_contents()), 16)
+
+    def test_touch_and_remove(self):
+        clock = Clock()
+        self.table._clock = clock
+        for i in range(3):
+            self.table.insert(*self._get_contacts(bytes([i])*20))
+            clock.advance(1)
+        first, second, third = list(self.table)
+        self.assertEqual(self.table.get_stalest(clock.seconds()), first)
+        self.assertIsNone(self.table.get_stalest(first.last_seen - 1))
+
+        self.table.touch(first)
+        self.assertEqual(list(self.table), [second, third, first])
+        self.assertEqual(first.last_seen, clock.seconds())
+        self.assertEqual(self.table.get_stalest(clock.seconds()), second)
+
+        self.table.remove(second)
+        self.assertEqual(list(self.table), [third, first])
+
+    def _make_entry(self, i, ts):
+        # utility: fake contact info with a node addr that expires
+        contact, _ = self._get_contacts(bytes(20))
+        preimage = Preimage(NodeAddress._ts_int_to_bytes(ts), b'\x7f\x00\x00\x01', bytes(6))
+        return contact, NodeAddress(bytes([i])*20, preimage)
+
+    def test_expiry(self):
+        clock = Clock()
+        clock.advance(NodeAddress.timeout_window + 1)
+        self.table._clock = clock
+        make_entry = self._make_entry
+
+        self.assertFalse(self.table.insert(*make_entry(0, 0)))  # already expired
+        self.assertEqual(len(self.table.expiries), 0)
+
+        for i in range(self.table.k):
+            self.assertTrue(self.table.insert(*make_entry(i, int(clock.seconds()) + i*600)))
+        self.assertFalse(self.table.insert(*make_entry(0xFF, int(clock.seconds()) + 600)))
+        first, *rest = list(self.table)
+        replacement, = self.table.get_replacements()
+        self.assertEqual(len(self.table.expiries), self.table.k + 1)
+
+        # expired entries stop showing up in queries right away...
+        clock.advance(NodeAddress.timeout_window + 1)
+        self.assertNotIn(first, self.table.query(bytes(20)))
+
+        # ...and are removed once the wheel gets to them
+        clock.advance(self.table.expiries.resolution)
+        self.table.expire()
+        self.assertEqual(list(self.table), rest + [replacement])
+        self.assertEqual(len(self.table.expiries), self.table.k)
+
+    def test_expiries_follow_drops(self):
+        clock = Clock()
+        clock.advance(NodeAddress.timeout_window + 1)
+        dead = set()
+        self.table = self.table_class(is_dead=lambda contact: contact in dead)
+        self.table._clock = clock
+        now = int(clock.seconds())
+
+        entries = [self._make_entry(i, now) for i in range(self.table.k)]
+        for contact, address in entries:
+            self.assertTrue(self.table.insert(contact, address))
+        for i in range(self.table.k + 1):
+            self.assertFalse(self.table.insert(*self._make_entry(0x80 + i, now)))
+
+        # the oldest replacement was pushed out, and a dead entry gets evicted
+        dead.add(entries[0][0])
+        self.assertTrue(self.table.insert(*self._make_entry(0xFF, now)))
+
+        held = self.table.get_contents() + self.table.get_replacements()
+        self.assertEqual(len(held), 2*self.table.k)
+        self.assertEqual(len(self.table.expiries), len(held))
+        self.assertTrue(all(entry in self.table.expiries for entry in held))
+
+
+class FlatRoutingTests(RoutingTests):
+    table_class = FlatRoutingTable
+
+    def test_incremental_reload(self):
+        self.test_basic_queries()
+        low_bucket, *others = self.table.buckets
+        num_buckets = len(self.table.buckets)
+        contents = self.table.get_contents()
+
+        # dropping the 0xFF... addr merges the whole upper half into one bucket
+        # and leaves the buckets around the remaining addr alone
+        local_addr, dropped_addr = self.table.local_addrs
+        self.table.reload([local_addr])
+        self.assertIs(self.table.buckets[0], low_bucket)
+        self.assertEqual(self.table.buckets[-1].lower, 2**159)
+        self.assertLess(len(self.table.buckets), num_buckets)
+        self.assertEqual(len(self.table.buckets[-1].contents), self.table.k)
+        self.assertEqual(len(self.table.buckets[-1].replacements), self.table.k)
+
+        # getting it back lets the evicted entries back in
+        self.table.reload([local_addr, dropped_addr])
+        self.assertIs(self.table.buckets[0], low_bucket)
+        self.assertEqual(contents, self.table.get_contents())
+        self.assertEqual(self.table.get_replacements(), [])
+
+    def test_matches_tree(self):
+        local_addrs = [NodeAddress(bytes(self.rng.getrandbits(8) for _ in range(20)), None) for _ in range(3)]
+        tree, flat = RoutingTable(local_addrs), FlatRoutingTable(local_addrs)
+        for i in range(2000):
+            addr = bytes(self.rng.getrandbits(8) for _ in range(20))
+            contact = ContactInfo('127.0.0.1', 1025 + i, KeyPair25519.from_public_bytes(b'z'*32))
+            self.assertEqual(tree.insert(contact, NodeAddress(addr, None)), flat.insert(contact, NodeAddress(addr, None)))
+
+        self.assertEqual(tree.get_contents(), flat.get_contents())
+        targets = [bytes(self.rng.getrandbits(8) for _ in range(20)) for _ in range(50)]
+        for target in targets + [addr.addr for addr in local_addrs]:
+            for lookup_size in (1, 8, 20):
+                self.assertEqual(tree.query(target, lookup_size), flat.query(target, lookup_size))
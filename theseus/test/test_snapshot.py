@@ -0,0 +1,128 @@
+from twisted.trial import unittest
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import Clock
+
+from theseus.snapshot import RoutingSnapshot
+from theseus.routing import RoutingTable, FlatRoutingTable
+from theseus.contactinfo import ContactInfo
+from theseus.nodeaddr import NodeAddress, Preimage
+from theseus.hasher import hasher
+
+from noise.functions import KeyPair25519
+
+from socket import inet_aton
+from time import time
+from unittest.mock import Mock
+
+import os
+
+
+class RoutingSnapshotTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self._clocks = RoutingSnapshot._clock, RoutingTable._clock
+        RoutingSnapshot._clock = RoutingTable._clock = self.clock
+
+        self.local_peer = Mock()
+        self.local_peer.private_key = os.urandom(32)
+        self.local_peer.routing_table = FlatRoutingTable()
+        self.path = self.mktemp()
+        self.snapshot = RoutingSnapshot(self.local_peer, self.path)
+
+    def tearDown(self):
+        RoutingSnapshot._clock, RoutingTable._clock = self._clocks
+
+    def _make_addr(self, i, ts=None):
+        ts = int(time()) if ts is None else ts
+        preimage = Preimage(NodeAddress._ts_int_to_bytes(ts), inet_aton('127.0.0.1'), bytes(6))
+        return NodeAddress(bytes([i])*20, preimage, verified=False)
+
+    def _insert(self, i, addr=None):
+        contact = ContactInfo('127.0.0.1', 1024 + i, KeyPair25519.from_public_bytes(bytes([i])*32))
+        self.local_peer.routing_table.insert(contact, addr or self._make_addr(i))
+
+    def _restore(self):
+        saved = self.snapshot.load()
+        self.local_peer.routing_table = FlatRoutingTable()
+        self.snapshot.restore(saved.entries)
+        return saved
+
+    def test_round_trip(self):
+        for i in range(5):
+            self.clock.advance(1)
+            self._insert(i)
+        entries = list(self.local_peer.routing_table)
+        self.snapshot.save()
+
+        saved = self.snapshot.load()
+        self.assertEqual(saved.private_key, self.local_peer.private_key)
+        self.assertEqual([entry.as_bytes() for entry in saved.entries], [entry.as_bytes() for entry in entries])
+        self.assertEqual([entry.last_seen for entry in saved.entries], [1, 2, 3, 4, 5])
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), [os.path.basename(self.path)])
+
+    def test_failed_save(self):
+        self._insert(1)
+        self.snapshot.save()
+        with open(self.path, "rb") as f:
+            data = f.read()
+
+        def replace(src, dst):
+            raise OSError("disk full")
+        self.patch(os, "replace", replace)
+        self._insert(2)
+        self.snapshot.save()
+        self.assertEqual(len(self.flushLoggedErrors(OSError)), 1)
+
+        # the old snapshot is left alone, and the temp file is cleaned up
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), [os.path.basename(self.path)])
+
+    def test_missing_or_corrupt(self):
+        self.assertIsNone(self.snapshot.load())
+
+        self._insert(1)
+        self.snapshot.save()
+        with open(self.path, "rb") as f:
+            data = f.read()
+
+        for bad in (data[:-1], b'XXXX' + data[4:], b''):
+            with open(self.path, "wb") as f:
+                f.write(bad)
+            self.assertIsNone(self.snapshot.load())
+
+    def test_expired_entries_skipped(self):
+        self._insert(1)
+        self._insert(2, self._make_addr(2, ts=1))
+        self.snapshot.save()
+
+        saved = self.snapshot.load()
+        self.assertEqual([entry.node_addr.addr for entry in saved.entries], [bytes([1])*20])
+
+    @inlineCallbacks
+    def test_verification(self):
+        good = yield NodeAddress.new('127.0.0.1')
+        good.verified = False
+        self._insert(1)  # addr doesn't match its preimage
+        self._insert(2, good)
+        self.snapshot.save()
+
+        saved = self._restore()
+        self.assertEqual(len(self.local_peer.routing_table.get_contents()), 2)
+        self.assertEqual(len(self.snapshot.restored), 2)
+
+        self.snapshot.verify()
+        _ = yield hasher.exhaust()
+
+        contents = self.local_peer.routing_table.get_contents()
+        self.assertEqual([entry.node_addr.addr for entry in contents], [good.addr])
+        self.assertEqual(self.snapshot.restored, contents)
+        self.assertTrue(saved.entries[1].node_addr.verified)
+
+    def test_periodic_saves(self):
+        self.snapshot.start()
+        self.addCleanup(self.snapshot.stop)
+        self.assertFalse(os.path.exists(self.path))
+        self.clock.advance(RoutingSnapshot.interval)
+        self.assertTrue(os.path.exists(self.path))
@@ -1,10 +1,11 @@
 from twisted.trial import unittest
-from twisted.internet.defer import Deferred
+from twisted.internet.defer import Deferred, succeed
 
 from theseus.statstracker import StatsTracker
 from theseus.routing import RoutingEntry
 from theseus.nodeaddr import NodeAddress
 from theseus.constants import k
+from theseus.errors import NotEnoughLookupsError
 
 from unittest.mock import Mock
 
@@ -21,7 +22,7 @@ class StatsTrackerTests(unittest.TestCase):
     def test_size_estimation(self):
         for i in range(self.s.min_sample_size):
             target = bytes([i] + [0]*19)
-            addrs = [NodeAddress(bytes([i, j+1] + [0]*18), b'preimage') for j in range(k)]
+            addrs = [NodeAddress(bytes([i, j+1] + [0]*18), None) for j in range(k)]
             entries = [RoutingEntry(contact_info=None, node_addr=addr) for addr in addrs]
 
             d = Deferred()
@@ -30,3 +31,31 @@ class StatsTrackerTests(unittest.TestCase):
 
         estimate = self.s.get_size()
         self.assertEqual(estimate, 65536.0)
+
+    def test_lookup_params(self):
+        self.assertEqual(self.s.get_lookup_params(), {})  # no size estimate yet
+
+        self.s.get_size = lambda: 40
+        self.assertEqual(self.s.get_lookup_params(), {"alpha": 3, "shortlist_size": 4*k})
+        self.s.get_size = lambda: 20
+        self.assertEqual(self.s.get_lookup_params()["shortlist_size"], 20)
+
+        self.s.get_size = lambda: 50000
+        self.assertEqual(self.s.get_lookup_params()["alpha"], 4)
+
+        # a handful of queries isn't enough to go on
+        self.s.record_queries(4, 2)
+        self.assertEqual(self.s.get_loss_rate(), 0)
+        self.s.record_queries(16, 3)
+        self.assertEqual(self.s.get_loss_rate(), 0.25)
+        self.assertEqual(self.s.get_lookup_params(), {"alpha": 6, "shortlist_size": 43})
+
+    def test_degenerate_samples(self):
+        self.s.register_lookup(succeed([]), bytes(20))
+        self.assertEqual(len(self.s.measurements), 0)
+
+        # identical targets and results leave nothing to estimate from
+        for _ in range(self.s.min_sample_size):
+            self.s.measurements.append((self.s._clock(), [0]*k))
+        self.assertRaises(NotEnoughLookupsError, self.s.get_size)
+        self.assertEqual(self.s.get_lookup_params(), {})
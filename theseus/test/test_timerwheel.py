@@ -0,0 +1,46 @@
+from twisted.trial import unittest
+
+from theseus.timerwheel import TimerWheel
+
+
+class TimerWheelTests(unittest.TestCase):
+    def setUp(self):
+        self.wheel = TimerWheel(resolution=10)
+
+    def test_expiry(self):
+        for i in range(10):
+            self.wheel.add(i, 100 + i*5)
+        self.assertEqual(len(self.wheel), 10)
+
+        self.assertEqual(self.wheel.pop_expired(109), [])
+        self.assertEqual(self.wheel.pop_expired(110), [0, 1])
+        self.assertEqual(self.wheel.pop_expired(110), [])
+        self.assertEqual(self.wheel.pop_expired(130), [2, 3, 4, 5])
+        self.assertNotIn(3, self.wheel)
+        self.assertIn(6, self.wheel)
+        self.assertEqual(len(self.wheel), 4)
+
+    def test_discard_and_reschedule(self):
+        self.wheel.add('a', 100)
+        self.wheel.add('b', 100)
+        self.wheel.add('c', 100)
+        self.wheel.discard('b')
+        self.wheel.discard('nonexistent')
+        self.wheel.add('c', 500)
+        self.assertEqual(self.wheel.pop_expired(200), ['a'])
+        self.assertEqual(self.wheel.pop_expired(510), ['c'])
+        self.assertEqual(self.wheel.slots, {})
+
+    def test_long_gap(self):
+        # the first drain after a jump from t=0 visits only occupied slots
+        self.wheel.add('x', 10**9)
+        self.wheel.add('y', 10**9 + 10**6)
+        self.assertEqual(self.wheel.pop_expired(10**9 + 10), ['x'])
+        self.assertEqual(self.wheel.next_slot, 10**8 + 1)
+
+    def test_late_add(self):
+        # items added for slots that have already been drained go in the next slot
+        self.wheel.pop_expired(100)
+        self.wheel.add('late', 50)
+        self.assertEqual(self.wheel.pop_expired(100), [])
+        self.assertEqual(self.wheel.pop_expired(110), ['late'])
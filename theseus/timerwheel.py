@@ -0,0 +1,61 @@
+class TimerWheel:
+    """
+    Tracks expiry times for a set of hashable items using fixed-width time
+    slots, so that any number of expiries can be handled with a single
+    periodic timer rather than one delayed call per item.
+
+    Adding or discarding an item is O(1), and each item costs O(1) to expire.
+    Items may be reported up to `resolution` seconds after their expiry time.
+    """
+
+    def __init__(self, resolution=60):
+        self.resolution = resolution
+        self.slots = {}  # slot number -> {item: None} (i.e. an ordered set)
+        self.slot_of = {}  # item -> slot number
+        self.next_slot = 0  # every slot below this one has been drained
+
+    def __len__(self):
+        return len(self.slot_of)
+
+    def __contains__(self, item):
+        return item in self.slot_of
+
+    def add(self, item, expires_at):
+        """
+        Schedules an item to expire at the given time, replacing any expiry
+        time it already had.
+        """
+        self.discard(item)
+        slot = max(int(expires_at // self.resolution), self.next_slot)
+        self.slots.setdefault(slot, {})[item] = None
+        self.slot_of[item] = slot
+
+    def discard(self, item):
+        slot = self.slot_of.pop(item, None)
+        if slot is not None:
+            items = self.slots[slot]
+            del items[item]
+            if not items:
+                del self.slots[slot]
+
+    def pop_expired(self, now):
+        """
+        Removes and returns every item whose slot has passed.
+        """
+        due = int(now // self.resolution)
+        if due <= self.next_slot:
+            return []
+
+        if due - self.next_slot > len(self.slots):
+            # after a long gap it's cheaper to visit only the occupied slots
+            slots = sorted(slot for slot in self.slots if slot < due)
+        else:
+            slots = range(self.next_slot, due)
+        self.next_slot = due
+
+        expired = []
+        for slot in slots:
+            for item in self.slots.pop(slot, ()):
+                del self.slot_of[item]
+                expired.append(item)
+        return expired